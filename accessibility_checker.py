@@ -1,227 +1,337 @@
-from playwright.sync_api import sync_playwright
-from weasyprint import HTML, CSS
-from datetime import datetime
-import tempfile
+from browser_pool import get_browser_pool
+from scan_cache import get_scan_cache, make_key, hash_content
+from page_loading import DEFAULT_LOAD_OPTIONS, cache_options, block_requests, navigate
+from tracing import span
+from images import compress, image_options, screenshot_options
+# Report rendering lives in report_render; re-exported for existing callers
+from report_render import generate_report_html, write_report_pdf
+import logging
+import time
 import os
-import json
 import base64
 
-def check_accessibility(url):
-    with sync_playwright() as p:
-        # Launch browser with optimized settings
-        browser = p.chromium.launch(
-            headless=True,
-        )
-        # Create a new context with optimized settings
-        context = browser.new_context(
-            viewport={'width': 1280, 'height': 800},
-            java_script_enabled=True,
-            ignore_https_errors=True
+logger = logging.getLogger(__name__)
+
+# Screenshot modes:
+#   full_page - one full-page capture per violation (default)
+#   element   - one capture per violation, clipped to its nodes
+#   combined  - a single full-page capture labelled with every violation
+SCREENSHOT_MODES = ('full_page', 'element', 'combined')
+DEFAULT_SCREENSHOT_MODE = os.getenv('SCREENSHOT_MODE', 'full_page')
+
+# Padding in pixels around element-clipped screenshots
+CLIP_PADDING = 20
+
+# axe.run that rejects after a number of milliseconds, so a stuck rule frees the browser
+AXE_RUN_WITH_TIMEOUT_JS = '''(ms) => Promise.race([
+    axe.run(document.body),
+    new Promise((resolve, reject) => setTimeout(() => reject(new Error(`axe.run timed out after ${ms}ms`)), ms))
+])'''
+
+# Installed once per page; annotates or clears every node of a violation in a single call
+ANNOTATE_HELPER_JS = '''
+() => {
+    if (window.__axeAnnotate) {
+        return;
+    }
+    window.__axeAnnotate = (items) => {
+        let left = Infinity, top = Infinity, right = -Infinity, bottom = -Infinity;
+        for (const item of items) {
+            let elements = [];
+            try {
+                elements = document.querySelectorAll(item.selector);
+            } catch (e) {
+                continue;
+            }
+            elements.forEach(element => {
+                // Add styles
+                element.style.outline = "4px solid red";
+                element.style.outlineOffset = "2px";
+                element.style.position = "relative";
+                element.setAttribute('data-axe-annotated', '');
+
+                // Add label
+                const label = document.createElement('div');
+                label.innerText = item.label;
+                label.className = 'axe-violation-label';
+                label.style.position = 'absolute';
+                label.style.top = '0';
+                label.style.left = '0';
+                label.style.transform = 'translate(-100%, -100%)';
+                label.style.backgroundColor = 'black';
+                label.style.color = 'white';
+                label.style.zIndex = '9999';
+                label.style.padding = '2px 4px';
+                label.style.fontSize = '12px';
+                label.style.borderRadius = '4px';
+                element.appendChild(label);
+
+                // Track the bounding box of everything annotated, in page coordinates
+                const rect = element.getBoundingClientRect();
+                if (rect.width || rect.height) {
+                    left = Math.min(left, rect.left + window.scrollX);
+                    top = Math.min(top, rect.top + window.scrollY);
+                    right = Math.max(right, rect.right + window.scrollX);
+                    bottom = Math.max(bottom, rect.bottom + window.scrollY);
+                }
+            });
+        }
+        if (left === Infinity) {
+            return null;
+        }
+        return {
+            x: left,
+            y: top,
+            width: right - left,
+            height: bottom - top,
+            pageWidth: document.documentElement.scrollWidth,
+            pageHeight: document.documentElement.scrollHeight
+        };
+    };
+    window.__axeClearAnnotations = () => {
+        document.querySelectorAll('.axe-violation-label').forEach(label => label.remove());
+        document.querySelectorAll('[data-axe-annotated]').forEach(element => {
+            element.style.outline = '';
+            element.style.outlineOffset = '';
+            element.removeAttribute('data-axe-annotated');
+        });
+    };
+}
+'''
+
+def check_accessibility(url, pool=None, screenshot_mode=None, content_hash=None):
+    """
+    Scan a URL with axe-core and render a PDF report
+    Args:
+        url: URL of the page to check
+        pool: Browser pool to lease a browser from (optional)
+        screenshot_mode: One of SCREENSHOT_MODES (optional)
+        content_hash: Hash identifying the page content, e.g. a git blob SHA (optional)
+    Returns: Path to the generated PDF
+    """
+    scan = run_scan(url, pool, screenshot_mode, content_hash)
+    started = time.perf_counter()
+    report_path = write_report_pdf(url, scan['results'], scan['screenshots'], scan['overview'])
+    logger.info("Rendered report for %s in %.2fs", url, time.perf_counter() - started)
+    return report_path
+
+def run_scan(url, pool=None, screenshot_mode=None, content_hash=None, skip_if_hash=None, timeout=None):
+    """
+    Scan a URL with axe-core without rendering a report
+    Args:
+        url: URL of the page to check
+        pool: Browser pool to lease a browser from (optional)
+        screenshot_mode: One of SCREENSHOT_MODES (optional)
+        content_hash: Hash identifying the page content, e.g. a git blob SHA (optional)
+        skip_if_hash: DOM hash of an earlier scan; when the page still hashes to it, axe is
+                      not run and the result has 'unchanged' set (optional)
+        timeout: Seconds allowed for waiting for a browser and scanning; the scan itself
+                 stops at the deadline so it does not keep holding the browser (optional)
+    Returns: Dict with the axe results, per-violation screenshots and the combined overview
+    Raises: TimeoutError when the timeout expires
+    """
+    started = time.perf_counter()
+    screenshot_mode = screenshot_mode or DEFAULT_SCREENSHOT_MODE
+    cache = get_scan_cache()
+
+    # With a known content hash the cache can be checked before leasing a browser
+    cached = None
+    if content_hash:
+        cached = cache.get(make_key(content_hash, scan_options(screenshot_mode)))
+        if cached and cached['screenshots'] is not None:
+            logger.info("Cache hit for %s", url)
+            return dict(cached, url=url, cached=True)
+
+    pool = pool or get_browser_pool()
+    with span('scan'):
+        scan = pool.run(scan_page, url, screenshot_mode, content_hash, cached, skip_if_hash=skip_if_hash,
+                        deadline=time.monotonic() + timeout if timeout else None, timeout=timeout)
+    if scan.get('unchanged'):
+        logger.info("%s is unchanged", url)
+    elif scan['cached']:
+        logger.info("Cache hit for %s", url)
+    else:
+        cache.put(scan['cache_key'], scan['results'], scan['screenshots'], scan['overview'])
+        logger.info(
+            "Checked %s in %.2fs (%s screenshots)",
+            url, time.perf_counter() - started, screenshot_mode
         )
-        page = context.new_page()
-        
-        # Navigate to the URL
-        page.goto(url)
-        
-        # Get the path to axe.min.js
+    return scan
+
+def scan_options(screenshot_mode, load=None):
+    """Run options that are part of the cache key"""
+    return {
+        'context': 'body',
+        'screenshot_mode': screenshot_mode,
+        'load': cache_options(load or DEFAULT_LOAD_OPTIONS),
+        'image': image_options()
+    }
+
+_axe_script = None
+
+def load_axe_script():
+    """Read axe-core from the local axe.min.js, once per process"""
+    global _axe_script
+    if _axe_script is None:
         current_dir = os.path.dirname(os.path.abspath(__file__))
         axe_path = os.path.join(current_dir, 'axe.min.js')
-        
-        # Inject axe-core from local file
         with open(axe_path, 'r') as f:
-            axe_script = f.read()
-            page.evaluate(axe_script)
-        
+            _axe_script = f.read()
+    return _axe_script
+
+def scan_page(context, url, screenshot_mode=None, content_hash=None, cached=None, load=None, skip_if_hash=None,
+              deadline=None):
+    """
+    Run axe-core against url inside a leased browser context
+    Args:
+        context: Leased Playwright browser context
+        url: URL of the page to check
+        screenshot_mode: One of SCREENSHOT_MODES (optional)
+        content_hash: Hash identifying the page content; the DOM is hashed when omitted
+        cached: Cache entry already looked up by the caller (optional)
+        load: Load options from page_loading.load_options (optional)
+        skip_if_hash: Stop after hashing the DOM when it hashes to this value (optional)
+        deadline: time.monotonic() value by which axe and screenshots must finish (optional)
+    Returns: Dict with the axe results, screenshots, combined overview, cache key, DOM hash
+             and phase timings
+    """
+    screenshot_mode = screenshot_mode or DEFAULT_SCREENSHOT_MODE
+    if screenshot_mode not in SCREENSHOT_MODES:
+        raise ValueError(f"Unknown screenshot mode: {screenshot_mode}")
+    load = load or DEFAULT_LOAD_OPTIONS
+    timings = {}
+
+    # axe-core is evaluated from the in-memory copy as each document is created
+    context.add_init_script(script=load_axe_script())
+    block_requests(context, url, load)
+    page = context.new_page()
+    if deadline is not None:
+        # Bounds screenshots and other waits; axe is bounded separately below
+        page.set_default_timeout(_remaining_ms(deadline))
+
+    # Navigate to the URL
+    with span('navigate') as phase:
+        navigate(page, url, load)
+    timings['navigate'] = phase.seconds
+
+    dom_hash = content_hash or hash_content(page.content())
+    cache_key = make_key(dom_hash, scan_options(screenshot_mode, load))
+    scan = {'url': url, 'cache_key': cache_key, 'content_hash': dom_hash, 'cached': False, 'timings': timings}
+    if skip_if_hash and dom_hash == skip_if_hash:
+        page.close()
+        scan.update(results=None, screenshots=[], overview=None, unchanged=True)
+        return scan
+
+    if cached is None and not content_hash:
+        cached = get_scan_cache().get(cache_key)
+
+    if cached and cached['screenshots'] is not None:
+        page.close()
+        scan.update(results=cached['results'], screenshots=cached['screenshots'], overview=cached['overview'], cached=True)
+        return scan
+
+    if cached:
+        # Results are cached, only the screenshots are needed
+        results = cached['results']
+    else:
+        # Pages that replace window.axe or block init scripts get a fresh copy
+        with span('inject') as phase:
+            if not page.evaluate('() => typeof window.axe !== "undefined" && typeof window.axe.run === "function"'):
+                page.evaluate(load_axe_script())
+        timings['inject'] = phase.seconds
+
         # Run accessibility check
-        results = page.evaluate('''() => {
-            return axe.run(document.body);
-        }''')
-        
-        # Take screenshots of issues
-        screenshots = []
-        for violation in results.get('violations', []):
-            for index, node in enumerate(violation.get('nodes', [])):
-                for target in node.get('target', []):
-                    target_selector = json.dumps(target)  # safely encode string
-                    label_text = json.dumps(str(index + 1))   # safely encode string
-                    
-                    page.evaluate(f'''
-                    (() => {{
-                        const elements = document.querySelectorAll({target_selector});
-                        elements.forEach(element => {{
-                            // Add styles
-                            element.style.outline = "4px solid red";
-                            element.style.outlineOffset = "2px";
-                            element.style.position = "relative";
-
-                            // Add label
-                            const label = document.createElement('div');
-                            label.innerText = {label_text};
-                            label.className = 'axe-violation-label';
-                            label.style.position = 'absolute';
-                            label.style.top = '0';
-                            label.style.left = '0';
-                            label.style.transform = 'translate(-100%, -100%)'; 
-                            label.style.backgroundColor = 'black';
-                            label.style.color = 'white';
-                            label.style.zIndex = '9999';
-                            label.style.padding = '2px 4px';
-                            label.style.fontSize = '12px';
-                            label.style.borderRadius = '4px';
-                            element.appendChild(label);
-                        }});
-                    }})();
-                    ''')
-
-            # Take screenshot
-            screenshot_bytes = page.screenshot(full_page=True)
-            screenshot_base64 = base64.b64encode(screenshot_bytes).decode('utf-8')
-            screenshots.append({
-                'data': screenshot_base64,
-                'description': violation.get('description', ''),
-                'impact': violation.get('impact', '')
-            })
+        with span('axe') as phase:
+            if deadline is None:
+                results = page.evaluate('''() => {
+                    return axe.run(document.body);
+                }''')
+            else:
+                results = page.evaluate(AXE_RUN_WITH_TIMEOUT_JS, _remaining_ms(deadline))
+        timings['axe'] = phase.seconds
+
+    with span('screenshots') as phase:
+        screenshots, overview = take_screenshots(page, results.get('violations', []), screenshot_mode)
+    timings['screenshots'] = phase.seconds
+
+    page.close()
+    scan.update(results=results, screenshots=screenshots, overview=overview)
+    return scan
+
+def _remaining_ms(deadline):
+    if time.monotonic() >= deadline:
+        raise TimeoutError("Scan timed out")
+    return max(int((deadline - time.monotonic()) * 1000), 1)
+
+def annotation_items(violation, label=None):
+    """Selector and label for every node of a violation"""
+    items = []
+    for index, node in enumerate(violation.get('nodes', [])):
+        for target in node.get('target', []):
+            if isinstance(target, str):
+                items.append({
+                    'selector': target,
+                    'label': label if label is not None else str(index + 1)
+                })
+    return items
+
+def take_screenshots(page, violations, screenshot_mode):
+    """
+    Highlight violations and capture them according to screenshot_mode
+    Returns: Per-violation screenshots and the combined overview (or None)
+    """
+    page.evaluate(ANNOTATE_HELPER_JS)
+
+    if screenshot_mode == 'combined':
+        items = []
+        for i, violation in enumerate(violations):
+            items.extend(annotation_items(violation, label=str(i + 1)))
+        if not items:
+            return [], None
+        page.evaluate('(items) => window.__axeAnnotate(items)', items)
+        overview = encode_screenshot(page.screenshot(**screenshot_options(full_page=True)))
+        page.evaluate('() => window.__axeClearAnnotations()')
+        return [], overview
+
+    screenshots = []
+    captures = {}
+    for violation in violations:
+        items = annotation_items(violation)
+        # Violations on the same elements look identical, so their capture is reused
+        capture_key = tuple(item['selector'] for item in items)
+        if capture_key not in captures:
+            bounds = page.evaluate('(items) => window.__axeAnnotate(items)', items)
+
+            if screenshot_mode == 'element':
+                clip = clip_rect(bounds)
+                screenshot_bytes = page.screenshot(**screenshot_options(full_page=True, clip=clip)) if clip else None
+            else:
+                screenshot_bytes = page.screenshot(**screenshot_options(full_page=True))
+            captures[capture_key] = encode_screenshot(screenshot_bytes) if screenshot_bytes else None
 
             # Cleanup: remove outlines and labels
-            for node in violation.get('nodes', []):
-                for target in node.get('target', []):
-                    target_selector = json.dumps(target)
-                    page.evaluate(f'''
-                    (() => {{
-                        const elements = document.querySelectorAll({target_selector});
-                        elements.forEach(element => {{
-                            // Remove outline styles
-                            element.style.outline = '';
-                            element.style.outlineOffset = '';
-
-                            // Remove the label
-                            const label = element.querySelector('.axe-violation-label');
-                            if (label) {{
-                                element.removeChild(label);
-                            }}
-                        }});
-                    }})();
-                    ''')
-
-        browser.close()
-        
-        # Generate PDF report
-        report_html = generate_report_html(url, results, screenshots)
-        report_path = os.path.join(tempfile.gettempdir(), f'report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.pdf')
-        
-        HTML(string=report_html).write_pdf(report_path)
-        
-        return report_path
-
-def generate_report_html(url, results, screenshots):
-    violations = results.get('violations', [])
-    return f'''
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <style>
-            body {{
-                font-family: "Arial", sans-serif;
-                margin: 0;
-                padding: 0;
-            }}
-
-            h1, h2, p {{
-                width: 100%;
-                white-space: nowrap;
-            }}
-
-            .title-page {{
-                height: 100vh;
-                width: 100vw;
-                display: flex;
-                flex-direction: column;
-                justify-content: center;
-                align-items: center;
-                text-align: center;
-                page-break-after: always;
-                position: relative;
-            }}
-
-            .title-page h1 {{
-                font-size: 3em;
-                margin-bottom: 0.5em;
-            }}
-
-            .title-page h2 {{
-                font-size: 1.5em;
-                color: #555;
-                margin: 0.2em 0;
-            }}
-
-            .title-page p {{
-                font-size: 1.2em;
-                color: #777;
-                margin: 0.3em 0;
-            }}
-
-            .issue {{
-                page-break-before: always;
-                padding: 1cm;
-                box-sizing: border-box;
-                border: 2px solid black;
-                border-radius: 10px;
-            }}
-
-            .issue h3 {{
-                font-size: 1.6em;
-                margin-top: 0;
-                color: #333;
-            }}
-
-            .issue p {{
-                font-size: 1em;
-                margin: 0.3em 0;
-                color: #444;
-            }}
-
-            .screenshot-container {{
-                margin-top: 1em;
-                text-align: center;
-            }}
-
-            .screenshot {{
-                max-width: 100%;
-                max-height: 18cm;
-                border: 1px solid #ccc;
-                object-fit: contain;
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="title-page">
-            <h1>Accessibility Report</h1>
-            <h2>{url}</h2>
-            <p>Generated: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}</p>
-            <h2>Issues Found: {len(violations)}</h2>
-        </div>
-        {generate_issues_html(violations, screenshots)}
-    </body>
-    </html>
-    '''
-
-def generate_issues_html(violations, screenshots):
-    html = ''
-    for i, violation in enumerate(violations):
-        screenshot_html = ''
-        if i < len(screenshots) and screenshots[i]:
-            screenshot_html = f'''
-                <div class="screenshot-container">
-                    <img class="screenshot" src="data:image/png;base64,{screenshots[i]["data"]}" alt="Issue Screenshot">
-                </div>
-            '''
-        html += f'''
-        <div class="issue">
-            <h3>{violation.get('description', 'Unknown Issue')}</h3>
-            <p><strong>Impact:</strong> {violation.get('impact', 'Unknown')}</p>
-            <p><strong>Help:</strong> {violation.get('help', 'No help available')}</p>
-            {screenshot_html}
-        </div>
-        '''
-    return html
\ No newline at end of file
+            page.evaluate('() => window.__axeClearAnnotations()')
+
+        screenshots.append({
+            'data': captures[capture_key],
+            'description': violation.get('description', ''),
+            'impact': violation.get('impact', '')
+        } if captures[capture_key] else None)
+
+    return screenshots, None
+
+def clip_rect(bounds):
+    """Pad the annotated region and keep it inside the page"""
+    if not bounds:
+        return None
+    x = max(bounds['x'] - CLIP_PADDING, 0)
+    y = max(bounds['y'] - CLIP_PADDING, 0)
+    width = min(bounds['x'] + bounds['width'] + CLIP_PADDING, bounds['pageWidth']) - x
+    height = min(bounds['y'] + bounds['height'] + CLIP_PADDING, bounds['pageHeight']) - y
+    if width <= 0 or height <= 0:
+        return None
+    return {'x': x, 'y': y, 'width': width, 'height': height}
+
+def encode_screenshot(screenshot_bytes):
+    """Compress a capture to the configured format and base64 encode it"""
+    return base64.b64encode(compress(screenshot_bytes)).decode('utf-8')
@@ -1,12 +1,25 @@
-from flask import Flask, render_template, request, send_file, jsonify, session, redirect, url_for
-from datetime import datetime
-from accessibility_checker import check_accessibility
-from git_comparator import compare_commits
-from database import Database
+from flask import Flask, render_template, request, jsonify, session, redirect, url_for, Response, stream_with_context, g
+from datetime import datetime, timedelta
+from accessibility_checker import write_report_pdf, generate_report_html
+from report_render import submit_report_pdf
+from render_pool import RENDER_TIMEOUT, get_render_pool, RenderQueueFull
+from async_checker import iter_check_many
+from sitemap import fetch_sitemap_urls
+from browser_pool import get_browser_pool
+from scan_cache import get_scan_cache
+from git_comparator import compare_commits, SCAN_SCOPES
+from database import Database, ScreenshotLoader, report_cursor
 from models import User
+import mongo
+import metrics
+import images
+from monitor import MonitorStore, MonitorScheduler, MonitorLimitExceeded, serialize_monitor, serialize_run
+from jobs import JobManager, InMemoryJobStore, MongoJobStore, JobLimitExceeded, JobQueueFull, FINISHED_STATES, serialize_job
+import json
+import time
+import cProfile
 import tempfile
-from bson import ObjectId
-import io
+from pymongo.errors import DuplicateKeyError
 from functools import wraps
 import os
 
@@ -19,6 +32,58 @@ app.secret_key = os.getenv('SECRET_KEY', 'your-secret-key-here')  # Change this
 db = Database()
 user_model = User()
 
+# Scan jobs run off the request thread; use the Mongo store when running several nodes
+job_store = MongoJobStore(db.db) if os.getenv('SCAN_JOB_STORE') == 'mongo' else InMemoryJobStore()
+job_manager = JobManager(job_store)
+
+# Monitored URLs are re-audited in the background; leases keep several nodes from running one twice
+monitor_store = MonitorStore(db.db)
+if os.getenv('MONITOR_SCHEDULER', 'true').lower() in ('1', 'true', 'yes'):
+    MonitorScheduler(monitor_store, db).start()
+
+BATCH_MAX_URLS = int(os.getenv('BATCH_MAX_URLS', 100))
+BATCH_MAX_CONCURRENCY = int(os.getenv('BATCH_MAX_CONCURRENCY', 10))
+REPORTS_PAGE_SIZE = int(os.getenv('REPORTS_PAGE_SIZE', 20))
+CRAWL_MAX_PAGES_LIMIT = int(os.getenv('CRAWL_MAX_PAGES_LIMIT', 500))
+HISTORY_MAX_DAYS = int(os.getenv('HISTORY_MAX_DAYS', 365))
+
+# Report types listed on /reports, with their labels
+REPORT_TYPES = {'accessibility_report': 'Page scan', 'crawl_report': 'Site crawl', 'monitor_report': 'Monitor'}
+
+# Requests sent with "X-Profile: 1" are profiled into this directory; unset disables profiling
+PROFILE_DIR = os.getenv('PROFILE_DIR')
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+# Render git comparison reports in the render pool before responding, instead of on first download
+GIT_PRERENDER_REPORTS = os.getenv('GIT_PRERENDER_REPORTS', 'true').lower() in ('1', 'true', 'yes')
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    if PROFILE_DIR and request.headers.get('X-Profile') == '1':
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def record_request(response):
+    profiler = g.pop('profiler', None)
+    if profiler is not None:
+        # Streamed responses are only profiled up to the point they start streaming
+        profiler.disable()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profile_path = os.path.join(PROFILE_DIR, f'{request.endpoint or "unknown"}-{datetime.now().strftime("%Y%m%d-%H%M%S-%f")}.prof')
+        profiler.dump_stats(profile_path)
+        response.headers['X-Profile-File'] = os.path.basename(profile_path)
+
+    started = g.pop('request_started', None)
+    if started is not None:
+        metrics.HTTP_REQUEST_SECONDS.observe(
+            time.perf_counter() - started,
+            endpoint=request.endpoint or 'unknown',
+            method=request.method,
+            status=response.status_code
+        )
+    return response
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -79,25 +144,185 @@ def dashboard():
 @app.route('/reports')
 @login_required
 def view_reports():
-    reports = db.list_reports(session['user_id'])
-    # Sort reports by timestamp, most recent first
-    reports.sort(key=lambda x: x['timestamp'], reverse=True)
-    return render_template('reports.html', reports=reports)
+    limit = max(1, min(request.args.get('limit', REPORTS_PAGE_SIZE, type=int), 100))
+    report_type = request.args.get('type')
+    if report_type and report_type not in REPORT_TYPES:
+        return jsonify({'error': f"Unknown report type: {report_type}"}), 400
+    filters = {
+        'url': request.args.get('url') or None,
+        'since': parse_date(request.args.get('from')),
+        'until': parse_date(request.args.get('to'), end_of_day=True),
+        'report_type': report_type or list(REPORT_TYPES)
+    }
+
+    try:
+        # Fetch one extra report to know whether there is another page
+        reports = db.list_reports(session['user_id'], limit=limit + 1, before=request.args.get('before'), **filters)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    next_cursor = None
+    if len(reports) > limit:
+        reports = reports[:limit]
+        next_cursor = report_cursor(reports[-1])
+
+    return render_template(
+        'reports.html',
+        reports=reports,
+        next_cursor=next_cursor,
+        limit=limit,
+        report_types=REPORT_TYPES,
+        filters={key: request.args.get(key, '') for key in ('url', 'type', 'from', 'to')}
+    )
+
+@app.route('/history')
+@login_required
+def history():
+    # Browsers get the page, which fetches the same URL for its data
+    if request.accept_mimetypes.best_match(['application/json', 'text/html']) == 'text/html':
+        return render_template('history.html')
+
+    days = min(max(request.args.get('days', 30, type=int), 1), HISTORY_MAX_DAYS)
+    return jsonify(db.history(session['user_id'], url=request.args.get('url') or None, days=days))
+
+def parse_date(value, end_of_day=False):
+    # Dates come from <input type="date">; 'to' includes the whole day
+    if not value:
+        return None
+    try:
+        date = datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        return None
+    return date + timedelta(days=1) if end_of_day else date
+
+def stream_pdf(grid_out, filename):
+    """
+    Stream a GridFS file chunk by chunk, honouring If-None-Match and single byte ranges
+    """
+    # Stored files never change, so their ID is a strong validator
+    etag = str(grid_out._id)
+    headers = {
+        'ETag': f'"{etag}"',
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'private, max-age=0, must-revalidate',
+        'Content-Disposition': f'attachment; filename="{filename}"'
+    }
+    if etag in request.if_none_match:
+        return Response(status=304, headers=headers)
+
+    length = grid_out.length
+    start, end = 0, length - 1
+    status = 200
+    byte_range = request.range
+    if byte_range and byte_range.units == 'bytes' and len(byte_range.ranges) == 1:
+        requested = byte_range.range_for_length(length)
+        if requested is None:
+            headers['Content-Range'] = f'bytes */{length}'
+            return Response(status=416, headers=headers)
+        start, end = requested[0], requested[1] - 1
+        headers['Content-Range'] = f'bytes {start}-{end}/{length}'
+        status = 206
+
+    def generate():
+        grid_out.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = grid_out.read(min(grid_out.chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+        grid_out.close()
+
+    headers['Content-Length'] = str(end - start + 1)
+    return Response(generate(), status=status, mimetype='application/pdf', headers=headers)
 
 @app.route('/download-report/<file_id>')
 @login_required
 def download_report(file_id):
     try:
-        pdf_data, filename = db.get_pdf(file_id, session['user_id'])
-        return send_file(
-            io.BytesIO(pdf_data),
-            mimetype='application/pdf',
-            as_attachment=True,
-            download_name=filename
-        )
+        report = db.get_report(file_id, session['user_id'])
+
+        # Scans are rendered on first download and the PDF is kept for later ones
+        if report.get('format') == 'scan' and not report.get('pdf_id'):
+            scan = db.get_scan(file_id, session['user_id'])
+            started = time.perf_counter()
+            report_path = write_report_pdf(
+                scan['url'], scan['results'], scan['screenshots'], scan['overview'],
+                load_image=ScreenshotLoader(session['user_id'])
+            )
+            try:
+                db.attach_pdf(file_id, report_path, render_seconds=time.perf_counter() - started)
+            finally:
+                os.remove(report_path)
+
+        pdf_file, filename = db.open_pdf(file_id, session['user_id'])
+        return stream_pdf(pdf_file, filename)
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
+    except RenderQueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    except TimeoutError as e:
+        return jsonify({'error': str(e)}), 504
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/reports/<file_id>/json')
+@login_required
+def report_json(file_id):
+    try:
+        report = db.get_report(file_id, session['user_id'])
+        if report.get('format') != 'scan':
+            return jsonify({'error': 'Report is only available as a PDF'}), 404
+        scan = db.get_scan(file_id, session['user_id'])
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+    return jsonify({
+        'file_id': file_id,
+        'url': scan['url'],
+        'timestamp': scan['timestamp'].isoformat(),
+        'results': scan['results'],
+        'screenshots': [
+            url_for('view_screenshot', screenshot_id=screenshot_id) if screenshot_id else None
+            for screenshot_id in report['screenshot_ids']
+        ],
+        'overview': url_for('view_screenshot', screenshot_id=report['overview_id']) if report.get('overview_id') else None,
+        'timings': report.get('timings', {})
+    })
+
+@app.route('/reports/<file_id>/html')
+@login_required
+def report_html(file_id):
+    try:
+        scan = db.get_scan(file_id, session['user_id'])
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    # Screenshots are loaded by the browser from /screenshots, where they are cached
+    return generate_report_html(
+        scan['url'], scan['results'], scan['screenshots'], scan['overview'],
+        image_url=lambda screenshot_id: url_for('view_screenshot', screenshot_id=screenshot_id)
+    )
+
+@app.route('/screenshots/<screenshot_id>')
+@login_required
+def view_screenshot(screenshot_id):
+    try:
+        data = db.get_screenshot(screenshot_id, session['user_id'])
+    except PermissionError as e:
+        return jsonify({'error': str(e)}), 403
+    except Exception as e:
+        return jsonify({'error': str(e)}), 404
+    # Stored images never change, so browsers may keep them
+    return Response(data, mimetype=images.mimetype(data), headers={'Cache-Control': 'private, max-age=31536000, immutable'})
+
 @app.route('/check-accessibility', methods=['POST'])
 @login_required
 def accessibility_check():
@@ -106,41 +331,255 @@ def accessibility_check():
         return jsonify({'error': 'URL is required'}), 400
     
     try:
-        # Generate the accessibility report
-        report_path = check_accessibility(url)
-        
-        # Store the PDF in MongoDB
-        file_id = db.store_pdf(report_path, url, session['user_id'])
-        
-        # Send the file to the user
-        return send_file(
-            report_path,
-            as_attachment=True,
-            download_name=f'accessibility-report-{datetime.now().strftime("%Y%m%d-%H%M%S")}.pdf'
-        )
+        job_id = job_manager.submit(session['user_id'], url)
+    except JobLimitExceeded as e:
+        return jsonify({'error': str(e)}), 429
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+    return jsonify({
+        'job_id': job_id,
+        'status_url': url_for('job_status', job_id=job_id)
+    }), 202
+
+@app.route('/crawl', methods=['POST'])
+@login_required
+def crawl_check():
+    payload = request.get_json(silent=True) or request.form
+    start_url = payload.get('url')
+    sitemap_url = payload.get('sitemap')
+    if not start_url and not sitemap_url:
+        return jsonify({'error': 'A start URL or a sitemap is required'}), 400
+
+    options = {'sitemap_url': sitemap_url}
+    if not start_url:
+        options['start_url'] = None
+    try:
+        for key in ('max_pages', 'max_depth'):
+            if payload.get(key) not in (None, ''):
+                options[key] = int(payload.get(key))
+    except ValueError:
+        return jsonify({'error': 'max_pages and max_depth must be integers'}), 400
+    if options.get('max_pages', 0) > CRAWL_MAX_PAGES_LIMIT:
+        return jsonify({'error': f"At most {CRAWL_MAX_PAGES_LIMIT} pages can be crawled at once"}), 400
+
+    try:
+        job_id = job_manager.submit(session['user_id'], start_url or sitemap_url, kind='crawl', options=options)
+    except JobLimitExceeded as e:
+        return jsonify({'error': str(e)}), 429
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+    return jsonify({
+        'job_id': job_id,
+        'status_url': url_for('job_status', job_id=job_id)
+    }), 202
+
+@app.route('/jobs/<job_id>')
+@login_required
+def job_status(job_id):
+    job = job_manager.get(job_id, session['user_id'])
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(serialize_job(job))
+
+@app.route('/jobs/<job_id>/events')
+@login_required
+def job_events(job_id):
+    user_id = session['user_id']
+    if not job_manager.get(job_id, user_id):
+        return jsonify({'error': 'Job not found'}), 404
+
+    def generate():
+        # Push the job state whenever it changes, until it finishes
+        last_status = None
+        while True:
+            job = job_manager.get(job_id, user_id)
+            if job['status'] != last_status:
+                last_status = job['status']
+                yield f"data: {json.dumps(serialize_job(job))}\n\n"
+            if job['status'] in FINISHED_STATES:
+                break
+            time.sleep(1)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream')
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    if not job_manager.cancel(job_id, session['user_id']):
+        return jsonify({'error': 'Job not found or already finished'}), 409
+    return jsonify(serialize_job(job_manager.get(job_id, session['user_id'])))
+
+@app.route('/monitors', methods=['GET', 'POST'])
+@login_required
+def monitors():
+    user_id = session['user_id']
+    if request.method == 'GET':
+        return jsonify([serialize_monitor(monitor) for monitor in monitor_store.list(user_id)])
+
+    payload = request.get_json(silent=True) or request.form
+    url = payload.get('url')
+    if not url:
+        return jsonify({'error': 'URL is required'}), 400
+    try:
+        interval_hours = float(payload['interval_hours']) if payload.get('interval_hours') not in (None, '') else None
+        monitor_id = monitor_store.create(user_id, url, interval_hours)
+    except (TypeError, ValueError, OverflowError) as e:
+        return jsonify({'error': str(e) or 'interval_hours must be a number'}), 400
+    except DuplicateKeyError:
+        return jsonify({'error': 'This URL is already monitored'}), 409
+    except MonitorLimitExceeded as e:
+        return jsonify({'error': str(e)}), 429
+    return jsonify(serialize_monitor(monitor_store.get(monitor_id, user_id))), 201
+
+@app.route('/monitors/<monitor_id>', methods=['GET', 'PATCH', 'DELETE'])
+@login_required
+def monitor_detail(monitor_id):
+    user_id = session['user_id']
+    if request.method == 'DELETE':
+        if not monitor_store.delete(monitor_id, user_id):
+            return jsonify({'error': 'Monitor not found'}), 404
+        return '', 204
+
+    if request.method == 'PATCH':
+        payload = request.get_json(silent=True) or {}
+        if not isinstance(payload.get('enabled'), bool):
+            return jsonify({'error': 'enabled must be true or false'}), 400
+        monitor_store.set_enabled(monitor_id, user_id, payload['enabled'])
+
+    monitor = monitor_store.get(monitor_id, user_id)
+    if not monitor:
+        return jsonify({'error': 'Monitor not found'}), 404
+    return jsonify(dict(serialize_monitor(monitor), runs=[serialize_run(run) for run in monitor_store.list_runs(monitor_id)]))
+
+@app.route('/check-batch', methods=['POST'])
+@login_required
+def batch_check():
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    urls = payload.get('urls') or request.form.getlist('urls')
+    sitemap_url = payload.get('sitemap') or request.form.get('sitemap')
+    # A bare string would otherwise be checked one character at a time
+    if not isinstance(urls, list) or not all(isinstance(url, str) for url in urls):
+        return jsonify({'error': 'urls must be a list of strings'}), 400
+    if sitemap_url is not None and not isinstance(sitemap_url, str):
+        return jsonify({'error': 'sitemap must be a string'}), 400
+
+    try:
+        if sitemap_url:
+            urls = list(urls) + fetch_sitemap_urls(sitemap_url, limit=BATCH_MAX_URLS)
+    except Exception as e:
+        return jsonify({'error': f"Failed to read sitemap: {str(e)}"}), 400
+
+    # Drop duplicates but keep the submitted order
+    urls = list(dict.fromkeys(url for url in urls if url))
+    if not urls:
+        return jsonify({'error': 'A list of URLs or a sitemap is required'}), 400
+    if len(urls) > BATCH_MAX_URLS:
+        return jsonify({'error': f"At most {BATCH_MAX_URLS} URLs can be checked at once"}), 400
+
+    try:
+        concurrency = parse_concurrency(payload.get('concurrency', request.form.get('concurrency')))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    user_id = session['user_id']
+
+    def generate():
+        # One JSON line per URL, as soon as its scan finishes
+        for result in iter_check_many(urls, concurrency=concurrency):
+            line = {'url': result['url'], 'error': result['error']}
+            if result['error'] is None:
+                try:
+                    line['file_id'] = db.store_scan(result, result['url'], user_id)
+                    line['violations'] = len(result['results'].get('violations', []))
+                except Exception as e:
+                    line['error'] = f"Failed to store report: {str(e)}"
+            yield json.dumps(line) + '\n'
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+def parse_concurrency(value):
+    """
+    Pages a batch may scan at once, capped at BATCH_MAX_CONCURRENCY
+    Returns: The concurrency, or None for the default when value is empty
+    Raises: ValueError when value is not a positive integer
+    """
+    if value in (None, ''):
+        return None
+    try:
+        # Through str() so booleans and fractions are rejected rather than truncated
+        concurrency = int(str(value))
+    except ValueError:
+        concurrency = None
+    if concurrency is None or concurrency < 1:
+        raise ValueError("concurrency must be a positive integer")
+    return min(concurrency, BATCH_MAX_CONCURRENCY)
+
+def prerender_reports(stored):
+    """
+    Render stored scans in the render pool in parallel and attach the PDFs
+    Reports that cannot be rendered now are rendered on first download instead
+    Args:
+        stored: List of (file_id, report URL, scan) tuples
+    """
+    started = time.perf_counter()
+    # One deadline for the batch, so the response waits at most RENDER_TIMEOUT
+    deadline = time.monotonic() + RENDER_TIMEOUT
+    renders = []
+    for file_id, report_url, scan in stored:
+        try:
+            renders.append((file_id, submit_report_pdf(
+                report_url, scan['results'], scan['screenshots'], scan['overview']
+            )))
+        except RenderQueueFull:
+            break
+
+    for file_id, render in renders:
+        try:
+            report_path = render.result(max(deadline - time.monotonic(), 0))
+        except Exception as e:
+            app.logger.warning("Failed to render report %s: %s", file_id, e)
+            continue
+        try:
+            db.attach_pdf(file_id, report_path, render_seconds=time.perf_counter() - started)
+        except Exception as e:
+            app.logger.warning("Failed to store PDF for report %s: %s", file_id, e)
+        finally:
+            os.remove(report_path)
+
 @app.route('/compare-git', methods=['POST'])
 @login_required
 def git_compare():
     repo_url = request.form.get('repo_url')
     branch = request.form.get('branch', 'main')
     commit_hash = request.form.get('commit_hash')
+    scope = request.form.get('scope')
     
     if not repo_url:
         return jsonify({'error': 'Repository URL is required'}), 400
+    if scope and scope not in SCAN_SCOPES:
+        return jsonify({'error': f"scope must be one of {', '.join(SCAN_SCOPES)}"}), 400
     
     try:
-        diff_results = compare_commits(repo_url, branch, commit_hash)
+        diff_results = compare_commits(repo_url, branch, commit_hash, scope=scope)
         
-        # Store accessibility reports in the database
+        # Store accessibility scans in the database
+        stored = []
         for file_path, issues in diff_results.get('accessibility_issues', {}).items():
-            if issues.get('has_issues') and issues.get('report_path'):
+            scan = issues.pop('scan', None)
+            if issues.get('has_issues') and scan:
+                report_url = f"Git comparison - {file_path}"
                 try:
-                    file_id = db.store_pdf(
-                        issues['report_path'],
-                        f"Git comparison - {file_path}",
+                    file_id = db.store_scan(
+                        scan,
+                        report_url,
                         session['user_id'],
                         metadata={
                             'type': 'git_accessibility',
@@ -149,12 +588,40 @@ def git_compare():
                         }
                     )
                     issues['report_id'] = file_id
+                    stored.append((file_id, report_url, scan))
                 except Exception as e:
                     issues['error'] = f"Failed to store report: {str(e)}"
-        
+
+        if GIT_PRERENDER_REPORTS:
+            prerender_reports(stored)
+
         return jsonify(diff_results)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-if __name__ == '__main__':
-    app.run(debug=True) 
\ No newline at end of file
+@app.route('/browser-pool/stats')
+@login_required
+def browser_pool_stats():
+    return jsonify(get_browser_pool().stats())
+
+@app.route('/render-pool/stats')
+@login_required
+def render_pool_stats():
+    return jsonify(get_render_pool().stats())
+
+@app.route('/scan-cache/stats')
+@login_required
+def scan_cache_stats():
+    return jsonify(get_scan_cache().stats())
+
+@app.route('/metrics')
+def prometheus_metrics():
+    # Scraped without a session; protect with a bearer token when METRICS_TOKEN is set
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return jsonify({'error': 'Unauthorized'}), 401
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/mongo/stats')
+@login_required
+def mongo_stats():
+    return jsonify(mongo.stats())
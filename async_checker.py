@@ -0,0 +1,347 @@
+import os
+import atexit
+import asyncio
+import queue
+import threading
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
+from playwright.async_api import async_playwright
+from browser_pool import CONTEXT_OPTIONS
+from page_loading import DEFAULT_LOAD_OPTIONS, block_requests_async, navigate_async
+from metrics import SCANS_IN_FLIGHT
+from images import screenshot_options
+from tracing import span
+from dom_scope import SCOPED_AXE_JS
+from accessibility_checker import (
+    ANNOTATE_HELPER_JS, DEFAULT_SCREENSHOT_MODE, SCREENSHOT_MODES,
+    annotation_items, clip_rect, encode_screenshot, load_axe_script
+)
+
+DEFAULT_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', 5))
+DEFAULT_PER_DOMAIN = int(os.getenv('BATCH_PER_DOMAIN', 2))
+DEFAULT_URL_TIMEOUT = float(os.getenv('BATCH_URL_TIMEOUT', 60))
+
+
+class SharedBrowser:
+    """
+    One Chromium kept open on a background event loop, shared by every check_many
+    call in the process, so batches and git comparisons do not each launch a browser.
+    The browser is relaunched when it crashes, and recycled between batches after
+    BROWSER_POOL_MAX_PAGES pages like the pool's browsers.
+    """
+
+    def __init__(self, max_pages=None):
+        self.max_pages = max_pages or int(os.getenv('BROWSER_POOL_MAX_PAGES', 50))
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name='shared-browser', daemon=True)
+        self._thread.start()
+        self._playwright = None
+        self._browser = None
+        self._guard = None
+        self._active = 0
+        self._pages = 0
+
+    def submit(self, coroutine):
+        """Run coroutine on the browser's loop; returns a concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    @asynccontextmanager
+    async def lease(self, pages):
+        """Use the browser for a batch of pages; only callable on self.loop"""
+        self._guard = self._guard or asyncio.Lock()
+        async with self._guard:
+            if self._browser is None or not self._browser.is_connected():
+                await self._launch()
+            browser = self._browser
+            self._active += 1
+        try:
+            yield browser
+        finally:
+            self._active -= 1
+            self._pages += pages
+            if self._active == 0 and self._pages >= self.max_pages:
+                await self._close()
+
+    async def _launch(self):
+        await self._close()
+        if self._playwright is None:
+            self._playwright = await async_playwright().start()
+        with span('browser_launch'):
+            self._browser = await self._playwright.chromium.launch(headless=True)
+        self._pages = 0
+
+    async def _close(self):
+        browser, self._browser = self._browser, None
+        if browser is not None:
+            try:
+                await browser.close()
+            except Exception:
+                pass
+
+    def shutdown(self):
+        async def stop():
+            await self._close()
+            if self._playwright is not None:
+                await self._playwright.stop()
+        try:
+            self.submit(stop()).result(10)
+        except Exception:
+            pass
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+
+_shared_browser = None
+_shared_browser_pid = None
+_shared_browser_lock = threading.Lock()
+
+
+def get_shared_browser():
+    """Return the process-wide SharedBrowser, starting it on first use"""
+    global _shared_browser, _shared_browser_pid
+    with _shared_browser_lock:
+        # Forked job workers cannot use their parent's event loop thread
+        if _shared_browser is None or _shared_browser_pid != os.getpid():
+            _shared_browser = SharedBrowser()
+            _shared_browser_pid = os.getpid()
+            atexit.register(_shared_browser.shutdown)
+        return _shared_browser
+
+
+async def check_many(urls, concurrency=None, per_domain=None, timeout=None, screenshot_mode=None, routes=None,
+                     scopes=None, screenshots=True, browser=None):
+    """
+    Scan many URLs at once on a shared browser
+    Args:
+        urls: Iterable of URLs to check
+        concurrency: Maximum pages open at once
+        per_domain: Maximum pages open at once per host
+        timeout: Seconds allowed per URL
+        screenshot_mode: One of SCREENSHOT_MODES (optional)
+        routes: List of (URL pattern, async handler) pairs registered on every page,
+                used to serve content from memory (optional)
+        scopes: Dict of URL to regions from dom_scope.changed_regions; those URLs are
+                scanned only in the regions (optional)
+        screenshots: Capture screenshots of the violations; False skips them when no report is rendered
+        browser: Async Playwright browser to open the pages in; a new one is launched and
+                 closed when not given (optional)
+    Yields: One result dict per URL, in the order the scans finish
+    """
+    concurrency = concurrency or DEFAULT_CONCURRENCY
+    per_domain = per_domain or DEFAULT_PER_DOMAIN
+    timeout = timeout or DEFAULT_URL_TIMEOUT
+    screenshot_mode = screenshot_mode or DEFAULT_SCREENSHOT_MODE
+    if screenshot_mode not in SCREENSHOT_MODES:
+        raise ValueError(f"Unknown screenshot mode: {screenshot_mode}")
+
+    urls = list(urls)
+    if not urls:
+        return
+
+    axe_script = load_axe_script()
+    scopes = scopes or {}
+    limit = asyncio.Semaphore(concurrency)
+    domain_limits = {}
+
+    async def run(url):
+        # Politeness: cap concurrent pages per host as well as overall
+        domain = urlparse(url).netloc
+        domain_limit = domain_limits.setdefault(domain, asyncio.Semaphore(per_domain))
+        async with domain_limit, limit:
+            try:
+                return await asyncio.wait_for(
+                    scan_url(browser, url, axe_script, screenshot_mode, routes, scope=scopes.get(url),
+                             screenshots=screenshots),
+                    timeout
+                )
+            except asyncio.TimeoutError:
+                return failed_result(url, f"Timed out after {timeout:g}s")
+            except Exception as e:
+                return failed_result(url, str(e))
+
+    async def scan_all():
+        tasks = [asyncio.ensure_future(run(url)) for url in urls]
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                yield await next_result
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    if browser is not None:
+        async for result in scan_all():
+            yield result
+        return
+
+    async with async_playwright() as p:
+        with span('browser_launch'):
+            browser = await p.chromium.launch(headless=True)
+        try:
+            async for result in scan_all():
+                yield result
+        finally:
+            await browser.close()
+
+
+def iter_check_many(urls, **kwargs):
+    """
+    Synchronous wrapper around check_many for use from Flask and scripts
+    Pages open on the process-wide SharedBrowser; results are yielded as they arrive
+    """
+    urls = list(urls)
+    shared = get_shared_browser()
+    results = queue.Queue()
+    done = object()
+
+    async def consume():
+        async with shared.lease(len(urls)) as browser:
+            async for result in check_many(urls, browser=browser, **kwargs):
+                results.put(result)
+
+    future = shared.submit(consume())
+    future.add_done_callback(lambda _: results.put(done))
+    try:
+        while True:
+            item = results.get()
+            if item is done:
+                break
+            yield item
+        future.result()
+    finally:
+        # The caller stopped reading: close the pages still open
+        if not future.done():
+            future.cancel()
+
+
+async def scan_url(browser, url, axe_script, screenshot_mode, routes=None, collect_links=False, load=None, scope=None,
+                   screenshots=True):
+    """
+    Scan one URL in a fresh context of browser
+    Args:
+        browser: Async Playwright browser
+        url: URL of the page to check
+        axe_script: Source of axe.min.js
+        screenshot_mode: One of SCREENSHOT_MODES
+        routes: List of (URL pattern, async handler) pairs (optional)
+        collect_links: Also return the absolute URLs of every link on the page
+        load: Load options from page_loading.load_options (optional)
+        scope: Regions from dom_scope.changed_regions; axe runs on them and their ancestors
+               and screenshots are limited to them, or on the whole page when they are not
+               found (optional)
+        screenshots: Capture screenshots of the violations
+    Returns: Result dict with the axe results, screenshots, combined overview and phase timings
+    """
+    load = load or DEFAULT_LOAD_OPTIONS
+    timings = {}
+    context = await browser.new_context(**CONTEXT_OPTIONS)
+    SCANS_IN_FLIGHT.inc()
+    try:
+        # axe-core is evaluated from memory as each document is created
+        await context.add_init_script(script=axe_script)
+        for pattern, handler in routes or []:
+            await context.route(pattern, handler)
+        # Registered last so it sees requests first and falls back to the routes above
+        await block_requests_async(context, url, load)
+        page = await context.new_page()
+
+        with span('navigate') as phase:
+            await navigate_async(page, url, load)
+        timings['navigate'] = phase.seconds
+
+        # Collect links before the page is annotated
+        links = []
+        if collect_links:
+            links = await page.eval_on_selector_all('a[href]', 'elements => elements.map(e => e.href)')
+
+        # Pages that replace window.axe or block init scripts get a fresh copy
+        with span('inject') as phase:
+            if not await page.evaluate('() => typeof window.axe !== "undefined" && typeof window.axe.run === "function"'):
+                await page.evaluate(axe_script)
+        timings['inject'] = phase.seconds
+
+        with span('axe') as phase:
+            scoped = await page.evaluate(SCOPED_AXE_JS, scope) if scope else None
+            region = None
+            if scoped:
+                results = scoped['results']
+                region = clip_rect(scoped['bounds'])
+                results['scope'] = {'mode': 'changed', 'regions': [item['selector'] for item in scope]}
+            else:
+                results = await page.evaluate('''() => {
+                    return axe.run(document.body);
+                }''')
+                if scope:
+                    results['scope'] = {'mode': 'page', 'reason': 'Changed regions not found in the rendered page'}
+        timings['axe'] = phase.seconds
+
+        captures, overview = [], None
+        if screenshots:
+            with span('screenshots') as phase:
+                captures, overview = await _take_screenshots(page, results.get('violations', []), screenshot_mode, region)
+            timings['screenshots'] = phase.seconds
+        return {
+            'url': url,
+            'final_url': page.url,
+            'results': results,
+            'screenshots': captures,
+            'overview': overview,
+            'links': links,
+            'timings': timings,
+            'error': None
+        }
+    finally:
+        SCANS_IN_FLIGHT.dec()
+        await context.close()
+
+
+async def _take_screenshots(page, violations, screenshot_mode, region=None):
+    # Mirrors accessibility_checker.take_screenshots for the async API;
+    # region limits full page captures to the scanned part of a scoped scan
+    await page.evaluate(ANNOTATE_HELPER_JS)
+
+    if screenshot_mode == 'combined':
+        items = []
+        for i, violation in enumerate(violations):
+            items.extend(annotation_items(violation, label=str(i + 1)))
+        if not items:
+            return [], None
+        await page.evaluate('(items) => window.__axeAnnotate(items)', items)
+        overview = encode_screenshot(await page.screenshot(**screenshot_options(full_page=True, clip=region)))
+        await page.evaluate('() => window.__axeClearAnnotations()')
+        return [], overview
+
+    screenshots = []
+    captures = {}
+    for violation in violations:
+        items = annotation_items(violation)
+        capture_key = tuple(item['selector'] for item in items)
+        if capture_key not in captures:
+            bounds = await page.evaluate('(items) => window.__axeAnnotate(items)', items)
+
+            if screenshot_mode == 'element':
+                clip = clip_rect(bounds)
+                screenshot_bytes = await page.screenshot(**screenshot_options(full_page=True, clip=clip)) if clip else None
+            else:
+                screenshot_bytes = await page.screenshot(**screenshot_options(full_page=True, clip=region))
+            captures[capture_key] = encode_screenshot(screenshot_bytes) if screenshot_bytes else None
+
+            await page.evaluate('() => window.__axeClearAnnotations()')
+
+        screenshots.append({
+            'data': captures[capture_key],
+            'description': violation.get('description', ''),
+            'impact': violation.get('impact', '')
+        } if captures[capture_key] else None)
+
+    return screenshots, None
+
+
+def failed_result(url, error):
+    return {
+        'url': url,
+        'final_url': url,
+        'links': [],
+        'results': None,
+        'screenshots': [],
+        'overview': None,
+        'error': error
+    }
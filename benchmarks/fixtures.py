@@ -0,0 +1,100 @@
+import os
+import threading
+import functools
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+from git import Repo, Actor
+
+# Rules each fixture cycles through, so violating nodes are spread over several axe rules
+VIOLATION_SNIPPETS = (
+    '<img src="data:image/gif;base64,R0lGODlhAQABAAAAACw=">',                 # image-alt
+    '<button></button>',                                                        # button-name
+    '<a href="#"></a>',                                                         # link-name
+    '<input type="text">',                                                      # label
+    '<p style="color:#999;background:#aaa">Low contrast text</p>',              # color-contrast
+)
+
+AUTHOR = Actor('Benchmark', 'benchmark@example.com')
+
+
+def fixture_page(violations, title='Benchmark fixture', variant=0):
+    """
+    An HTML page with the given number of violating elements
+    Args:
+        violations: Number of violating nodes, spread over VIOLATION_SNIPPETS
+        title: Page title
+        variant: Changes the page text without changing its violations
+    """
+    body = [f'<p>Fixture variant {variant}</p>']
+    for i in range(violations):
+        body.append(f'<div id="v{i}">{VIOLATION_SNIPPETS[i % len(VIOLATION_SNIPPETS)]}</div>')
+    return (
+        '<!DOCTYPE html>\n<html lang="en">\n<head><meta charset="utf-8">'
+        f'<title>{title}</title></head>\n<body>\n<main>\n' + '\n'.join(body) + '\n</main>\n</body>\n</html>\n'
+    )
+
+
+def write_fixture_site(directory, sizes):
+    """
+    Write one page per violation count
+    Returns: Dict of violation count to file name
+    """
+    os.makedirs(directory, exist_ok=True)
+    pages = {}
+    for size in sizes:
+        name = f'violations-{size}.html'
+        with open(os.path.join(directory, name), 'w') as f:
+            f.write(fixture_page(size, title=f'{size} violations'))
+        pages[size] = name
+    return pages
+
+
+class FixtureServer:
+    """Serves a directory over HTTP on a free localhost port, on a background thread"""
+
+    def __init__(self, directory):
+        handler = functools.partial(_QuietHandler, directory=directory)
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='fixture-server', daemon=True)
+
+    @property
+    def base_url(self):
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def make_git_repo(directory, files, violations):
+    """
+    Create a repository with two commits on main that both touch every HTML file
+    The second commit changes the page text, so every file is rescanned
+    Args:
+        directory: Where to create the repository
+        files: Number of HTML files
+        violations: Violating nodes per file
+    Returns: Path of the repository, usable as a clone URL
+    """
+    repo = Repo.init(directory, initial_branch='main')
+    paths = [os.path.join('pages', f'page-{i:04d}.html') for i in range(files)]
+    os.makedirs(os.path.join(directory, 'pages'), exist_ok=True)
+
+    for variant in (0, 1):
+        for path in paths:
+            with open(os.path.join(directory, path), 'w') as f:
+                f.write(fixture_page(violations, title=path, variant=variant))
+        repo.index.add(paths)
+        repo.index.commit(f'Benchmark commit {variant}', author=AUTHOR, committer=AUTHOR)
+
+    repo.close()
+    return directory
@@ -0,0 +1,258 @@
+"""
+Benchmarks for the scan, report, git and database hot paths
+
+Run from the repository root:
+
+    python -m benchmarks.run --output baseline.json
+    python -m benchmarks.run --baseline baseline.json --output current.json
+
+With --baseline, medians are compared and the exit status is 1 when any benchmark
+is slower than the baseline by more than --threshold.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime, timezone
+
+# Benchmarks measure uncached work; set before any application module reads its configuration
+os.environ['SCAN_CACHE_BACKENDS'] = 'none'
+
+from benchmarks.fixtures import FixtureServer, write_fixture_site, make_git_repo
+
+DEFAULT_SIZES = (10, 100, 1000)
+
+# The database benchmarks write here, never to the application database, and drop it afterwards
+BENCHMARK_DB = os.getenv('BENCHMARK_DB', 'accessibility_reports_benchmark')
+
+
+def bench_scan(ctx):
+    """check_accessibility end to end, then report HTML and PDF rendering on its results"""
+    from accessibility_checker import check_accessibility, run_scan, generate_report_html, write_report_pdf
+
+    pages = write_fixture_site(os.path.join(ctx['workdir'], 'site'), ctx['sizes'])
+    with FixtureServer(os.path.join(ctx['workdir'], 'site')) as server:
+        for size, name in pages.items():
+            url = f'{server.base_url}/{name}'
+            yield f'check_accessibility[{size}]', lambda url=url: _remove(check_accessibility(url))
+
+            scan = run_scan(url)
+            args = (url, scan['results'], scan['screenshots'], scan['overview'])
+            yield f'generate_report_html[{size}]', lambda args=args: generate_report_html(*args)
+            yield f'write_report_pdf[{size}]', lambda args=args: _remove(write_report_pdf(*args))
+
+
+def bench_git(ctx):
+    """compare_commits over a synthetic repository where every HTML file changed"""
+    from git_comparator import compare_commits
+
+    files = ctx['git_files']
+    repo_path = make_git_repo(os.path.join(ctx['workdir'], 'repo'), files, violations=10)
+    # The warm-up run creates the mirror, timed runs measure incremental fetches and scans
+    yield f'compare_commits[{files} files]', lambda: compare_commits(repo_path, 'main')
+
+
+def bench_database(ctx):
+    """Database.store_pdf and list_reports against mongod (MONGO_URI) or mongomock, in BENCHMARK_DB"""
+    import database
+    client, reason = _benchmark_client()
+    if reason:
+        yield 'database', Skip(reason)
+        return
+
+    database.get_database = lambda: client[BENCHMARK_DB]
+    try:
+        db = database.Database()
+        user_id = f'benchmark-{os.getpid()}'
+        pdf_path = os.path.join(ctx['workdir'], 'report.pdf')
+        with open(pdf_path, 'wb') as f:
+            f.write(os.urandom(ctx['pdf_bytes']))
+
+        yield 'Database.store_pdf', lambda: db.store_pdf(pdf_path, 'http://benchmark.invalid/', user_id)
+
+        for i in range(ctx['reports']):
+            db.store_pdf(pdf_path, f'http://benchmark.invalid/{i}', user_id)
+        first_page = db.list_reports(user_id, limit=20)
+        cursor = database.report_cursor(first_page[-1])
+
+        yield f'Database.list_reports[first page of {ctx["reports"]}]', lambda: db.list_reports(user_id, limit=20)
+        yield f'Database.list_reports[second page of {ctx["reports"]}]', lambda: db.list_reports(user_id, limit=20, before=cursor)
+        yield 'Database.list_reports[url filter]', lambda: db.list_reports(user_id, limit=20, url='http://benchmark.invalid/5')
+    finally:
+        client.drop_database(BENCHMARK_DB)
+
+
+BENCHMARKS = {
+    'scan': bench_scan,
+    'git': bench_git,
+    'database': bench_database
+}
+
+
+class Skip:
+    def __init__(self, reason):
+        self.reason = reason
+
+
+def _benchmark_client():
+    """
+    A real server is used when configured; otherwise mongomock, when installed, stands in
+    Returns: (client, None), or (None, reason to skip)
+    """
+    import mongo
+    if BENCHMARK_DB == mongo.DATABASE_NAME:
+        return None, f'BENCHMARK_DB must not be the application database {mongo.DATABASE_NAME}'
+    if os.getenv('MONGO_URI'):
+        return mongo.get_client(), None
+    try:
+        import mongomock
+        import mongomock.gridfs
+    except ImportError:
+        return None, 'Set MONGO_URI to a local mongod or install mongomock'
+
+    mongomock.gridfs.enable_gridfs_integration()
+    return mongomock.MongoClient(), None
+
+
+def _remove(path):
+    os.remove(path)
+
+
+def measure(fn, repeat, warmup):
+    """Run fn warmup times untimed, then repeat times timed"""
+    for _ in range(warmup):
+        fn()
+    runs = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        runs.append(time.perf_counter() - started)
+    return {
+        'runs': runs,
+        'min': min(runs),
+        'median': statistics.median(runs),
+        'mean': statistics.mean(runs),
+        'max': max(runs),
+        'stdev': statistics.stdev(runs) if len(runs) > 1 else 0.0
+    }
+
+
+def run(args):
+    workdir = tempfile.mkdtemp(prefix='a11y-benchmark-')
+    ctx = {
+        'workdir': workdir,
+        'sizes': args.sizes,
+        'git_files': args.git_files,
+        'reports': args.reports,
+        'pdf_bytes': args.pdf_bytes
+    }
+    # Keep git mirrors out of the shared cache
+    os.environ.setdefault('REPO_CACHE_DIR', os.path.join(workdir, 'mirrors'))
+
+    results = {}
+    try:
+        for group, bench in BENCHMARKS.items():
+            if args.only and group not in args.only:
+                continue
+            try:
+                for name, fn in bench(ctx):
+                    if isinstance(fn, Skip):
+                        results[name] = {'skipped': fn.reason}
+                        print(f'{name}: skipped ({fn.reason})', file=sys.stderr)
+                        continue
+                    try:
+                        results[name] = measure(fn, args.repeat, args.warmup)
+                        print(f'{name}: median {results[name]["median"]:.4f}s', file=sys.stderr)
+                    except Exception as e:
+                        results[name] = {'error': str(e)}
+                        print(f'{name}: failed ({e})', file=sys.stderr)
+            except Exception as e:
+                results[group] = {'error': f'Setup failed: {e}'}
+                print(f'{group}: setup failed ({e})', file=sys.stderr)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        'meta': {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'commit': _git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'warmup': args.warmup
+        },
+        'results': results
+    }
+
+
+def compare(current, baseline, threshold):
+    """
+    Compare medians against a baseline run
+    Returns: List of (name, baseline median, current median, ratio, regressed) rows
+    """
+    rows = []
+    for name, result in current['results'].items():
+        old = baseline['results'].get(name, {})
+        if 'median' not in result or 'median' not in old:
+            continue
+        ratio = result['median'] / old['median'] if old['median'] else float('inf')
+        rows.append((name, old['median'], result['median'], ratio, ratio > 1 + threshold))
+    return rows
+
+
+def _git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def _sizes(value):
+    return [int(size) for size in value.split(',') if size]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the accessibility checker')
+    parser.add_argument('--only', action='append', choices=list(BENCHMARKS), help='Run only these groups')
+    parser.add_argument('--sizes', type=_sizes, default=list(DEFAULT_SIZES), help='Violations per fixture page, e.g. 10,100,1000')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per benchmark')
+    parser.add_argument('--warmup', type=int, default=1, help='Untimed runs per benchmark')
+    parser.add_argument('--git-files', type=int, default=50, help='Changed HTML files in the synthetic repository')
+    parser.add_argument('--reports', type=int, default=1000, help='Reports stored before timing list_reports')
+    parser.add_argument('--pdf-bytes', type=int, default=256 * 1024, help='Size of the PDF stored by store_pdf')
+    parser.add_argument('--output', help='Write the results as JSON to this file (default: stdout)')
+    parser.add_argument('--baseline', help='Compare against results from an earlier run')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Slowdown allowed before a benchmark counts as a regression')
+    args = parser.parse_args(argv)
+
+    current = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(current, f, indent=2)
+    else:
+        json.dump(current, sys.stdout, indent=2)
+        print()
+
+    if not args.baseline:
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    rows = compare(current, baseline, args.threshold)
+    regressed = False
+    print(f'\n{"benchmark":<48} {"baseline":>10} {"current":>10} {"change":>8}', file=sys.stderr)
+    for name, old, new, ratio, is_regression in rows:
+        regressed = regressed or is_regression
+        flag = '  REGRESSION' if is_regression else ''
+        print(f'{name:<48} {old:>9.4f}s {new:>9.4f}s {ratio - 1:>+8.1%}{flag}', file=sys.stderr)
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
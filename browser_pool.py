@@ -0,0 +1,231 @@
+import os
+import queue
+import threading
+import time
+import atexit
+from playwright.sync_api import sync_playwright
+from metrics import Gauge, Histogram, SCANS_IN_FLIGHT
+from tracing import span
+
+# Context settings shared by every scan
+CONTEXT_OPTIONS = {
+    'viewport': {'width': 1280, 'height': 800},
+    'java_script_enabled': True,
+    'ignore_https_errors': True
+}
+
+
+class PoolExhausted(Exception):
+    """Raised when the lease queue is full and no browser frees up in time"""
+
+
+class _Lease:
+    def __init__(self, fn, args, kwargs):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.enqueued_at = time.monotonic()
+        self.done = threading.Event()
+        self.cancelled = False
+        self.result = None
+        self.error = None
+
+
+class _BrowserWorker(threading.Thread):
+    """
+    Owns one Chromium instance for its whole life.
+    Playwright's sync API is bound to the thread that started it, so every
+    lease for this browser is executed on this thread.
+    """
+
+    def __init__(self, pool, index):
+        super().__init__(name=f'browser-pool-{index}', daemon=True)
+        self.pool = pool
+        self.browser = None
+        self.pages_served = 0
+
+    def run(self):
+        with sync_playwright() as p:
+            while True:
+                lease = self.pool._leases.get()
+                if lease is None:
+                    break
+                if lease.cancelled:
+                    continue
+
+                self.pool._record_lease(time.monotonic() - lease.enqueued_at)
+                try:
+                    self._ensure_browser(p)
+                    context = self.browser.new_context(**CONTEXT_OPTIONS)
+                    try:
+                        with SCANS_IN_FLIGHT.track_in_progress():
+                            lease.result = lease.fn(context, *lease.args, **lease.kwargs)
+                    finally:
+                        try:
+                            context.close()
+                        except Exception:
+                            pass
+                except Exception as e:
+                    lease.error = e
+                    # A disconnected browser means Chromium crashed, drop it
+                    if self.browser is not None and not self.browser.is_connected():
+                        self.pool._record_crash()
+                        self.browser = None
+                finally:
+                    self.pages_served += 1
+                    self.pool._release()
+                    lease.done.set()
+
+            self._close_browser()
+
+    def _ensure_browser(self, p):
+        # Health check before every lease, recycle after max_pages
+        healthy = self.browser is not None and self.browser.is_connected()
+        if healthy and self.pages_served < self.pool.max_pages:
+            return
+        if self.browser is not None:
+            self.pool._record_recycle()
+            self._close_browser()
+        with span('browser_launch'):
+            self.browser = p.chromium.launch(headless=True)
+        self.pages_served = 0
+
+    def _close_browser(self):
+        if self.browser is not None:
+            try:
+                self.browser.close()
+            except Exception:
+                pass
+            self.browser = None
+
+
+class BrowserPool:
+    def __init__(self, size=None, max_pages=None, queue_size=None, lease_timeout=None):
+        """
+        Pool of long-lived Chromium browsers
+        Args:
+            size: Number of browsers to keep running
+            max_pages: Recycle a browser after serving this many pages
+            queue_size: Maximum number of scans waiting for a browser
+            lease_timeout: Seconds to wait for a free queue slot
+        """
+        self.size = size or int(os.getenv('BROWSER_POOL_SIZE', 2))
+        self.max_pages = max_pages or int(os.getenv('BROWSER_POOL_MAX_PAGES', 50))
+        self.queue_size = queue_size or int(os.getenv('BROWSER_POOL_QUEUE_SIZE', 20))
+        self.lease_timeout = lease_timeout or float(os.getenv('BROWSER_POOL_LEASE_TIMEOUT', 30))
+
+        self._leases = queue.Queue(maxsize=self.queue_size)
+        self._workers = []
+        self._lock = threading.Lock()
+        self._busy = 0
+        self._lease_count = 0
+        self._lease_wait_total = 0.0
+        self._lease_wait_max = 0.0
+        self._recycles = 0
+        self._crashes = 0
+
+    def start(self):
+        with self._lock:
+            if self._workers:
+                return
+            for index in range(self.size):
+                worker = _BrowserWorker(self, index)
+                worker.start()
+                self._workers.append(worker)
+
+    def run(self, fn, *args, timeout=None, **kwargs):
+        """
+        Lease a fresh browser context and run fn(context, *args, **kwargs) with it
+        Args:
+            fn: Callable receiving a Playwright BrowserContext
+            timeout: Seconds to wait for the result (optional)
+        Returns: Whatever fn returns
+        """
+        self.start()
+        lease = _Lease(fn, args, kwargs)
+        try:
+            self._leases.put(lease, timeout=self.lease_timeout)
+        except queue.Full:
+            raise PoolExhausted("Browser pool queue is full")
+
+        if not lease.done.wait(timeout):
+            lease.cancelled = True
+            raise TimeoutError("Timed out waiting for browser pool")
+
+        if lease.error is not None:
+            raise lease.error
+        return lease.result
+
+    def shutdown(self):
+        with self._lock:
+            workers, self._workers = self._workers, []
+        for _ in workers:
+            self._leases.put(None)
+        for worker in workers:
+            worker.join(timeout=10)
+
+    def stats(self):
+        """Lease wait time and utilisation counters"""
+        with self._lock:
+            return {
+                'size': self.size,
+                'busy': self._busy,
+                'utilisation': self._busy / self.size if self.size else 0.0,
+                'queued': self._leases.qsize(),
+                'leases': self._lease_count,
+                'lease_wait_avg': self._lease_wait_total / self._lease_count if self._lease_count else 0.0,
+                'lease_wait_max': self._lease_wait_max,
+                'recycles': self._recycles,
+                'crashes': self._crashes
+            }
+
+    def _record_lease(self, wait):
+        LEASE_WAIT_SECONDS.observe(wait)
+        with self._lock:
+            self._busy += 1
+            self._lease_count += 1
+            self._lease_wait_total += wait
+            self._lease_wait_max = max(self._lease_wait_max, wait)
+
+    def _release(self):
+        with self._lock:
+            self._busy -= 1
+
+    def _record_recycle(self):
+        with self._lock:
+            self._recycles += 1
+
+    def _record_crash(self):
+        with self._lock:
+            self._crashes += 1
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _pool_stat(name):
+    # Read when /metrics is scraped; nothing is reported until the pool exists
+    def read():
+        if _pool is None:
+            raise LookupError("Browser pool not started")
+        return _pool.stats()[name]
+    return read
+
+
+LEASE_WAIT_SECONDS = Histogram('a11y_browser_lease_wait_seconds', 'Time scans wait for a browser')
+Gauge('a11y_browser_pool_size', 'Browsers in the pool', function=_pool_stat('size'))
+Gauge('a11y_browser_pool_busy', 'Browsers running a scan', function=_pool_stat('busy'))
+Gauge('a11y_browser_pool_queued', 'Scans waiting for a browser', function=_pool_stat('queued'))
+Gauge('a11y_browser_pool_recycles', 'Browsers recycled after max_pages', function=_pool_stat('recycles'))
+Gauge('a11y_browser_pool_crashes', 'Browsers that crashed', function=_pool_stat('crashes'))
+
+
+def get_browser_pool():
+    """Return the process-wide browser pool, creating it on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BrowserPool()
+            atexit.register(_pool.shutdown)
+        return _pool
@@ -0,0 +1,348 @@
+"""
+Command-line batch runner for CI
+
+Scan pages, sharded over worker processes that each keep their own browser:
+
+    python cli.py scan https://example.com/ https://example.com/about --fail-on serious
+    python cli.py scan --file urls.txt --processes 4 --pdf-dir reports > results.jsonl
+
+Compare two commits of a repository:
+
+    python cli.py git https://github.com/org/site.git main~1..main --fail-on serious
+
+One JSON object per page or changed file is written to stdout as soon as it is scanned.
+The exit status is 1 when a violation at or above --fail-on was found (for git, only
+violations the newer commit introduced count), 2 for invalid arguments, 3 when a page
+could not be scanned or the repository could not be read, and 0 otherwise.
+
+Modules are imported only by the command that needs them, and MongoDB is never used
+unless SCAN_CACHE_BACKENDS asks for it.
+"""
+import os
+import sys
+import json
+import queue
+import logging
+import argparse
+import multiprocessing
+from summaries import IMPACTS, summarize_results
+
+DEFAULT_PROCESSES = int(os.getenv('CLI_PROCESSES', 2))
+DEFAULT_FAIL_ON = os.getenv('CLI_FAIL_ON', 'none')
+FAIL_ON_LEVELS = IMPACTS + ('none',)
+
+EXIT_OK = 0
+EXIT_VIOLATIONS = 1
+EXIT_USAGE = 2
+EXIT_FAILED = 3
+
+# Seconds between checks that every worker process is still alive
+WORKER_POLL_SECONDS = 1
+
+logger = logging.getLogger(__name__)
+
+
+def exceeds(impacts, fail_on):
+    """Whether any of impacts is at least as severe as fail_on"""
+    if fail_on == 'none':
+        return False
+    levels = IMPACTS[:IMPACTS.index(fail_on) + 1]
+    return any(impact in levels for impact in impacts)
+
+
+def scan_urls(urls, processes=None, pdf_dir=None, **options):
+    """
+    Scan URLs round-robin over worker processes
+    Args:
+        urls: List of URLs to check
+        processes: Worker processes, each with its own browser
+        pdf_dir: Directory to write a PDF report per page to (optional)
+        options: Passed to async_checker.check_many
+    Yields: One result line per URL, in the order the scans finish
+    """
+    processes = max(1, min(processes or DEFAULT_PROCESSES, len(urls)))
+    shards = [urls[i::processes] for i in range(processes)]
+    if processes == 1:
+        yield from _scan_shard_or_fail(shards[0], pdf_dir, options)
+        return
+
+    # Workers start from a fresh interpreter and import only what scanning needs
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    workers = {}
+    for index, shard in enumerate(shards):
+        worker = context.Process(target=_shard_worker, args=(index, shard, pdf_dir, options, results),
+                                 name=f'scan-shard-{index}', daemon=True)
+        worker.start()
+        workers[index] = worker
+
+    pending = {index: set(shard) for index, shard in enumerate(shards)}
+    try:
+        while workers:
+            try:
+                index, line = results.get(timeout=WORKER_POLL_SECONDS)
+            except queue.Empty:
+                # A worker killed without reporting, e.g. out of memory, fails its remaining URLs
+                for dead, worker in list(workers.items()):
+                    if not worker.is_alive():
+                        del workers[dead]
+                        for url in sorted(pending.pop(dead)):
+                            yield _failed_line(url, f"Worker exited with code {worker.exitcode}")
+                continue
+            if line is None:
+                workers.pop(index).join()
+                pending.pop(index)
+                continue
+            pending[index].discard(line['url'])
+            yield line
+    finally:
+        for worker in workers.values():
+            worker.terminate()
+
+
+def _shard_worker(index, urls, pdf_dir, options, results):
+    try:
+        for line in _scan_shard_or_fail(urls, pdf_dir, options):
+            results.put((index, line))
+    finally:
+        results.put((index, None))
+
+
+def _scan_shard_or_fail(urls, pdf_dir, options):
+    reported = set()
+    try:
+        for line in _scan_shard(urls, pdf_dir, options):
+            reported.add(line['url'])
+            yield line
+    except Exception as e:
+        # The browser failed, e.g. it could not start; the rest of the shard was not scanned
+        for url in urls:
+            if url not in reported:
+                yield _failed_line(url, str(e))
+
+
+def _scan_shard(urls, pdf_dir, options):
+    from async_checker import iter_check_many
+
+    for result in iter_check_many(urls, screenshots=bool(pdf_dir), **options):
+        if result['error']:
+            yield _failed_line(result['url'], result['error'])
+            continue
+        line = _result_line(result['url'], result['results'])
+        line['final_url'] = result['final_url']
+        if pdf_dir and line['violations']:
+            line.update(_write_pdf(pdf_dir, result['url'], _report_name(result['url']), result))
+        yield line
+
+
+def compare(repo_url, branch, commit_hash, workers=None, scope=None, pdf_dir=None):
+    """
+    Compare two commits with git_comparator.compare_commits
+    Yields: One result line per changed page, in diff order
+    """
+    from git_comparator import compare_commits
+
+    comparison = compare_commits(repo_url, branch, commit_hash, workers, scope)
+    for file_path, issues in comparison['accessibility_issues'].items():
+        base = {'file': file_path, 'commit': comparison['current_commit'], 'old_commit': comparison['old_commit']}
+        if issues.get('skipped'):
+            yield dict(base, skipped=issues['skipped'])
+            continue
+        if issues.get('error'):
+            yield dict(base, error=issues['error'])
+            continue
+
+        scan = issues['scan']
+        line = dict(base, **_result_line(scan['url'], scan['results']))
+        line.update(
+            scope=issues['scope'],
+            new_issues=issues['new_issues'],
+            fixed_issues=issues['fixed_issues'],
+            unchanged_count=issues['unchanged_count'],
+            old_error=issues.get('old_error')
+        )
+        if pdf_dir and issues['has_issues']:
+            title = f"{file_path} at {comparison['current_commit'][:10]}"
+            line.update(_write_pdf(pdf_dir, title, _report_name(file_path), scan))
+        yield line
+
+
+def _result_line(url, results):
+    return {
+        'url': url,
+        'error': None,
+        'summary': summarize_results(results),
+        'violations': [
+            {
+                'id': violation.get('id'),
+                'impact': violation.get('impact'),
+                'help': violation.get('help'),
+                'help_url': violation.get('helpUrl'),
+                'targets': [node.get('target') for node in violation.get('nodes', [])]
+            }
+            for violation in results.get('violations', [])
+        ]
+    }
+
+
+def _failed_line(url, error):
+    return {'url': url, 'error': error, 'summary': None, 'violations': []}
+
+
+def _write_pdf(pdf_dir, title, name, scan):
+    # Rendered in the calling process: each scan worker is already its own process
+    from report_render import render_pdf
+
+    path = os.path.join(pdf_dir, f'{name}.pdf')
+    try:
+        render_pdf(path, title, scan['results'], scan['screenshots'], scan['overview'])
+    except Exception as e:
+        logger.warning("Could not render a report for %s: %s", title, e)
+        return {'pdf': None, 'pdf_error': str(e)}
+    return {'pdf': path}
+
+
+def _report_name(value):
+    # Readable and unique file name for a URL or repository path
+    from scan_cache import hash_content
+
+    readable = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in value.split('://', 1)[-1]).strip('_.')
+    return f'{readable[:80]}-{hash_content(value)[:8]}'
+
+
+def _read_urls(args):
+    urls = list(args.urls)
+    if args.file:
+        f = sys.stdin if args.file == '-' else open(args.file)
+        with f:
+            urls.extend(line.strip() for line in f)
+    # Blank lines and comments are skipped; duplicates are scanned once
+    return list(dict.fromkeys(url for url in urls if url and not url.startswith('#')))
+
+
+def _revisions(args):
+    # OLD..NEW, or the branch and commit options
+    if not args.revisions:
+        return args.branch, args.commit
+    old, separator, new = args.revisions.partition('..')
+    if not separator or not old or not new:
+        raise ValueError(f"Expected a range like main~1..main, got {args.revisions}")
+    return new, old
+
+
+def _emit(lines, fail_on, impacts_of):
+    counts = {'lines': 0, 'failed': 0, 'over_threshold': 0}
+    for line in lines:
+        sys.stdout.write(json.dumps(line) + '\n')
+        sys.stdout.flush()
+        counts['lines'] += 1
+        if line.get('error'):
+            counts['failed'] += 1
+        elif exceeds(impacts_of(line), fail_on):
+            counts['over_threshold'] += 1
+    return counts
+
+
+def _exit_status(counts, what):
+    print(
+        f"{counts['lines']} {what}: {counts['over_threshold']} over the threshold, {counts['failed']} failed",
+        file=sys.stderr
+    )
+    if counts['failed']:
+        return EXIT_FAILED
+    if counts['over_threshold']:
+        return EXIT_VIOLATIONS
+    return EXIT_OK
+
+
+def scan_command(args):
+    try:
+        urls = _read_urls(args)
+    except OSError as e:
+        print(f"error: could not read URLs: {e}", file=sys.stderr)
+        return EXIT_USAGE
+    if not urls:
+        print("error: no URLs to scan", file=sys.stderr)
+        return EXIT_USAGE
+    if args.pdf_dir:
+        os.makedirs(args.pdf_dir, exist_ok=True)
+
+    options = {
+        'concurrency': args.concurrency,
+        'per_domain': args.per_domain,
+        'timeout': args.timeout,
+        'screenshot_mode': args.screenshot_mode
+    }
+    lines = scan_urls(urls, args.processes, args.pdf_dir, **options)
+    counts = _emit(lines, args.fail_on, lambda line: [violation['impact'] for violation in line['violations']])
+    return _exit_status(counts, 'pages scanned')
+
+
+def git_command(args):
+    try:
+        branch, commit_hash = _revisions(args)
+    except ValueError as e:
+        print(f"error: {e}", file=sys.stderr)
+        return EXIT_USAGE
+    if args.pdf_dir:
+        os.makedirs(args.pdf_dir, exist_ok=True)
+
+    lines = compare(args.repo, branch, commit_hash, args.workers, args.scope, args.pdf_dir)
+    try:
+        counts = _emit(lines, args.fail_on, lambda line: [issue['impact'] for issue in line.get('new_issues', [])])
+    except ValueError as e:
+        # Unknown branch, commit or scope
+        print(f"error: {e}", file=sys.stderr)
+        return EXIT_USAGE
+    except Exception as e:
+        # Clone, fetch, mirror lock or browser failures are not accessibility results
+        print(f"error: comparison failed: {type(e).__name__}: {_first_line(e)}", file=sys.stderr)
+        return EXIT_FAILED
+    return _exit_status(counts, 'changed pages')
+
+
+def _first_line(error):
+    lines = str(error).strip().splitlines()
+    return lines[0] if lines else ''
+
+
+def main(argv=None):
+    # Both commands scan with it; imported here so the module itself stays light for workers
+    from accessibility_checker import SCREENSHOT_MODES
+
+    parser = argparse.ArgumentParser(description='Check pages or repository changes for accessibility issues')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    scan = commands.add_parser('scan', help='Scan a list of URLs')
+    scan.add_argument('urls', nargs='*', help='URLs to scan')
+    scan.add_argument('--file', help="Read URLs from this file, one per line ('-' for stdin)")
+    scan.add_argument('--processes', type=int, default=DEFAULT_PROCESSES, help='Worker processes, each with its own browser')
+    scan.add_argument('--concurrency', type=int, help='Pages open at once per process')
+    scan.add_argument('--per-domain', type=int, help='Pages open at once per host and process')
+    scan.add_argument('--timeout', type=float, help='Seconds allowed per URL')
+    scan.add_argument('--screenshot-mode', choices=SCREENSHOT_MODES,
+                      help='Screenshots are only taken for PDFs')
+    scan.set_defaults(handler=scan_command)
+
+    git = commands.add_parser('git', help='Compare two commits of a repository')
+    git.add_argument('repo', help='Repository URL or path')
+    git.add_argument('revisions', nargs='?', help='OLD..NEW; defaults to --branch and its parent')
+    git.add_argument('--branch', default='main', help='Newer revision when no range is given')
+    git.add_argument('--commit', help='Older revision when no range is given')
+    git.add_argument('--workers', type=int, help='Pages scanned at once')
+    git.add_argument('--scope', help="'changed' to scan only changed elements, or 'page'")
+    git.set_defaults(handler=git_command)
+
+    for command in (scan, git):
+        command.add_argument('--fail-on', choices=FAIL_ON_LEVELS, default=DEFAULT_FAIL_ON,
+                             help='Exit with status 1 on violations of this impact or worse')
+        command.add_argument('--pdf-dir', help='Write a PDF report per page with violations to this directory')
+
+    args = parser.parse_args(argv)
+    # stdout carries only results
+    logging.basicConfig(level=logging.WARNING, stream=sys.stderr)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,299 @@
+import os
+import asyncio
+import posixpath
+from collections import deque
+from urllib.parse import urlsplit, urlunsplit, urldefrag, parse_qsl, urlencode
+from playwright.async_api import async_playwright
+from accessibility_checker import load_axe_script
+from async_checker import DEFAULT_URL_TIMEOUT, scan_url, failed_result
+from sitemap import fetch_sitemap_urls
+from tracing import span
+
+CRAWL_MAX_PAGES = int(os.getenv('CRAWL_MAX_PAGES', 50))
+CRAWL_MAX_DEPTH = int(os.getenv('CRAWL_MAX_DEPTH', 2))
+CRAWL_CONCURRENCY = int(os.getenv('CRAWL_CONCURRENCY', 4))
+CRAWL_FRONTIER_SIZE = int(os.getenv('CRAWL_FRONTIER_SIZE', 1000))
+
+# Full-page captures of every page would dominate memory, so crawls clip to the elements
+CRAWL_SCREENSHOT_MODES = ('element', 'full_page')
+CRAWL_SCREENSHOT_MODE = os.getenv('CRAWL_SCREENSHOT_MODE', 'element')
+
+# Links to these are downloads, not pages
+SKIP_EXTENSIONS = (
+    '.pdf', '.zip', '.gz', '.tar', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx',
+    '.jpg', '.jpeg', '.png', '.gif', '.svg', '.webp', '.ico',
+    '.mp3', '.mp4', '.mov', '.avi', '.webm', '.css', '.js', '.json', '.xml', '.rss'
+)
+
+# Query parameters that do not change the page
+TRACKING_PARAMS = ('fbclid', 'gclid', 'msclkid')
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+
+
+def normalize_url(url):
+    """
+    Canonical form of an http(s) URL, used to recognise pages already seen
+    Returns: The normalised URL, or None for other schemes and downloads
+    """
+    url, _ = urldefrag(url.strip())
+    try:
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return None
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parts.hostname:
+        return None
+
+    netloc = parts.hostname.lower()
+    if port and port != DEFAULT_PORTS[scheme]:
+        netloc = f'{netloc}:{port}'
+
+    path = parts.path or '/'
+    if path.lower().endswith(SKIP_EXTENSIONS):
+        return None
+    # Resolve dot segments but keep a meaningful trailing slash
+    normalised = posixpath.normpath(path)
+    path = normalised + '/' if path.endswith('/') and normalised != '/' else normalised
+    path = path.replace('//', '/')
+
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith('utm_') and key.lower() not in TRACKING_PARAMS
+    ))
+    return urlunsplit((scheme, netloc, path, query, ''))
+
+
+def origin(url):
+    parts = urlsplit(url)
+    return parts.scheme, parts.netloc
+
+
+class Frontier:
+    """Breadth-first queue of same-origin URLs still to scan, each enqueued at most once"""
+
+    def __init__(self, site_origin, max_size):
+        self.origin = site_origin
+        self.max_size = max_size
+        self.seen = set()
+        self.dropped = 0
+        self._queue = deque()
+
+    def add(self, url, depth):
+        """
+        Enqueue url at depth if it is a new page on the site
+        Returns: True if the URL was enqueued
+        """
+        url = normalize_url(url)
+        if url is None or origin(url) != self.origin or url in self.seen:
+            return False
+        if len(self._queue) >= self.max_size:
+            # Bounded: links beyond the limit are counted, not kept
+            self.dropped += 1
+            return False
+        self.seen.add(url)
+        self._queue.append((url, depth))
+        return True
+
+    def mark_seen(self, url):
+        url = normalize_url(url)
+        if url:
+            self.seen.add(url)
+
+    def pop(self):
+        return self._queue.popleft()
+
+    def __len__(self):
+        return len(self._queue)
+
+
+async def crawl(start_url=None, sitemap_url=None, max_pages=None, max_depth=None,
+                concurrency=None, timeout=None, screenshot_mode=None, frontier_size=None):
+    """
+    Discover and scan the pages of a site on a shared browser
+    Links are read from each page after it loads, so client-side navigation is followed too
+    Args:
+        start_url: Page to start from (optional if sitemap_url is given)
+        sitemap_url: sitemap.xml whose pages seed the crawl at depth 0 (optional)
+        max_pages: Maximum number of pages scanned
+        max_depth: Maximum number of links followed from a seed page
+        concurrency: Maximum pages open at once
+        timeout: Seconds allowed per page
+        screenshot_mode: One of CRAWL_SCREENSHOT_MODES (optional)
+        frontier_size: Maximum number of URLs waiting to be scanned
+    Yields: One result dict per page, with its 'depth', in the order the scans finish
+    """
+    max_pages = max_pages or CRAWL_MAX_PAGES
+    max_depth = CRAWL_MAX_DEPTH if max_depth is None else max_depth
+    concurrency = concurrency or CRAWL_CONCURRENCY
+    timeout = timeout or DEFAULT_URL_TIMEOUT
+    screenshot_mode = screenshot_mode or CRAWL_SCREENSHOT_MODE
+    if screenshot_mode not in CRAWL_SCREENSHOT_MODES:
+        raise ValueError(f"Unsupported crawl screenshot mode: {screenshot_mode}")
+
+    seeds = [start_url] if start_url else []
+    if sitemap_url:
+        seeds += fetch_sitemap_urls(sitemap_url, limit=max_pages)
+    first = next((normalize_url(url) for url in seeds if normalize_url(url)), None)
+    if first is None:
+        raise ValueError("A start URL or a sitemap with http(s) pages is required")
+
+    frontier = Frontier(origin(first), frontier_size or CRAWL_FRONTIER_SIZE)
+    for url in seeds:
+        frontier.add(url, 0)
+
+    axe_script = load_axe_script()
+
+    async with async_playwright() as p:
+        with span('browser_launch'):
+            browser = await p.chromium.launch(headless=True)
+        in_flight = set()
+        try:
+            async def run(url, depth):
+                try:
+                    result = await asyncio.wait_for(
+                        scan_url(browser, url, axe_script, screenshot_mode, collect_links=depth < max_depth),
+                        timeout
+                    )
+                except asyncio.TimeoutError:
+                    result = failed_result(url, f"Timed out after {timeout:g}s")
+                except Exception as e:
+                    result = failed_result(url, str(e))
+                result['depth'] = depth
+                return result
+
+            started = 0
+            while True:
+                while frontier and len(in_flight) < concurrency and started < max_pages:
+                    url, depth = frontier.pop()
+                    in_flight.add(asyncio.ensure_future(run(url, depth)))
+                    started += 1
+                if not in_flight:
+                    break
+
+                done, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    # Redirects elsewhere on the site count as visited; links off-site are not followed
+                    frontier.mark_seen(result['final_url'])
+                    if origin(normalize_url(result['final_url']) or result['final_url']) == frontier.origin:
+                        for link in result['links']:
+                            frontier.add(link, result['depth'] + 1)
+                    result['frontier_dropped'] = frontier.dropped
+                    yield result
+        finally:
+            for task in in_flight:
+                task.cancel()
+            await browser.close()
+
+
+def crawl_site(start_url=None, sitemap_url=None, timeout=None, **kwargs):
+    """
+    Crawl a site and aggregate the results into a single scan
+    Accepts the keyword arguments of crawl
+    Args:
+        timeout: Seconds allowed for the whole crawl; the browser is closed when it expires (optional)
+    Returns: Scan dict with the grouped results, one screenshot per rule and no overview
+    Raises: TimeoutError when the timeout expires
+    """
+    report = CrawlReport()
+
+    async def consume():
+        async for result in crawl(start_url, sitemap_url, **kwargs):
+            report.add(result)
+
+    async def bounded():
+        try:
+            await asyncio.wait_for(consume(), timeout)
+        except asyncio.TimeoutError:
+            raise TimeoutError("Crawl timed out")
+
+    asyncio.run(bounded())
+    return report.scan()
+
+
+class CrawlReport:
+    """Merges per-page results, grouping identical violations by rule and selector"""
+
+    def __init__(self):
+        self.pages = []
+        self.rules = {}
+        self.frontier_dropped = 0
+        self.timings = {}
+
+    def add(self, result):
+        """Fold one page result in; its screenshots are dropped once a rule has one"""
+        page = {
+            'url': result['url'],
+            'depth': result.get('depth', 0),
+            'error': result['error'],
+            'violations': 0
+        }
+        self.pages.append(page)
+        self.frontier_dropped = max(self.frontier_dropped, result.get('frontier_dropped', 0))
+        if result['error']:
+            return
+        for phase, seconds in (result.get('timings') or {}).items():
+            self.timings[phase] = self.timings.get(phase, 0) + seconds
+
+        violations = result['results'].get('violations', [])
+        page['violations'] = len(violations)
+        screenshots = result.get('screenshots') or []
+        for i, violation in enumerate(violations):
+            rule = self.rules.get(violation.get('id'))
+            if rule is None:
+                rule = self.rules[violation.get('id')] = {
+                    'id': violation.get('id'),
+                    'impact': violation.get('impact'),
+                    'description': violation.get('description', ''),
+                    'help': violation.get('help', ''),
+                    'helpUrl': violation.get('helpUrl', ''),
+                    'targets': {},
+                    'pages': [],
+                    'screenshot': None
+                }
+            rule['pages'].append(result['url'])
+            if rule['screenshot'] is None and i < len(screenshots) and screenshots[i]:
+                rule['screenshot'] = dict(screenshots[i], url=result['url'])
+            for node in violation.get('nodes', []):
+                for target in node.get('target', []):
+                    # Targets inside iframes or shadow roots are lists of selectors
+                    selector = ' >> '.join(target) if isinstance(target, list) else target
+                    pages = rule['targets'].setdefault(selector, [])
+                    if not pages or pages[-1] != result['url']:
+                        pages.append(result['url'])
+
+    def scan(self):
+        """Scan dict in the shape store_scan and generate_report_html expect"""
+        # Rules on the most pages first
+        rules = sorted(self.rules.values(), key=lambda rule: -len(rule['pages']))
+        violations = []
+        for rule in rules:
+            violations.append({
+                'id': rule['id'],
+                'impact': rule['impact'],
+                'description': rule['description'],
+                'help': rule['help'],
+                'helpUrl': rule['helpUrl'],
+                'pages': rule['pages'],
+                'nodes': [
+                    {'target': [selector], 'pages': pages}
+                    for selector, pages in sorted(rule['targets'].items(), key=lambda item: -len(item[1]))
+                ]
+            })
+        return {
+            'results': {
+                'violations': violations,
+                'pages': self.pages,
+                'crawl': {
+                    'pages_scanned': len(self.pages),
+                    'pages_failed': sum(1 for page in self.pages if page['error']),
+                    'frontier_dropped': self.frontier_dropped
+                }
+            },
+            'screenshots': [rule['screenshot'] for rule in rules],
+            'overview': None,
+            # Summed over every page, so they exceed the wall-clock time of a concurrent crawl
+            'timings': self.timings
+        }
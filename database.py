@@ -1,25 +1,59 @@
 import os
-from datetime import datetime
-from pymongo import MongoClient
-from dotenv import load_dotenv
+from datetime import datetime, timedelta
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+from mongo import get_database
+from tracing import traced
+from images import IMAGE_REF, content_hash, mimetype
+from summaries import IMPACTS, summarize_results
 import gridfs
 from bson import ObjectId
+import base64
+import gzip
+import json
+import logging
 
-# Load environment variables
-load_dotenv()
+logger = logging.getLogger(__name__)
+
+# Serves equality on user and type, the timestamp sort/range and keyset pagination; the URL
+# is only checked from index keys here
+REPORT_LIST_INDEX = [
+    ('metadata.user_id', ASCENDING),
+    ('metadata.type', ASCENDING),
+    ('metadata.timestamp', DESCENDING),
+    ('_id', DESCENDING),
+    ('metadata.url', ASCENDING)
+]
+
+# The same with the URL as an equality prefix, for listings filtered by URL
+REPORT_URL_INDEX = [
+    ('metadata.user_id', ASCENDING),
+    ('metadata.type', ASCENDING),
+    ('metadata.url', ASCENDING),
+    ('metadata.timestamp', DESCENDING),
+    ('_id', DESCENDING)
+]
+
+# Stored scan results are gzipped JSON, whatever they are downloaded as
+SCAN_SUFFIX = '.json.gz'
+
+REPORT_LIST_PROJECTION = {
+    'filename': 1,
+    'metadata.url': 1,
+    'metadata.timestamp': 1,
+    'metadata.type': 1,
+    'metadata.format': 1
+}
 
 class Database:
     def __init__(self):
-        # Get MongoDB URI from environment variables
-        self.mongo_uri = os.getenv('MONGO_URI')
-        if not self.mongo_uri:
-            raise ValueError("MongoDB URI not found in environment variables")
-        
-        # Initialize MongoDB client
-        self.client = MongoClient(self.mongo_uri)
-        self.db = self.client['accessibility_reports']
+        # Share the process-wide MongoDB client
+        self.db = get_database()
+        self.client = self.db.client
         self.fs = gridfs.GridFS(self.db)
+        self.ensure_indexes()
 
+    @traced('db_store_pdf')
     def store_pdf(self, pdf_path, url, user_id, metadata=None):
         """
         Store PDF in MongoDB using GridFS
@@ -31,10 +65,6 @@ class Database:
         Returns: The ID of the stored file
         """
         try:
-            # Read the PDF file
-            with open(pdf_path, 'rb') as pdf_file:
-                pdf_data = pdf_file.read()
-            
             # Prepare metadata
             base_metadata = {
                 'url': url,
@@ -47,54 +77,562 @@ class Database:
             if metadata:
                 base_metadata.update(metadata)
             
-            # Store in GridFS
-            file_id = self.fs.put(
-                pdf_data,
-                filename=f'accessibility-report-{datetime.now().strftime("%Y%m%d-%H%M%S")}.pdf',
-                metadata=base_metadata
-            )
+            # Stream into GridFS one chunk at a time
+            with open(pdf_path, 'rb') as pdf_file:
+                file_id = self.fs.put(
+                    pdf_file,
+                    filename=f'accessibility-report-{datetime.now().strftime("%Y%m%d-%H%M%S")}.pdf',
+                    contentType='application/pdf',
+                    metadata=base_metadata
+                )
             
             return str(file_id)
         
         except Exception as e:
             raise Exception(f"Failed to store PDF: {str(e)}")
 
-    def get_pdf(self, file_id, user_id=None):
+    @traced('db_store_scan')
+    def store_scan(self, scan, url, user_id, metadata=None):
         """
-        Retrieve PDF from MongoDB
+        Store raw scan results without rendering a PDF
+        The axe results are stored as compressed JSON and each screenshot as its own file
         Args:
-            file_id: ID of the PDF file
+            scan: Scan dict with 'results', 'screenshots' and 'overview'
+            url: URL or description of the report
+            user_id: ID of the user who created the report
+            metadata: Additional metadata to store (optional)
+        Returns: The ID of the stored report
+        """
+        try:
+            # Identical captures are stored once and shared by every violation and report using them
+            stored = {}
+            screenshot_ids = [
+                self._store_screenshot(screenshot['data'], user_id, stored) if screenshot else None
+                for screenshot in scan['screenshots']
+            ]
+            overview_id = self._store_screenshot(scan['overview'], user_id, stored) if scan.get('overview') else None
+
+            base_metadata = {
+                'url': url,
+                'timestamp': datetime.now(),
+                'type': metadata.get('type', 'accessibility_report') if metadata else 'accessibility_report',
+                'user_id': user_id,
+                'format': 'scan',
+                'screenshot_ids': screenshot_ids,
+                'overview_id': overview_id,
+                'violation_count': len(scan['results'].get('violations', [])),
+                'timings': scan.get('timings') or {},
+                'pdf_id': None
+            }
+            if metadata:
+                base_metadata.update(metadata)
+
+            file_id = self.fs.put(
+                gzip.compress(json.dumps(scan['results']).encode('utf-8')),
+                filename=f'accessibility-report-{datetime.now().strftime("%Y%m%d-%H%M%S")}{SCAN_SUFFIX}',
+                contentType='application/json',
+                encoding='gzip',
+                metadata=base_metadata
+            )
+            try:
+                self._record_summary(str(file_id), base_metadata, scan['results'])
+            except Exception as e:
+                # The report is stored; backfill_summaries can add the summary later
+                logger.warning("Failed to summarise report %s: %s", file_id, e)
+            return str(file_id)
+
+        except Exception as e:
+            raise Exception(f"Failed to store scan: {str(e)}")
+
+    def get_report(self, file_id, user_id=None):
+        """
+        Retrieve report metadata without reading its contents
+        Args:
+            file_id: ID of the report
             user_id: Optional user ID to verify ownership
-        Returns: The PDF data and filename
+        Returns: The report's GridFS metadata, with 'filename' added
+        """
+        try:
+            file_data = self.fs.get(ObjectId(file_id))
+        except Exception as e:
+            raise Exception(f"Failed to retrieve report: {str(e)}")
+
+        # Check if user has access to this file
+        if user_id and file_data.metadata.get('user_id') != user_id:
+            raise PermissionError("Access denied")
+
+        return dict(file_data.metadata, filename=file_data.filename)
+
+    @traced('db_load_scan')
+    def get_scan(self, file_id, user_id=None):
+        """
+        Retrieve the raw results of a scan stored with store_scan
+        Args:
+            file_id: ID of the report
+            user_id: Optional user ID to verify ownership
+        Returns: Scan dict with 'url', 'timestamp', 'results', 'screenshots' and 'overview',
+                 where images are IMAGE_REF references to stored screenshots
+        """
+        report = self.get_report(file_id, user_id)
+        if report.get('format') != 'scan':
+            raise ValueError("Report has no stored scan results")
+
+        results = json.loads(gzip.decompress(self.fs.get(ObjectId(file_id)).read()))
+        violations = results.get('violations', [])
+
+        # Images are referenced, not loaded; see get_screenshot
+        screenshots = []
+        for i, screenshot_id in enumerate(report['screenshot_ids']):
+            if screenshot_id is None:
+                screenshots.append(None)
+                continue
+            violation = violations[i] if i < len(violations) else {}
+            screenshots.append({
+                'data': IMAGE_REF + screenshot_id,
+                'description': violation.get('description', ''),
+                'impact': violation.get('impact', '')
+            })
+
+        return {
+            'url': report['url'],
+            'timestamp': report['timestamp'],
+            'results': results,
+            'screenshots': screenshots,
+            'overview': IMAGE_REF + report['overview_id'] if report.get('overview_id') else None
+        }
+
+    def get_screenshot(self, screenshot_id, user_id=None):
+        """
+        Retrieve a stored screenshot
+        Args:
+            screenshot_id: ID of the screenshot
+            user_id: Optional user ID to verify ownership
+        Returns: The image data
+        """
+        file_data = self.fs.get(ObjectId(screenshot_id))
+        if file_data.metadata.get('type') != 'screenshot':
+            raise ValueError("Not a screenshot")
+        if user_id and file_data.metadata.get('user_id') != user_id:
+            raise PermissionError("Access denied")
+        return file_data.read()
+
+    @traced('db_attach_pdf')
+    def attach_pdf(self, file_id, pdf_path, render_seconds=None):
+        """
+        Memoise the rendered PDF of a stored scan
+        Args:
+            file_id: ID of the report
+            pdf_path: Path to the rendered PDF
+            render_seconds: Time taken to render the PDF, kept with the scan timings (optional)
+        Returns: The ID of the PDF to serve
+        """
+        report = self.get_report(file_id)
+        with open(pdf_path, 'rb') as pdf_file:
+            pdf_id = self.fs.put(
+                pdf_file,
+                filename=pdf_filename(report['filename']),
+                contentType='application/pdf',
+                metadata={'type': 'rendered_pdf', 'report_id': file_id, 'user_id': report['user_id']}
+            )
+
+        update = {'metadata.pdf_id': str(pdf_id)}
+        if render_seconds is not None:
+            update['metadata.timings.pdf'] = render_seconds
+
+        # Another request may have rendered it first, keep whichever won
+        result = self.db.fs.files.update_one(
+            {'_id': ObjectId(file_id), 'metadata.pdf_id': None},
+            {'$set': update}
+        )
+        if result.modified_count == 0:
+            self.fs.delete(pdf_id)
+            return self.get_report(file_id)['pdf_id']
+        return str(pdf_id)
+
+    def open_pdf(self, file_id, user_id=None):
+        """
+        Open a stored PDF for streaming without reading it into memory
+        Args:
+            file_id: ID of the report
+            user_id: Optional user ID to verify ownership
+        Returns: A GridOut positioned at the start of the PDF, and the download filename
         """
         try:
             file_data = self.fs.get(ObjectId(file_id))
-            
-            # Check if user has access to this file
-            if user_id and file_data.metadata.get('user_id') != user_id:
-                raise Exception("Access denied")
-                
-            return file_data.read(), file_data.filename
         except Exception as e:
             raise Exception(f"Failed to retrieve PDF: {str(e)}")
 
-    def list_reports(self, user_id):
+        # Check if user has access to this file
+        if user_id and file_data.metadata.get('user_id') != user_id:
+            raise PermissionError("Access denied")
+
+        # Scans point at their rendered PDF once it exists
+        filename = pdf_filename(file_data.filename)
+        if file_data.metadata.get('format') == 'scan':
+            if not file_data.metadata.get('pdf_id'):
+                raise Exception("Report has not been rendered yet")
+            file_data = self.fs.get(ObjectId(file_data.metadata['pdf_id']))
+
+        return file_data, filename
+
+    def delete_report(self, file_id):
+        """
+        Delete a stored report along with its screenshots and rendered PDF
+        Screenshots still used by another report are kept
+        Args:
+            file_id: ID of the report
+        """
+        report = self.get_report(file_id)
+        images = set(report.get('screenshot_ids') or []) | {report.get('overview_id')}
+        images.discard(None)
+        self.fs.delete(ObjectId(file_id))
+
+        summary = self.db.scan_summaries.find_one_and_delete({'_id': file_id})
+        if summary:
+            self._apply_rollups(summary, -1)
+
+        for image_id in images:
+            if not self.db.fs.files.find_one({
+                '$or': [{'metadata.screenshot_ids': image_id}, {'metadata.overview_id': image_id}]
+            }, {'_id': 1}):
+                self.fs.delete(ObjectId(image_id))
+        if report.get('pdf_id'):
+            self.fs.delete(ObjectId(report['pdf_id']))
+
+    def _store_screenshot(self, data, user_id, stored=None):
+        """
+        Store a base64 image once per user, keyed by its content hash
+        Args:
+            data: base64 image data, or an IMAGE_REF reference to an image already stored
+            stored: Dict of hashes stored by the current call, to skip repeated lookups (optional)
+        Returns: The ID of the stored image
+        """
+        if data.startswith(IMAGE_REF):
+            return data[len(IMAGE_REF):]
+
+        image = base64.b64decode(data)
+        digest = content_hash(image)
+        if stored is not None and digest in stored:
+            return stored[digest]
+
+        query = {'metadata.type': 'screenshot', 'metadata.user_id': user_id, 'metadata.sha256': digest}
+        existing = self.db.fs.files.find_one(query, {'_id': 1})
+        if existing:
+            file_id = str(existing['_id'])
+        else:
+            new_id = ObjectId()
+            try:
+                self.fs.put(
+                    image,
+                    _id=new_id,
+                    contentType=mimetype(image),
+                    metadata={'type': 'screenshot', 'user_id': user_id, 'sha256': digest}
+                )
+                file_id = str(new_id)
+            except gridfs.errors.FileExists:
+                # A concurrent scan stored the same image first; the unique screenshot_hash
+                # index rejected this copy after its chunks were written
+                self.db.fs.chunks.delete_many({'files_id': new_id})
+                file_id = str(self.db.fs.files.find_one(query, {'_id': 1})['_id'])
+        if stored is not None:
+            stored[digest] = file_id
+        return file_id
+
+    @traced('db_list_reports')
+    def list_reports(self, user_id, limit=None, before=None, url=None, since=None, until=None,
+                     report_type='accessibility_report'):
         """
-        List all accessibility reports for a specific user
+        List reports for a specific user, most recent first
+        Sorting, filtering and pagination run on REPORT_LIST_INDEX, or REPORT_URL_INDEX with a URL
         Args:
             user_id: ID of the user
+            limit: Maximum number of reports to return (optional)
+            before: Cursor from report_cursor(); only older reports are returned (optional)
+            url: Only reports for this URL (optional)
+            since: Only reports at or after this datetime (optional)
+            until: Only reports before this datetime (optional)
+            report_type: Report type, or a list of report types, to list
         Returns: List of report metadata
         """
+        query = {
+            'metadata.user_id': user_id,
+            'metadata.type': report_type if isinstance(report_type, str) else {'$in': list(report_type)}
+        }
+        if url:
+            query['metadata.url'] = url
+
+        timestamp_range = {}
+        if since:
+            timestamp_range['$gte'] = since
+        if until:
+            timestamp_range['$lt'] = until
+        if timestamp_range:
+            query['metadata.timestamp'] = timestamp_range
+
+        # Keyset pagination on (timestamp, _id), both descending
+        if before:
+            before_timestamp, before_id = parse_report_cursor(before)
+            query['$or'] = [
+                {'metadata.timestamp': {'$lt': before_timestamp}},
+                {'metadata.timestamp': before_timestamp, '_id': {'$lt': before_id}}
+            ]
+
+        cursor = self.db.fs.files.find(query, REPORT_LIST_PROJECTION).sort(
+            [('metadata.timestamp', DESCENDING), ('_id', DESCENDING)]
+        )
+        if limit:
+            cursor = cursor.limit(limit)
+
         reports = []
-        for grid_out in self.fs.find({
-            "metadata.type": "accessibility_report",
-            "metadata.user_id": user_id
-        }):
+        for doc in cursor:
+            metadata = doc.get('metadata', {})
             reports.append({
-                'file_id': str(grid_out._id),
-                'filename': grid_out.filename,
-                'url': grid_out.metadata.get('url'),
-                'timestamp': grid_out.metadata.get('timestamp'),
-                'type': grid_out.metadata.get('type')
+                'file_id': str(doc['_id']),
+                'filename': pdf_filename(doc.get('filename')),
+                'url': metadata.get('url'),
+                'timestamp': metadata.get('timestamp'),
+                'type': metadata.get('type'),
+                'format': metadata.get('format', 'pdf')
             })
-        return reports 
\ No newline at end of file
+        return reports
+
+    def _record_summary(self, file_id, metadata, results):
+        # Written next to every stored scan so trends never read report contents
+        summary = dict(
+            summarize_results(results),
+            _id=file_id,
+            user_id=metadata['user_id'],
+            url=metadata['url'],
+            type=metadata['type'],
+            commit=metadata.get('commit'),
+            timestamp=metadata['timestamp'],
+            day=metadata['timestamp'].strftime('%Y-%m-%d')
+        )
+        self.db.scan_summaries.insert_one(summary)
+        self._apply_rollups(summary, 1)
+
+    def _apply_rollups(self, summary, sign):
+        """Add a summary to, or with sign -1 remove it from, the user, URL and daily rollups"""
+        increments = {
+            'scans': sign,
+            'violations': sign * summary['violations'],
+            'nodes': sign * summary['nodes']
+        }
+        for impact, count in summary['by_impact'].items():
+            increments[f'by_impact.{impact}'] = sign * count
+        rule_increments = {f'by_rule.{rule}': sign * count for rule, count in summary['by_rule'].items()}
+
+        user_id, url = summary['user_id'], summary['url']
+        update = {'$inc': increments}
+        if sign > 0:
+            update['$max'] = {'last_timestamp': summary['timestamp']}
+        self.db.rollup_users.update_one({'user_id': user_id}, update, upsert=True)
+        day_update = {'$inc': dict(increments, **rule_increments)}
+        self.db.rollup_days.update_one(
+            {'user_id': user_id, 'url': url, 'day': summary['day']}, day_update, upsert=True
+        )
+        self.db.rollup_user_days.update_one({'user_id': user_id, 'day': summary['day']}, day_update, upsert=True)
+
+        url_update = {'$inc': dict(increments, **rule_increments)}
+        if sign > 0:
+            # The newest scan of a URL is kept as its current state
+            url_update['$max'] = {'last_timestamp': summary['timestamp']}
+            self.db.rollup_urls.update_one({'user_id': user_id, 'url': url}, url_update, upsert=True)
+            self.db.rollup_urls.update_one(
+                {'user_id': user_id, 'url': url, 'last_timestamp': summary['timestamp']},
+                {'$set': {'last': _last_scan(summary)}}
+            )
+        else:
+            self.db.rollup_urls.update_one({'user_id': user_id, 'url': url}, url_update)
+            self._reset_last_scan(user_id, url, summary['_id'])
+
+    def _reset_last_scan(self, user_id, url, removed_id):
+        # Point a URL back at its newest remaining scan once the current one is deleted
+        rollup = self.db.rollup_urls.find_one({'user_id': user_id, 'url': url}, {'last.report_id': 1})
+        if not rollup or (rollup.get('last') or {}).get('report_id') != removed_id:
+            return
+        newest = self.db.scan_summaries.find_one(
+            {'user_id': user_id, 'url': url}, {'by_rule': 0}, sort=[('timestamp', DESCENDING)]
+        )
+        if newest:
+            update = {'$set': {'last_timestamp': newest['timestamp'], 'last': _last_scan(newest)}}
+        else:
+            update = {'$unset': {'last_timestamp': '', 'last': ''}}
+        self.db.rollup_urls.update_one({'user_id': user_id, 'url': url}, update)
+
+    @traced('db_history')
+    def history(self, user_id, url=None, days=30, recent=20):
+        """
+        Violation trends from the rollup collections, without reading any report
+        Args:
+            user_id: ID of the user
+            url: Only this URL (optional)
+            days: Days of daily totals to return
+            recent: Number of latest scan summaries to return
+        Returns: Dict with 'totals', daily 'trend', the most frequent 'rules' over those days,
+                 per-URL 'urls' and 'recent' scans
+        """
+        scope = {'user_id': user_id}
+        if url:
+            scope['url'] = url
+        start = (datetime.now() - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+
+        # Daily rollups are kept per URL and per user
+        days_collection = self.db.rollup_days if url else self.db.rollup_user_days
+        trend = {}
+        rules = {}
+        for doc in days_collection.find(dict(scope, day={'$gte': start})):
+            for rule, count in (doc.get('by_rule') or {}).items():
+                rules[rule] = rules.get(rule, 0) + count
+            day = trend.setdefault(doc['day'], {'day': doc['day'], 'scans': 0, 'violations': 0, 'nodes': 0,
+                                                'by_impact': dict.fromkeys(IMPACTS + ('unknown',), 0)})
+            for key in ('scans', 'violations', 'nodes'):
+                day[key] += doc.get(key, 0)
+            for impact, count in (doc.get('by_impact') or {}).items():
+                day['by_impact'][impact] = day['by_impact'].get(impact, 0) + count
+
+        if url:
+            totals = self.db.rollup_urls.find_one(scope, {'_id': 0, 'last': 0})
+        else:
+            totals = self.db.rollup_users.find_one(scope, {'_id': 0})
+
+        urls = self.db.rollup_urls.find(scope, {'_id': 0, 'by_rule': 0}).sort('last_timestamp', DESCENDING).limit(50)
+        summaries = self.db.scan_summaries.find(scope, {'by_rule': 0}).sort('timestamp', DESCENDING).limit(recent)
+
+        return {
+            'totals': _rollup_view(totals),
+            'trend': [trend[day] for day in sorted(trend) if trend[day]['scans'] > 0],
+            'rules': [
+                {'rule': rule, 'nodes': count}
+                for rule, count in sorted(rules.items(), key=lambda item: -item[1])[:10] if count > 0
+            ],
+            'urls': [_rollup_view(doc) for doc in urls if doc.get('scans', 0) > 0],
+            'recent': [_summary_view(doc) for doc in summaries]
+        }
+
+    def backfill_summaries(self, user_id=None):
+        """
+        Summarise stored scans that predate scan summaries; reads each report once
+        Returns: Number of scans summarised
+        """
+        query = {'metadata.format': 'scan'}
+        if user_id:
+            query['metadata.user_id'] = user_id
+        count = 0
+        for doc in self.db.fs.files.find(query, {'metadata': 1}):
+            file_id = str(doc['_id'])
+            if self.db.scan_summaries.find_one({'_id': file_id}, {'_id': 1}):
+                continue
+            with self.fs.get(doc['_id']) as grid_out:
+                results = json.loads(gzip.decompress(grid_out.read()))
+            self._record_summary(file_id, doc['metadata'], results)
+            count += 1
+        return count
+
+    def ensure_indexes(self):
+        """Create the indexes used by report listing, screenshot deduplication and history"""
+        self.db.fs.files.create_index(REPORT_LIST_INDEX, name='report_list')
+        self.db.fs.files.create_index(REPORT_URL_INDEX, name='report_list_url')
+        self._ensure_screenshot_index()
+        self.db.fs.files.create_index('metadata.screenshot_ids', name='screenshot_refs', sparse=True)
+        self.db.fs.files.create_index('metadata.overview_id', name='overview_refs', sparse=True)
+        self.db.scan_summaries.create_index(
+            [('user_id', ASCENDING), ('url', ASCENDING), ('timestamp', DESCENDING)], name='summary_list'
+        )
+        self.db.scan_summaries.create_index([('user_id', ASCENDING), ('timestamp', DESCENDING)], name='summary_recent')
+        self.db.rollup_users.create_index('user_id', name='rollup_user', unique=True)
+        self.db.rollup_urls.create_index([('user_id', ASCENDING), ('url', ASCENDING)], name='rollup_url', unique=True)
+        self.db.rollup_urls.create_index([('user_id', ASCENDING), ('last_timestamp', DESCENDING)], name='rollup_url_recent')
+        self.db.rollup_days.create_index(
+            [('user_id', ASCENDING), ('url', ASCENDING), ('day', ASCENDING)], name='rollup_day', unique=True
+        )
+        self.db.rollup_user_days.create_index(
+            [('user_id', ASCENDING), ('day', ASCENDING)], name='rollup_user_day', unique=True
+        )
+
+    def _ensure_screenshot_index(self):
+        # Unique, so concurrent scans cannot store one image twice. Earlier versions created a
+        # non-unique index on the same keys, which MongoDB will not keep alongside this one
+        keys = [('metadata.user_id', ASCENDING), ('metadata.sha256', ASCENDING)]
+        partial = {'metadata.type': 'screenshot'}
+        if 'screenshot_hash' in self.db.fs.files.index_information():
+            self.db.fs.files.drop_index('screenshot_hash')
+        try:
+            self.db.fs.files.create_index(keys, name='screenshot_hash_unique', unique=True,
+                                          partialFilterExpression=partial)
+        except OperationFailure as e:
+            # Duplicates stored before the index existed; lookups still deduplicate new images
+            logger.warning("Could not create the unique screenshot index: %s", e)
+            self.db.fs.files.create_index(keys, name='screenshot_hash', partialFilterExpression=partial)
+
+
+class ScreenshotLoader:
+    """
+    Loads a user's stored screenshots for write_report_pdf
+    Picklable, so reports can be rendered in other processes; each process opens its own Database
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+
+    def __call__(self, screenshot_id):
+        return _process_database().get_screenshot(screenshot_id, self.user_id)
+
+
+_database = None
+_database_pid = None
+
+
+def _process_database():
+    global _database, _database_pid
+    if _database is None or _database_pid != os.getpid():
+        _database = Database()
+        _database_pid = os.getpid()
+    return _database
+
+
+def pdf_filename(filename):
+    """Download name of a report; scan results are stored as gzipped JSON and served as a PDF"""
+    if filename and filename.endswith(SCAN_SUFFIX):
+        return filename[:-len(SCAN_SUFFIX)] + '.pdf'
+    return filename
+
+
+def _rollup_view(doc):
+    # JSON-safe rollup
+    if not doc:
+        return None
+    doc = {key: value for key, value in doc.items() if key != '_id'}
+    if doc.get('last_timestamp'):
+        doc['last_timestamp'] = doc['last_timestamp'].isoformat()
+    return doc
+
+
+def _last_scan(summary):
+    # Current state of a URL, taken from its newest scan summary
+    return {
+        'report_id': summary['_id'],
+        'violations': summary['violations'],
+        'nodes': summary['nodes'],
+        'by_impact': summary['by_impact']
+    }
+
+
+def _summary_view(doc):
+    # JSON-safe scan summary, keyed by report_id
+    view = {key: value for key, value in doc.items() if key != '_id'}
+    view.update(report_id=doc['_id'], timestamp=doc['timestamp'].isoformat())
+    return view
+
+
+def report_cursor(report):
+    """Pagination cursor pointing just after a report returned by list_reports"""
+    return f"{report['timestamp'].isoformat()}_{report['file_id']}"
+
+
+def parse_report_cursor(cursor):
+    try:
+        timestamp, file_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(timestamp), ObjectId(file_id)
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
@@ -0,0 +1,305 @@
+import os
+import re
+from html.parser import HTMLParser
+
+# More changed regions than this are scanned as a whole page
+MAX_REGIONS = int(os.getenv('GIT_SCOPE_MAX_REGIONS', 25))
+
+VOID_ELEMENTS = {
+    'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta',
+    'param', 'source', 'track', 'wbr'
+}
+HEAD_ELEMENTS = {'base', 'link', 'meta', 'noscript', 'script', 'style', 'template', 'title'}
+
+# Changes to these can affect any part of the page
+GLOBAL_ELEMENTS = {'html', 'head', 'body', 'script', 'style', 'link', 'meta', 'base', 'template'}
+
+# Elements the HTML parser closes when a sibling of the same group opens
+IMPLIED_END = {
+    'p': {'p'}, 'li': {'li'}, 'dt': {'dt', 'dd'}, 'dd': {'dt', 'dd'}, 'option': {'option'},
+    'tr': {'tr'}, 'td': {'td', 'th'}, 'th': {'td', 'th'}
+}
+
+# Opening any of these inside a <p> closes it, so the source nesting is not the DOM's
+BLOCK_ELEMENTS = {
+    'address', 'article', 'aside', 'blockquote', 'details', 'div', 'dl', 'fieldset',
+    'figure', 'footer', 'form', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'header', 'hr',
+    'main', 'menu', 'nav', 'ol', 'p', 'pre', 'section', 'table', 'ul'
+}
+
+SIMPLE_ID = re.compile(r'^[A-Za-z][\w-]*$')
+
+# Left out of the identity check: scripts commonly change these at runtime
+DYNAMIC_ATTRIBUTES = {'class', 'style', 'value', 'checked', 'selected', 'open', 'hidden'}
+
+# Resolves the regions in the page and runs axe on them, their ancestors and nothing else.
+# Returns null when a selector does not match exactly one element that, along with the
+# ancestors on its path, has the source's tags, attributes and classes; e.g. when a script
+# inserted a sibling and shifted an nth-of-type step.
+SCOPED_AXE_JS = '''async (regions) => {
+    const same = (element, identity) => element
+        && element.tagName.toLowerCase() === identity.tag
+        && Object.entries(identity.attributes).every(([name, value]) => element.getAttribute(name) === value)
+        && identity.classes.every((name) => element.classList.contains(name));
+
+    const targets = [];
+    for (const region of regions) {
+        const matches = document.querySelectorAll(region.selector);
+        if (matches.length !== 1 || !same(matches[0], region)) {
+            return null;
+        }
+        let node = matches[0];
+        for (const ancestor of region.path) {
+            node = node.parentElement;
+            if (!same(node, ancestor)) {
+                return null;
+            }
+        }
+        targets.push(matches[0]);
+    }
+
+    // Siblings of every ancestor that hold no region are left out
+    const onPath = new Set();
+    for (const target of targets) {
+        for (let node = target.parentElement; node && node !== document.documentElement; node = node.parentElement) {
+            onPath.add(node);
+        }
+    }
+    const exclude = [];
+    for (const ancestor of onPath) {
+        for (const child of ancestor.children) {
+            if (!onPath.has(child) && !targets.includes(child)) {
+                exclude.push(child);
+            }
+        }
+    }
+
+    let left = Infinity, top = Infinity, right = -Infinity, bottom = -Infinity;
+    for (const target of targets) {
+        const rect = target.getBoundingClientRect();
+        left = Math.min(left, rect.left + window.scrollX);
+        top = Math.min(top, rect.top + window.scrollY);
+        right = Math.max(right, rect.right + window.scrollX);
+        bottom = Math.max(bottom, rect.bottom + window.scrollY);
+    }
+    const bounds = right > left && bottom > top ? {
+        x: left, y: top, width: right - left, height: bottom - top,
+        pageWidth: document.documentElement.scrollWidth,
+        pageHeight: document.documentElement.scrollHeight
+    } : null;
+
+    const results = await axe.run({include: [document.body], exclude: exclude});
+    return {results: results, bounds: bounds};
+}'''
+
+
+class AmbiguousScope(ValueError):
+    """Raised when changed lines cannot be mapped to DOM elements with confidence"""
+
+
+class _Element:
+    def __init__(self, tag, attrs, parent, start):
+        self.tag = tag
+        self.attrs = {name: value or '' for name, value in attrs}
+        self.id = self.attrs.get('id')
+        self.parent = parent
+        self.children = []
+        self.start = start
+        self.end = start
+
+
+class _SourceTree(HTMLParser):
+    """Elements of an HTML source with the lines they start and end on"""
+
+    def __init__(self):
+        super().__init__()
+        self.root = _Element('#document', [], None, 1)
+        self.stack = [self.root]
+        self.owners = {}
+        self.irregular = None
+
+    def handle_starttag(self, tag, attrs):
+        line = self.getpos()[0]
+        top = self.stack[-1]
+        if top.tag in IMPLIED_END.get(tag, ()):
+            self._close(line)
+            top = self.stack[-1]
+        elif top.tag == 'p' and tag in BLOCK_ELEMENTS:
+            self.irregular = self.irregular or f"<{tag}> inside <p> on line {line}"
+        elif top.tag == 'table' and tag == 'tr':
+            self.irregular = self.irregular or f"<tr> without <tbody> on line {line}"
+
+        element = _Element(tag, attrs, top, line)
+        top.children.append(element)
+        end = line + self.get_starttag_text().count('\n')
+        self._own(element, line, end)
+        if tag in VOID_ELEMENTS:
+            element.end = end
+        else:
+            self.stack.append(element)
+
+    def handle_startendtag(self, tag, attrs):
+        # Outside SVG and MathML a trailing slash does not close the element
+        foreign = any(element.tag in ('svg', 'math') for element in self.stack)
+        self.handle_starttag(tag, attrs)
+        if tag not in VOID_ELEMENTS:
+            if not foreign:
+                self.irregular = self.irregular or f"Self-closing <{tag}/> on line {self.getpos()[0]}"
+            self._close(self.getpos()[0])
+
+    def handle_endtag(self, tag):
+        line = self.getpos()[0]
+        open_tags = [element.tag for element in self.stack]
+        if tag not in open_tags:
+            self.irregular = self.irregular or f"</{tag}> without an open element on line {line}"
+            return
+        while self.stack[-1].tag != tag:
+            if self.stack[-1].tag not in IMPLIED_END:
+                self.irregular = self.irregular or f"<{self.stack[-1].tag}> not closed before line {line}"
+            self._close(line)
+        self._own(self.stack[-1], line, line)
+        self._close(line)
+
+    def handle_data(self, data):
+        line = self.getpos()[0]
+        for offset, text in enumerate(data.split('\n')):
+            if text.strip():
+                self._own(self.stack[-1], line + offset, line + offset)
+
+    def handle_comment(self, data):
+        line = self.getpos()[0]
+        self._own(self.stack[-1], line, line + data.count('\n'))
+
+    def close(self):
+        super().close()
+        last = self.getpos()[0]
+        while len(self.stack) > 1:
+            self._close(last)
+
+    def _close(self, line):
+        self.stack.pop().end = line
+
+    def _own(self, element, start, end):
+        for line in range(start, end + 1):
+            self.owners.setdefault(line, []).append(element)
+
+
+def changed_regions(html, lines):
+    """
+    Map changed source lines to the elements they produce
+    Args:
+        html: Page source
+        lines: Changed line numbers, from FilePatch.new_lines or old_lines
+    Returns: List of {'selector': CSS selector, 'tag', 'attributes', 'classes', 'path'} dicts,
+             outermost regions only; 'path' holds the tag, attributes and classes of the
+             ancestors the selector steps through
+    Raises: AmbiguousScope when the page should be scanned as a whole
+    """
+    if not lines:
+        raise AmbiguousScope("No changed lines")
+
+    tree = _SourceTree()
+    try:
+        tree.feed(html)
+        tree.close()
+    except Exception as e:
+        raise AmbiguousScope(f"Could not parse the page: {e}")
+    if tree.irregular:
+        raise AmbiguousScope(f"Source nesting differs from the DOM: {tree.irregular}")
+
+    body = _body(tree.root)
+    source_lines = html.split('\n')
+    regions = []
+    for line in sorted(set(lines)):
+        if line > len(source_lines) or not source_lines[line - 1].strip():
+            continue
+        owners = tree.owners.get(line)
+        if not owners:
+            raise AmbiguousScope(f"Line {line} is outside any element")
+        for element in owners:
+            if element is body or element.tag in GLOBAL_ELEMENTS or not _inside(element, body):
+                raise AmbiguousScope(f"Line {line} changes <{element.tag}>, which affects the whole page")
+            if element not in regions:
+                regions.append(element)
+
+    if not regions:
+        raise AmbiguousScope("Only blank lines changed")
+
+    # Regions inside other regions are already covered
+    outermost = [element for element in regions if not any(_inside(element, other) for other in regions if other is not element)]
+    if len(outermost) > MAX_REGIONS:
+        raise AmbiguousScope(f"{len(outermost)} changed regions")
+
+    unique_ids = _unique_ids(tree.root)
+    regions = []
+    for element in outermost:
+        selector, path = _selector(element, body, unique_ids)
+        regions.append(dict(_identity(element), selector=selector, path=[_identity(node) for node in path]))
+    return regions
+
+
+def _body(root):
+    # An explicit <body>, otherwise the parser's implied one
+    html = next((child for child in root.children if child.tag == 'html'), root)
+    body = next((child for child in html.children if child.tag == 'body'), None)
+    if body:
+        return body
+
+    # Leading head elements go into <head>; everything from the first other element on into <body>
+    implied = _Element('body', [], html, 1)
+    children = [child for child in html.children if child.tag != 'head']
+    while children and children[0].tag in HEAD_ELEMENTS:
+        children.pop(0)
+    implied.children = children
+    for child in children:
+        child.parent = implied
+    return implied
+
+
+def _inside(element, ancestor):
+    node = element.parent
+    while node is not None:
+        if node is ancestor:
+            return True
+        node = node.parent
+    return False
+
+
+def _unique_ids(root):
+    counts = {}
+    pending = [root]
+    while pending:
+        element = pending.pop()
+        if element.id:
+            counts[element.id] = counts.get(element.id, 0) + 1
+        pending.extend(element.children)
+    return {element_id for element_id, count in counts.items() if count == 1}
+
+
+def _identity(element):
+    # What the browser checks to be sure a selector found the source element
+    return {
+        'tag': element.tag,
+        'attributes': {name: value for name, value in element.attrs.items() if name not in DYNAMIC_ATTRIBUTES},
+        'classes': element.attrs.get('class', '').split()
+    }
+
+
+def _selector(element, body, unique_ids):
+    # Anchored at the nearest ancestor with a unique id, otherwise at body.
+    # Also returns the ancestors the selector steps through, innermost first
+    parts = []
+    path = []
+    node = element
+    while node is not body:
+        if node.id in unique_ids and SIMPLE_ID.match(node.id):
+            parts.append(f'#{node.id}')
+            break
+        siblings = [sibling for sibling in node.parent.children if sibling.tag == node.tag]
+        parts.append(f'{node.tag}:nth-of-type({siblings.index(node) + 1})')
+        node = node.parent
+        if node is not body:
+            path.append(node)
+    else:
+        parts.append('body')
+    return ' > '.join(reversed(parts)), path
@@ -1,84 +1,400 @@
-import tempfile
 import os
-from git import Repo, GitCommandError
-import shutil
-from accessibility_checker import check_accessibility
-import base64
+import asyncio
+import threading
+import mimetypes
+from urllib.parse import urlparse, quote, unquote
+from git import GitCommandError, BadName
+from accessibility_checker import DEFAULT_SCREENSHOT_MODE, scan_options
+from async_checker import iter_check_many
+from scan_cache import get_scan_cache, make_key
+from repo_cache import open_mirror
+from patch_filter import parse_patch, is_page, is_asset, is_cosmetic, referenced_assets
+from dom_scope import changed_regions, AmbiguousScope
+from tracing import span
 
-def compare_commits(repo_url, branch='main', commit_hash=None):
-    temp_dir = tempfile.mkdtemp()
+# Changed files are scanned concurrently on one browser
+SCAN_WORKERS = int(os.getenv('GIT_SCAN_WORKERS', 4))
+
+# 'changed' runs axe only on the elements a diff touches, falling back to the whole
+# page when they cannot be located; 'page' always scans whole pages
+SCAN_SCOPES = ('changed', 'page')
+SCAN_SCOPE = os.getenv('GIT_SCAN_SCOPE', 'changed')
+
+# Pages are served from the commit tree under this origin, so relative assets resolve
+SCAN_ORIGIN = 'http://git-scan.invalid'
+
+# Unchanged pages rescanned because a stylesheet or script they load changed, at most
+ASSET_PAGE_LIMIT = int(os.getenv('GIT_ASSET_PAGE_LIMIT', 20))
+
+def compare_commits(repo_url, branch='main', commit_hash=None, workers=None, scope=None):
+    scope = scope or SCAN_SCOPE
+    if scope not in SCAN_SCOPES:
+        raise ValueError(f"Unknown scan scope: {scope}")
+    # Read from the shared bare mirror, fetched incrementally; nothing is checked out
+    with open_mirror(repo_url) as repo:
+        return _compare(repo, branch, commit_hash, workers or SCAN_WORKERS, scope)
+
+def _compare(repo, branch, commit_hash, workers, scope):
+    """Diff branch against commit_hash in repo and scan the changed HTML files"""
+    # Get the head commit of the specified branch
+    try:
+        current_commit = repo.commit(branch)
+    except (BadName, ValueError, GitCommandError):
+        raise ValueError(f"Invalid branch: {branch}")
+
+    # If no commit hash is provided, use the previous commit
+    if not commit_hash:
+        commit_hash = current_commit.parents[0].hexsha if current_commit.parents else current_commit.hexsha
+
+    # Get the specified commit
     try:
-        # Clone the repository
-        repo = Repo.clone_from(repo_url, temp_dir)
-        
-        # Fetch all branches
-        repo.remotes.origin.fetch()
-        
-        # Checkout the specified branch
-        repo.git.checkout(branch)
-        
-        # Get the current HEAD commit
-        current_commit = repo.head.commit
-        
-        # If no commit hash is provided, use the previous commit
-        if not commit_hash:
-            commit_hash = current_commit.parents[0].hexsha if current_commit.parents else current_commit.hexsha
-        
-        # Get the specified commit
-        try:
-            old_commit = repo.commit(commit_hash)
-        except GitCommandError:
-            raise ValueError(f"Invalid commit hash: {commit_hash}")
-        
-        # Get the diff between commits
+        old_commit = repo.commit(commit_hash)
+    except (BadName, ValueError, GitCommandError):
+        raise ValueError(f"Invalid commit hash: {commit_hash}")
+
+    # Get the diff between commits
+    with span('git_diff'):
         diff = current_commit.diff(old_commit)
-        
-        # Process the diff results
-        results = {
-            'current_commit': current_commit.hexsha,
-            'old_commit': old_commit.hexsha,
-            'changed_files': [],
-            'diffs': {},
-            'accessibility_issues': {}
-        }
-        
-        for item in diff:
-            file_path = item.a_path if item.a_path else item.b_path
-            results['changed_files'].append(file_path)
-            
-            # Get the diff content
+
+    # Process the diff results
+    results = {
+        'current_commit': current_commit.hexsha,
+        'old_commit': old_commit.hexsha,
+        'changed_files': [],
+        'diffs': {},
+        'accessibility_issues': {}
+    }
+
+    # One git call for every file's patch, parsed in-process
+    try:
+        with span('git_patch'):
+            patches = parse_patch(repo.git.diff(old_commit.hexsha, current_commit.hexsha, '--no-color', '--no-ext-diff'))
+    except GitCommandError:
+        patches = {}
+
+    items = []
+    for item in diff:
+        file_path = item.a_path if item.a_path else item.b_path
+        results['changed_files'].append(file_path)
+        items.append((file_path, item))
+
+        # Get the diff content
+        patch = patches.get(file_path)
+        results['diffs'][file_path] = patch.text if patch else "Error getting diff content"
+
+    # Stylesheets and scripts with more than whitespace or comment changes
+    changed_assets = {
+        file_path for file_path, item in items
+        if is_asset(file_path) and item.a_blob is not None
+        and not (patches.get(file_path) and is_cosmetic(patches[file_path]))
+    }
+
+    # Stylesheets and scripts loaded by each page of the new tree, when any of them changed
+    loaded = tree_page_assets(current_commit) if changed_assets else {}
+
+    # Decide which pages need scanning
+    html_files = []
+    skipped = {}
+    # Pages rescanned only because a stylesheet or script they load changed
+    asset_triggered = set()
+    for file_path, item in items:
+        # Check for accessibility issues if it's a page or template that still exists
+        if not is_page(file_path) or item.a_blob is None:
+            continue
+        if item.b_blob is not None and item.b_blob.hexsha == item.a_blob.hexsha:
+            # Same content, e.g. a mode change or a pure rename
+            skipped[file_path] = 'Content unchanged'
+            continue
+        patch = patches.get(file_path)
+        if patch and is_cosmetic(patch):
+            if not loaded.get(file_path, set()) & changed_assets:
+                skipped[file_path] = 'Only whitespace or comments changed'
+                continue
+            asset_triggered.add(file_path)
+        html_files.append((file_path, item.a_blob, item.b_path, item.b_blob))
+
+    # Pages the diff does not touch are rescanned when an asset they load changed
+    changed_paths = {file_path for file_path, _ in items}
+    unchanged_loaders = {}
+    for page_path in sorted(loaded):
+        if page_path in changed_paths:
+            continue
+        for asset in loaded[page_path] & changed_assets:
+            unchanged_loaders.setdefault(asset, []).append(page_path)
+    rescanned = set()
+    for asset in sorted(changed_assets):
+        pages = unchanged_loaders.get(asset, [])
+        left_out = []
+        for page_path in pages:
+            if page_path in rescanned:
+                continue
+            if len(rescanned) >= ASSET_PAGE_LIMIT:
+                left_out.append(page_path)
+                continue
+            rescanned.add(page_path)
+            old_blob = _tree_blob(old_commit, page_path)
+            html_files.append((page_path, _tree_blob(current_commit, page_path), page_path, old_blob))
+            asset_triggered.add(page_path)
+        if left_out:
+            skipped[asset] = (f"Not rescanned on {len(left_out)} unchanged pages that load it, "
+                              f"beyond GIT_ASSET_PAGE_LIMIT ({ASSET_PAGE_LIMIT})")
+        elif not pages and not any(asset in loaded.get(path, set()) for path, _, _, _ in html_files):
+            skipped[asset] = 'No page in the repository loads it'
+
+    results['rescanned_files'] = sorted(rescanned)
+    results['skipped_scans'] = skipped
+    results['scan_summary'] = {
+        'candidates': len(html_files) + len(skipped),
+        'scanned': len(html_files),
+        'skipped': len(skipped)
+    }
+
+    # Scan the new and old version of every file in one batch
+    targets = []
+    scopes = {}
+    for file_path, new_blob, old_path, old_blob in html_files:
+        new_regions = old_regions = None
+        if scope == 'changed':
             try:
-                diff_content = repo.git.diff(old_commit.hexsha, current_commit.hexsha, '--', file_path)
-                results['diffs'][file_path] = diff_content
-                
-                # Check for accessibility issues if it's an HTML file
-                if file_path.endswith('.html'):
-                    # Create a temporary HTML file with the current version
-                    temp_html_path = os.path.join(temp_dir, 'temp.html')
-                    with open(temp_html_path, 'w', encoding='utf-8') as f:
-                        f.write(repo.git.show(f"{current_commit.hexsha}:{file_path}"))
-                    
-                    # Run accessibility check
-                    try:
-                        report_path = check_accessibility(f"file://{temp_html_path}")
-                        results['accessibility_issues'][file_path] = {
-                            'report_path': report_path,
-                            'has_issues': True
-                        }
-                    except Exception as e:
-                        results['accessibility_issues'][file_path] = {
-                            'error': str(e),
-                            'has_issues': False
-                        }
-                    
-                    # Clean up temporary HTML file
-                    os.remove(temp_html_path)
-                
-            except GitCommandError:
-                results['diffs'][file_path] = "Error getting diff content"
-        
-        return results
-    
-    finally:
-        # Clean up the temporary directory
-        shutil.rmtree(temp_dir, ignore_errors=True) 
\ No newline at end of file
+                new_regions, old_regions = file_regions(patches.get(file_path), new_blob, old_blob)
+            except AmbiguousScope as e:
+                scopes[file_path] = {'mode': 'page', 'reason': str(e)}
+        refresh = file_path in asset_triggered
+        targets.append((current_commit, file_path, new_blob.hexsha, new_regions, refresh))
+        if old_blob is not None:
+            targets.append((old_commit, old_path, old_blob.hexsha, old_regions, refresh))
+    with span('git_scan'):
+        scans = scan_files(targets, workers)
+
+        # When the browser could not scope one version, both are rescanned as whole pages
+        unscoped = {
+            (commit.hexsha, path) for commit, path, _, regions, _ in targets
+            if regions and _scope_mode(scans[(commit.hexsha, path)]) == 'page'
+        }
+        rescan = []
+        for file_path, new_blob, old_path, old_blob in html_files:
+            pair = [(current_commit, file_path, new_blob.hexsha)]
+            if old_blob is not None:
+                pair.append((old_commit, old_path, old_blob.hexsha))
+            if any((commit.hexsha, path) in unscoped for commit, path, _ in pair):
+                refresh = file_path in asset_triggered
+                rescan.extend((commit, path, blob_sha, None, refresh) for commit, path, blob_sha in pair)
+                scopes[file_path] = {'mode': 'page', 'reason': 'Changed regions not found in the rendered page'}
+        if rescan:
+            scans.update(scan_files(rescan, workers))
+
+    # Merge in diff order, then the rescanned unchanged pages, so the output is deterministic
+    scanned = {file_path: (old_path, old_blob) for file_path, _, old_path, old_blob in html_files}
+    for file_path in [file_path for file_path, _ in items] + results['rescanned_files']:
+        if file_path in skipped:
+            results['accessibility_issues'][file_path] = {
+                'skipped': skipped[file_path],
+                'has_issues': False
+            }
+            continue
+        if file_path not in scanned:
+            continue
+
+        old_path, old_blob = scanned[file_path]
+        scan = scans[(current_commit.hexsha, file_path)]
+        old_scan = scans.get((old_commit.hexsha, old_path)) if old_blob is not None else None
+        if scan.get('error'):
+            results['accessibility_issues'][file_path] = {
+                'error': scan['error'],
+                'has_issues': False
+            }
+            continue
+
+        violations = scan['results'].get('violations', [])
+        issues = {
+            'scan': scan,
+            'violation_count': len(violations),
+            'has_issues': bool(violations),
+            'scope': scopes.get(file_path) or scan['results'].get('scope') or {'mode': 'page'}
+        }
+        if old_scan and old_scan.get('error'):
+            issues['old_error'] = old_scan['error']
+        old_violations = old_scan['results'].get('violations', []) if old_scan and not old_scan.get('error') else []
+        issues.update(diff_violations(old_violations, violations))
+        results['accessibility_issues'][file_path] = issues
+
+    return results
+
+def tree_page_assets(commit):
+    """
+    Stylesheets and scripts loaded by every page of a commit's tree
+    Returns: Dict of page path to a set of repository paths, see referenced_assets
+    """
+    pages = {}
+    for entry in commit.tree.traverse():
+        if entry.type == 'blob' and is_page(entry.path):
+            pages[entry.path] = referenced_assets(entry.data_stream.read().decode('utf-8', 'replace'), entry.path)
+    return pages
+
+def file_regions(patch, new_blob, old_blob):
+    """
+    Regions of the new and old version of a file touched by its patch
+    Both versions are scoped, or neither, so their violations stay comparable
+    Returns: (new regions, old regions) from dom_scope.changed_regions
+    Raises: AmbiguousScope when the file should be scanned as a whole
+    """
+    if old_blob is None:
+        raise AmbiguousScope("New file")
+    if patch is None or is_cosmetic(patch):
+        # Rescanned for a changed stylesheet or script, which can affect the whole page
+        raise AmbiguousScope("Referenced stylesheet or script changed")
+    new_regions = changed_regions(_blob_text(new_blob), patch.new_lines)
+    old_regions = changed_regions(_blob_text(old_blob), patch.old_lines)
+    return new_regions, old_regions
+
+def _blob_text(blob):
+    return blob.data_stream.read().decode('utf-8', 'replace')
+
+def _scope_mode(scan):
+    if scan.get('error'):
+        return None
+    return (scan['results'].get('scope') or {}).get('mode', 'page')
+
+def diff_violations(old_violations, new_violations):
+    """
+    Compare two sets of axe violations by rule id and target selector
+    Returns: Dict with the new and fixed issues and the number of unchanged ones
+    """
+    old_issues = _issue_index(old_violations)
+    new_issues = _issue_index(new_violations)
+    return {
+        'new_issues': [issue for key, issue in new_issues.items() if key not in old_issues],
+        'fixed_issues': [issue for key, issue in old_issues.items() if key not in new_issues],
+        'unchanged_count': sum(1 for key in new_issues if key in old_issues)
+    }
+
+def _issue_index(violations):
+    issues = {}
+    for violation in violations:
+        for node in violation.get('nodes', []):
+            for target in node.get('target', []):
+                # Targets inside iframes or shadow roots are lists of selectors
+                selector = ' >> '.join(target) if isinstance(target, list) else target
+                issues.setdefault((violation.get('id'), selector), {
+                    'rule': violation.get('id'),
+                    'target': selector,
+                    'impact': violation.get('impact'),
+                    'description': violation.get('description', '')
+                })
+    return issues
+
+def scan_files(targets, workers, screenshot_mode=None):
+    """
+    Scan files concurrently, one page per file on a single browser
+    Each distinct page, i.e. blob, path and the stylesheets and scripts it loads, is
+    scanned at most once per scope
+    Args:
+        targets: List of (commit, path, blob SHA, regions, refresh) tuples; the commit's tree
+                 is served to the browser, regions, when not None, limit the scan and refresh
+                 skips cached results
+        workers: Maximum pages open at once
+        screenshot_mode: One of SCREENSHOT_MODES (optional)
+    Returns: Dict of (commit SHA, path) to scan dict (or {'error': ...})
+    """
+    screenshot_mode = screenshot_mode or DEFAULT_SCREENSHOT_MODE
+    cache = get_scan_cache()
+    # GitPython's object database is not thread-safe; reads of one repository take turns
+    repo_lock = threading.Lock()
+    by_page = {}
+    for commit, file_path, blob_sha, regions, refresh in targets:
+        # The page also loads stylesheets and scripts from its tree, resolved against its
+        # path, so the same blob in trees with different assets is a different page
+        page = (blob_sha, file_path, page_assets(commit, file_path, repo_lock))
+        key = (page, tuple(region['selector'] for region in regions) if regions else None)
+        locations, _, _ = by_page.setdefault(key, ([], regions, refresh))
+        locations.append((commit, file_path))
+
+    blob_scans = {}
+    pending = {}
+    scopes = {}
+    commits = {}
+    for key, (locations, regions, refresh) in by_page.items():
+        # Pages scanned before, including old versions from earlier comparisons, come from the
+        # cache; pages rescanned because a stylesheet or script they load changed never do
+        (blob_sha, file_path, assets), _ = key
+        options = dict(scan_options(screenshot_mode), path=file_path, assets=assets)
+        if regions:
+            options = dict(options, regions=regions)
+        cache_key = make_key(blob_sha, options)
+        cached = None if refresh else cache.get(cache_key)
+        if cached and cached['screenshots'] is not None:
+            blob_scans[key] = dict(cached, cache_key=cache_key, cached=True)
+        else:
+            commit, file_path = locations[0]
+            commits[commit.hexsha] = commit
+            url = file_url(commit, file_path)
+            pending[url] = (key, cache_key)
+            if regions:
+                scopes[url] = regions
+
+    if pending:
+        routes = [(f'{SCAN_ORIGIN}/{sha}/**', _tree_route(commit, repo_lock)) for sha, commit in commits.items()]
+        for result in iter_check_many(list(pending), concurrency=workers, per_domain=workers,
+                                      screenshot_mode=screenshot_mode, routes=routes, scopes=scopes):
+            key, cache_key = pending[result['url']]
+            if result['error']:
+                blob_scans[key] = {'error': result['error']}
+                continue
+            cache.put(cache_key, result['results'], result['screenshots'], result['overview'])
+            blob_scans[key] = dict(result, cache_key=cache_key, cached=False)
+
+    scans = {}
+    for key, (locations, _, _) in by_page.items():
+        for commit, file_path in locations:
+            scan = blob_scans[key]
+            scans[(commit.hexsha, file_path)] = scan if scan.get('error') else dict(scan, url=file_url(commit, file_path))
+    return scans
+
+def file_url(commit, file_path):
+    """URL a file of commit is served at while scanning"""
+    return f'{SCAN_ORIGIN}/{commit.hexsha}/{quote(file_path)}'
+
+def _tree_route(commit, repo_lock):
+    # Serve any path under the commit from its tree, straight from the object store
+    prefix = f'/{commit.hexsha}/'
+
+    async def handle(route):
+        path = unquote(urlparse(route.request.url).path)
+        if not path.startswith(prefix):
+            await route.fulfill(status=404)
+            return
+        # Off the event loop: in a partial clone a missing blob is fetched from the remote,
+        # which would stall every other page open on the browser
+        body = await asyncio.to_thread(_read_blob, commit, path[len(prefix):], repo_lock)
+        if body is None:
+            await route.fulfill(status=404)
+            return
+        # Templates are rendered as HTML whatever their extension
+        content_type = 'text/html' if is_page(path) else mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        await route.fulfill(status=200, body=body, content_type=content_type)
+
+    return handle
+
+def page_assets(commit, file_path, repo_lock):
+    """
+    Stylesheets and scripts a page of commit loads from the repository
+    Returns: Sorted tuple of (path, blob SHA) pairs; the SHA is None for a missing file
+    """
+    html = _read_blob(commit, file_path, repo_lock)
+    if html is None:
+        return ()
+    assets = referenced_assets(html.decode('utf-8', 'replace'), file_path)
+    with repo_lock:
+        return tuple(sorted((path, getattr(_tree_blob(commit, path), 'hexsha', None)) for path in assets))
+
+def _read_blob(commit, path, repo_lock):
+    with repo_lock:
+        blob = _tree_blob(commit, path)
+        return blob.data_stream.read() if blob is not None else None
+
+def _tree_blob(commit, path):
+    try:
+        blob = commit.tree / path
+    except KeyError:
+        return None
+    return blob if blob.type == 'blob' else None
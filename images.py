@@ -0,0 +1,100 @@
+import io
+import os
+import hashlib
+from PIL import Image
+
+# Screenshot encoding; PNG is lossless but several times larger than JPEG or WebP
+IMAGE_FORMATS = ('png', 'jpeg', 'webp')
+IMAGE_FORMAT = os.getenv('SCREENSHOT_FORMAT', 'jpeg').lower()
+IMAGE_QUALITY = int(os.getenv('SCREENSHOT_QUALITY', 70))
+
+# Captures wider than this are scaled down; 0 keeps the captured resolution
+IMAGE_MAX_WIDTH = int(os.getenv('SCREENSHOT_MAX_WIDTH', 0))
+
+if IMAGE_FORMAT not in IMAGE_FORMATS:
+    raise ValueError(f"Unknown screenshot format: {IMAGE_FORMAT}")
+
+# Stored screenshots are referenced from reports as IMAGE_REF + GridFS ID.
+# ':' is not in the base64 alphabet, so references and inline data cannot be confused
+IMAGE_REF = 'gridfs:'
+
+MIMETYPES = {
+    'png': 'image/png',
+    'jpeg': 'image/jpeg',
+    'webp': 'image/webp'
+}
+
+# Leading bytes of each format, and the same prefixes once base64 encoded
+_SIGNATURES = (
+    (b'\x89PNG', 'iVBOR', 'image/png'),
+    (b'\xff\xd8\xff', '/9j/', 'image/jpeg'),
+    (b'RIFF', 'UklGR', 'image/webp')
+)
+
+
+def image_options():
+    """Encoding settings that are part of the scan cache key"""
+    return {'format': IMAGE_FORMAT, 'quality': IMAGE_QUALITY, 'max_width': IMAGE_MAX_WIDTH}
+
+
+def screenshot_options(**kwargs):
+    """
+    Keyword arguments for page.screenshot
+    JPEG is encoded by the browser directly unless the image still has to be resized
+    """
+    if IMAGE_FORMAT == 'jpeg' and not IMAGE_MAX_WIDTH:
+        return dict(kwargs, type='jpeg', quality=IMAGE_QUALITY)
+    return dict(kwargs, type='png')
+
+
+def compress(raw):
+    """
+    Bring a capture to the configured format and resolution
+    Args:
+        raw: Bytes returned by page.screenshot(**screenshot_options())
+    Returns: Encoded image bytes
+    """
+    with Image.open(io.BytesIO(raw)) as image:
+        # Opening only reads the header, so captures already in shape are returned untouched
+        too_wide = IMAGE_MAX_WIDTH and image.width > IMAGE_MAX_WIDTH
+        if not too_wide and image.format.lower() == IMAGE_FORMAT:
+            return raw
+
+        if too_wide:
+            height = max(1, round(image.height * IMAGE_MAX_WIDTH / image.width))
+            image = image.resize((IMAGE_MAX_WIDTH, height), Image.LANCZOS)
+        if IMAGE_FORMAT == 'jpeg' and image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        output = io.BytesIO()
+        if IMAGE_FORMAT == 'png':
+            image.save(output, format='PNG', optimize=True)
+        else:
+            image.save(output, format=IMAGE_FORMAT.upper(), quality=IMAGE_QUALITY)
+        return output.getvalue()
+
+
+def content_hash(data):
+    """SHA-256 of image bytes, used to store each image once"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def mimetype(data):
+    """MIME type of image bytes or of base64-encoded image data"""
+    for raw_prefix, encoded_prefix, mime in _SIGNATURES:
+        if data.startswith(raw_prefix if isinstance(data, bytes) else encoded_prefix):
+            return mime
+    return 'application/octet-stream'
+
+
+def image_src(image, image_url=None):
+    """
+    src attribute for a screenshot
+    Args:
+        image: base64 image data, or IMAGE_REF followed by the ID of a stored image
+        image_url: Maps a stored image ID to a URL; references are kept for the PDF renderer when omitted
+    """
+    if image.startswith(IMAGE_REF):
+        return image_url(image[len(IMAGE_REF):]) if image_url else image
+    return f'data:{mimetype(image)};base64,{image}'
+
@@ -0,0 +1,436 @@
+import os
+import time
+import queue
+import logging
+import threading
+import multiprocessing
+import uuid
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+# Job states
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+TIMED_OUT = 'timed_out'
+
+ACTIVE_STATES = (QUEUED, RUNNING)
+FINISHED_STATES = (SUCCEEDED, FAILED, CANCELLED, TIMED_OUT)
+
+# Finished jobs are kept this long for polling, then forgotten
+JOB_RETENTION_SECONDS = int(os.getenv('SCAN_JOB_RETENTION', 24 * 60 * 60))
+
+# Running jobs are reclaimed this long after their timeout, when no worker finished them
+RECLAIM_GRACE_SECONDS = 60
+
+# Queued jobs that have not started after this long are timed out, e.g. when the node
+# that queued them stopped and no other node took them over
+QUEUE_TIMEOUT_SECONDS = int(os.getenv('SCAN_JOB_QUEUE_TIMEOUT', 60 * 60))
+
+
+class JobLimitExceeded(Exception):
+    """Raised when a user already has the maximum number of active jobs"""
+
+
+class JobQueueFull(Exception):
+    """Raised when the pending job queue is full"""
+
+
+class InMemoryJobStore:
+    """Job store for single-process deployments"""
+
+    def __init__(self):
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job):
+        with self._lock:
+            self._jobs[job['id']] = dict(job)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def transition(self, job_id, from_states, **fields):
+        """Update a job only if it is currently in one of from_states"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job or job['status'] not in from_states:
+                return False
+            job.update(fields)
+            return True
+
+    def count_active(self, user_id):
+        with self._lock:
+            return sum(
+                1 for job in self._jobs.values()
+                if job['user_id'] == user_id and job['status'] in ACTIVE_STATES
+            )
+
+    def list_queued(self, limit):
+        # Queued jobs of this process are already in its pending queue
+        return []
+
+    def reclaim(self, started_before, queued_before):
+        """Time out jobs running since before started_before or queued since before queued_before"""
+        now = datetime.now()
+        with self._lock:
+            for job in self._jobs.values():
+                if job['status'] == RUNNING and job['started_at'] and job['started_at'] < started_before:
+                    job.update(status=TIMED_OUT, error="Scan did not finish", finished_at=now)
+                elif job['status'] == QUEUED and job['created_at'] < queued_before:
+                    job.update(status=TIMED_OUT, error="Scan did not start in time", finished_at=now)
+
+    def evict(self, finished_before):
+        """Forget jobs that finished before finished_before"""
+        with self._lock:
+            for job_id in [
+                job_id for job_id, job in self._jobs.items()
+                if job['status'] in FINISHED_STATES and job['finished_at'] and job['finished_at'] < finished_before
+            ]:
+                del self._jobs[job_id]
+
+
+class MongoJobStore:
+    """Job store shared by every node connected to the same database"""
+
+    def __init__(self, db):
+        self.jobs = db['scan_jobs']
+        self.jobs.create_index([('user_id', 1), ('status', 1)])
+        self.jobs.create_index([('status', 1), ('created_at', 1)])
+        # Active jobs have no finished_at and are never expired
+        self.jobs.create_index('finished_at', expireAfterSeconds=JOB_RETENTION_SECONDS)
+
+    def create(self, job):
+        doc = dict(job)
+        doc['_id'] = doc.pop('id')
+        self.jobs.insert_one(doc)
+
+    def get(self, job_id):
+        doc = self.jobs.find_one({'_id': job_id})
+        if not doc:
+            return None
+        doc['id'] = doc.pop('_id')
+        return doc
+
+    def transition(self, job_id, from_states, **fields):
+        """Update a job only if it is currently in one of from_states"""
+        result = self.jobs.update_one(
+            {'_id': job_id, 'status': {'$in': list(from_states)}},
+            {'$set': fields}
+        )
+        return result.modified_count == 1
+
+    def count_active(self, user_id):
+        return self.jobs.count_documents({
+            'user_id': user_id,
+            'status': {'$in': list(ACTIVE_STATES)}
+        })
+
+    def list_queued(self, limit):
+        """Oldest queued jobs, including those queued by nodes that have since stopped"""
+        jobs = []
+        for doc in self.jobs.find({'status': QUEUED}).sort('created_at', 1).limit(limit):
+            doc['id'] = doc.pop('_id')
+            jobs.append(doc)
+        return jobs
+
+    def reclaim(self, started_before, queued_before):
+        """
+        Time out jobs running since before started_before or queued since before
+        queued_before, e.g. on a node that stopped
+        """
+        self.jobs.update_many(
+            {'status': RUNNING, 'started_at': {'$lt': started_before}},
+            {'$set': {'status': TIMED_OUT, 'error': "Scan did not finish", 'finished_at': datetime.now()}}
+        )
+        self.jobs.update_many(
+            {'status': QUEUED, 'created_at': {'$lt': queued_before}},
+            {'$set': {'status': TIMED_OUT, 'error': "Scan did not start in time", 'finished_at': datetime.now()}}
+        )
+
+    def evict(self, finished_before):
+        # Finished jobs are removed by the TTL index
+        pass
+
+
+_database = None
+
+
+def _get_database():
+    # One Database per process, so process workers do not share a client
+    global _database
+    if _database is None:
+        from database import Database
+        _database = Database()
+    return _database
+
+
+def run_scan_job(url, user_id, options=None, timeout=None):
+    """
+    Scan a URL and store the report
+    Runs inside a worker thread or process
+    Returns: The ID of the stored report
+    """
+    from accessibility_checker import run_scan
+
+    scan = run_scan(url, timeout=timeout, **(options or {}))
+    return _get_database().store_scan(scan, url, user_id)
+
+
+def run_crawl_job(url, user_id, options=None, timeout=None):
+    """
+    Crawl a site from url and store one aggregated report
+    Runs inside a worker thread or process
+    Returns: The ID of the stored report
+    """
+    from crawler import crawl_site
+
+    # A sitemap-only crawl is labelled with the sitemap URL and has no start page
+    scan = crawl_site(timeout=timeout, **dict({'start_url': url}, **(options or {})))
+    return _get_database().store_scan(scan, url, user_id, metadata={'type': 'crawl_report'})
+
+
+JOB_RUNNERS = {
+    'scan': run_scan_job,
+    'crawl': run_crawl_job
+}
+
+
+def run_job(kind, url, user_id, options=None, timeout=None):
+    """
+    Run a job of the given kind; module level so process workers can unpickle it
+    timeout bounds the scan itself, so a timed out job frees its worker and browser
+    """
+    return JOB_RUNNERS[kind](url, user_id, options, timeout)
+
+
+class JobManager:
+    def __init__(self, store, mode=None, max_workers=None, max_pending=None,
+                 per_user_limit=None, timeout=None, start=True):
+        """
+        Runs scan jobs on a bounded worker pool
+        Args:
+            store: InMemoryJobStore or MongoJobStore
+            mode: 'thread' or 'process'
+            max_workers: Number of scans run at once
+            max_pending: Maximum number of queued jobs
+            per_user_limit: Maximum active jobs per user
+            timeout: Seconds before a job is marked as timed out; also bounds the scan
+            start: Start dispatching jobs, and take over jobs left behind by stopped nodes
+        """
+        self.store = store
+        self.mode = mode or os.getenv('SCAN_JOB_MODE', 'thread')
+        self.max_workers = max_workers or int(os.getenv('SCAN_JOB_WORKERS', 2))
+        self.max_pending = max_pending or int(os.getenv('SCAN_JOB_QUEUE_SIZE', 50))
+        self.per_user_limit = per_user_limit or int(os.getenv('SCAN_JOB_USER_LIMIT', 3))
+        self.timeout = timeout or float(os.getenv('SCAN_JOB_TIMEOUT', 300))
+
+        if self.mode not in ('thread', 'process'):
+            raise ValueError(f"Unknown job mode: {self.mode}")
+        self.executor = self._new_executor()
+
+        self._pending = queue.Queue(maxsize=self.max_pending)
+        self._slots = threading.Semaphore(self.max_workers)
+        self._submit_lock = threading.Lock()
+        self._executor_lock = threading.Lock()
+        if start:
+            threading.Thread(target=self._dispatch, name='scan-job-dispatcher', daemon=True).start()
+            # Jobs left behind by a previous run of this or another node
+            self._reap()
+            self._adopt_queued()
+            threading.Thread(target=self._reap_loop, name='scan-job-reaper', daemon=True).start()
+
+    def submit(self, user_id, url, kind='scan', options=None):
+        """
+        Queue a scan of url for user_id
+        Args:
+            user_id: ID of the user the report belongs to
+            url: URL to scan, or to start crawling from
+            kind: One of JOB_RUNNERS
+            options: Keyword arguments for the job runner (optional)
+        Returns: The new job ID
+        """
+        if kind not in JOB_RUNNERS:
+            raise ValueError(f"Unknown job kind: {kind}")
+
+        with self._submit_lock:
+            if self.store.count_active(user_id) >= self.per_user_limit:
+                raise JobLimitExceeded(f"At most {self.per_user_limit} scans can run at once")
+
+            job = {
+                'id': uuid.uuid4().hex,
+                'user_id': user_id,
+                'url': url,
+                'kind': kind,
+                'options': options or {},
+                'status': QUEUED,
+                'created_at': datetime.now(),
+                'started_at': None,
+                'finished_at': None,
+                'file_id': None,
+                'error': None
+            }
+            self.store.create(job)
+            try:
+                self._pending.put_nowait(job)
+            except queue.Full:
+                self.store.transition(job['id'], ACTIVE_STATES, status=FAILED,
+                                      error="Job queue is full", finished_at=datetime.now())
+                raise JobQueueFull("Too many scans are queued, try again later")
+            return job['id']
+
+    def get(self, job_id, user_id=None):
+        job = self.store.get(job_id)
+        if job is None or (user_id and job['user_id'] != user_id):
+            return None
+        return job
+
+    def cancel(self, job_id, user_id=None):
+        """
+        Cancel a queued or running job
+        A queued job never starts. A running scan is not interrupted: it goes on until it
+        finishes or reaches the job timeout, and its report is then deleted
+        Returns: True if the job was cancelled
+        """
+        if self.get(job_id, user_id) is None:
+            return False
+        return self.store.transition(job_id, ACTIVE_STATES, status=CANCELLED, finished_at=datetime.now())
+
+    def _new_executor(self):
+        if self.mode == 'process':
+            # Not forked: by now this process runs browser, scheduler and MongoDB threads,
+            # and a child could inherit a lock one of them holds
+            return ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+        return ThreadPoolExecutor(max_workers=self.max_workers)
+
+    def _dispatch(self):
+        # The only dispatcher: a job that cannot be started fails on its own instead of
+        # stopping every job queued after it
+        while True:
+            job = self._pending.get()
+            self._slots.acquire()
+            try:
+                started = self._start(job)
+            except Exception as e:
+                self._slots.release()
+                logger.exception("Could not start scan job %s", job['id'])
+                try:
+                    self.store.transition(job['id'], ACTIVE_STATES, status=FAILED,
+                                          error=f"Could not start the scan: {e}", finished_at=datetime.now())
+                except Exception as store_error:
+                    logger.warning("Could not mark scan job %s as failed: %s", job['id'], store_error)
+                continue
+            if started is None:
+                # Cancelled while it was queued
+                self._slots.release()
+                continue
+
+            executor, future = started
+            timer = threading.Timer(self.timeout, self._expire, args=(job['id'], future))
+            timer.daemon = True
+            timer.start()
+            future.add_done_callback(
+                lambda f, job=job, timer=timer, executor=executor: self._finish(job, f, timer, executor)
+            )
+
+    def _start(self, job):
+        """
+        Move a queued job to RUNNING and submit it to the executor
+        Returns: (executor, future), or None when the job is no longer queued
+        """
+        if not self.store.transition(job['id'], (QUEUED,), status=RUNNING, started_at=datetime.now()):
+            return None
+        args = (run_job, job.get('kind', 'scan'), job['url'], job['user_id'], job.get('options'), self.timeout)
+        executor = self.executor
+        try:
+            return executor, executor.submit(*args)
+        except BrokenProcessPool:
+            # A worker process died since the last job; start over once
+            self._discard(executor)
+            executor = self.executor
+            return executor, executor.submit(*args)
+
+    def _discard(self, executor):
+        # Jobs still on a broken executor fail with BrokenProcessPool; later jobs get a new one
+        with self._executor_lock:
+            if self.executor is not executor:
+                return
+            self.executor = self._new_executor()
+        logger.warning("A scan job worker died; restarting the job pool")
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _adopt_queued(self):
+        # The pending queue lives in memory, so queued jobs of a stopped node would never
+        # run; taking them over is safe because only one node can move a job to RUNNING
+        for job in self.store.list_queued(self.max_pending):
+            try:
+                self._pending.put_nowait(job)
+            except queue.Full:
+                break
+
+    def _reap(self):
+        now = datetime.now()
+        self.store.reclaim(
+            started_before=now - timedelta(seconds=self.timeout + RECLAIM_GRACE_SECONDS),
+            queued_before=now - timedelta(seconds=QUEUE_TIMEOUT_SECONDS)
+        )
+        self.store.evict(now - timedelta(seconds=JOB_RETENTION_SECONDS))
+
+    def _reap_loop(self):
+        while True:
+            time.sleep(min(self.timeout, 60))
+            try:
+                self._reap()
+            except Exception as e:
+                logger.warning("Could not reclaim stale scan jobs: %s", e)
+
+    def _expire(self, job_id, future):
+        if self.store.transition(job_id, ACTIVE_STATES, status=TIMED_OUT,
+                                 error="Scan timed out", finished_at=datetime.now()):
+            future.cancel()
+
+    def _finish(self, job, future, timer, executor):
+        timer.cancel()
+        self._slots.release()
+
+        if future.cancelled():
+            return
+
+        error = future.exception()
+        if error is not None:
+            if isinstance(error, BrokenProcessPool):
+                self._discard(executor)
+            self.store.transition(job['id'], (RUNNING,), status=FAILED,
+                                  error=str(error), finished_at=datetime.now())
+            return
+
+        file_id = future.result()
+        if not self.store.transition(job['id'], (RUNNING,), status=SUCCEEDED,
+                                     file_id=file_id, finished_at=datetime.now()):
+            # Cancelled or timed out while running, discard the report
+            try:
+                _get_database().delete_report(file_id)
+            except Exception:
+                pass
+
+
+def serialize_job(job):
+    """JSON-safe view of a job"""
+    return {
+        'job_id': job['id'],
+        'url': job['url'],
+        'kind': job.get('kind', 'scan'),
+        'status': job['status'],
+        'created_at': job['created_at'].isoformat() if job.get('created_at') else None,
+        'started_at': job['started_at'].isoformat() if job.get('started_at') else None,
+        'finished_at': job['finished_at'].isoformat() if job.get('finished_at') else None,
+        'file_id': job.get('file_id'),
+        'error': job.get('error')
+    }
@@ -1,24 +1,18 @@
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
-from pymongo import MongoClient
-import os
-from dotenv import load_dotenv
-
-# Load environment variables
-load_dotenv()
+from pymongo.errors import DuplicateKeyError
+from mongo import get_database
 
 class User:
     def __init__(self):
-        # Get MongoDB URI from environment variables
-        self.mongo_uri = os.getenv('MONGO_URI')
-        if not self.mongo_uri:
-            raise ValueError("MongoDB URI not found in environment variables")
-        
-        # Initialize MongoDB client
-        self.client = MongoClient(self.mongo_uri)
-        self.db = self.client['accessibility_reports']
+        # Share the process-wide MongoDB client
+        self.db = get_database()
+        self.client = self.db.client
         self.users = self.db['users']
 
+        # Email lookups for login and registration, and one account per email
+        self.users.create_index('email', unique=True)
+
     def create_user(self, email, password, name):
         """Create a new user"""
         if self.users.find_one({'email': email}):
@@ -31,7 +25,11 @@ class User:
             'created_at': datetime.now()
         }
         
-        result = self.users.insert_one(user)
+        try:
+            result = self.users.insert_one(user)
+        except DuplicateKeyError:
+            # Lost a race with another registration for the same email
+            raise ValueError("Email already registered")
         return str(result.inserted_id)
 
     def authenticate(self, email, password):
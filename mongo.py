@@ -0,0 +1,170 @@
+import os
+import threading
+from pymongo import MongoClient, monitoring
+from pymongo.write_concern import WriteConcern
+from dotenv import load_dotenv
+from metrics import MONGO_COMMAND_SECONDS
+
+# Load environment variables
+load_dotenv()
+
+DATABASE_NAME = 'accessibility_reports'
+
+
+class CommandLatencyListener(monitoring.CommandListener):
+    """Per-command counts and latency from pymongo's command monitoring"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.commands = {}
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event.command_name, event.duration_micros, failed=False)
+
+    def failed(self, event):
+        self._record(event.command_name, event.duration_micros, failed=True)
+
+    def _record(self, command_name, duration_micros, failed):
+        seconds = duration_micros / 1e6
+        MONGO_COMMAND_SECONDS.observe(seconds, command=command_name, outcome='failed' if failed else 'succeeded')
+        with self._lock:
+            stats = self.commands.setdefault(command_name, {
+                'count': 0, 'failures': 0, 'total_seconds': 0.0, 'max_seconds': 0.0
+            })
+            stats['count'] += 1
+            stats['failures'] += 1 if failed else 0
+            stats['total_seconds'] += seconds
+            stats['max_seconds'] = max(stats['max_seconds'], seconds)
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: dict(stats, avg_seconds=stats['total_seconds'] / stats['count'])
+                for name, stats in self.commands.items()
+            }
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Connection pool counters from pymongo's pool monitoring"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.open = 0
+        self.checked_out = 0
+        self.created = 0
+        self.closed = 0
+        self.checkout_failures = 0
+        self.cleared = 0
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.cleared += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.created += 1
+            self.open += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.closed += 1
+            self.open -= 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.checked_out += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'open': self.open,
+                'checked_out': self.checked_out,
+                'created': self.created,
+                'closed': self.closed,
+                'checkout_failures': self.checkout_failures,
+                'cleared': self.cleared
+            }
+
+
+command_listener = CommandLatencyListener()
+pool_listener = PoolStatsListener()
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+
+
+def client_options():
+    """MongoClient settings, tunable through environment variables"""
+    return {
+        'maxPoolSize': int(os.getenv('MONGO_MAX_POOL_SIZE', 50)),
+        'minPoolSize': int(os.getenv('MONGO_MIN_POOL_SIZE', 0)),
+        'maxIdleTimeMS': int(os.getenv('MONGO_MAX_IDLE_TIME_MS', 60000)),
+        'waitQueueTimeoutMS': int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', 10000)),
+        'serverSelectionTimeoutMS': int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 10000)),
+        'connectTimeoutMS': int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', 10000)),
+        'socketTimeoutMS': int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', 60000)),
+        'event_listeners': [command_listener, pool_listener]
+    }
+
+
+def get_client():
+    """
+    Return the process-wide MongoClient
+    MongoClient is not fork-safe, so a child process gets its own client the first time it asks
+    """
+    global _client, _client_pid
+    with _client_lock:
+        if _client is None or _client_pid != os.getpid():
+            mongo_uri = os.getenv('MONGO_URI')
+            if not mongo_uri:
+                raise ValueError("MongoDB URI not found in environment variables")
+            _client = MongoClient(mongo_uri, **client_options())
+            _client_pid = os.getpid()
+        return _client
+
+
+def get_database():
+    """Return the application database, with MONGO_WRITE_CONCERN applied when set"""
+    w = os.getenv('MONGO_WRITE_CONCERN')
+    write_concern = None
+    if w:
+        write_concern = WriteConcern(
+            w=int(w) if w.isdigit() else w,
+            wtimeout=int(os.getenv('MONGO_WRITE_TIMEOUT_MS', 10000))
+        )
+    return get_client().get_database(DATABASE_NAME, write_concern=write_concern)
+
+
+def stats():
+    """Connection pool and per-command latency statistics"""
+    return {
+        'pool': pool_listener.stats(),
+        'commands': command_listener.stats()
+    }
@@ -0,0 +1,342 @@
+import os
+import json
+import math
+import random
+import hashlib
+import logging
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Run outcomes, cheapest first
+NOT_MODIFIED = 'not_modified'                  # The server answered a conditional request with 304
+DOM_UNCHANGED = 'dom_unchanged'                # The rendered DOM hashes to the last scanned one
+VIOLATIONS_UNCHANGED = 'violations_unchanged'  # The page changed but its violations did not
+CHANGED = 'changed'                            # A new report was stored
+FAILED = 'failed'
+
+DEFAULT_INTERVAL_HOURS = float(os.getenv('MONITOR_DEFAULT_INTERVAL_HOURS', 6))
+MIN_INTERVAL_MINUTES = float(os.getenv('MONITOR_MIN_INTERVAL_MINUTES', 15))
+MAX_INTERVAL_HOURS = float(os.getenv('MONITOR_MAX_INTERVAL_HOURS', 24 * 30))
+USER_LIMIT = int(os.getenv('MONITOR_USER_LIMIT', 20))
+
+# Each run is rescheduled up to this fraction of its interval early or late, so
+# monitors created together do not stay in lockstep
+JITTER = float(os.getenv('MONITOR_JITTER', 0.1))
+
+PROBE_TIMEOUT = float(os.getenv('MONITOR_PROBE_TIMEOUT', 10))
+
+# Share of the lease a scan may take; the rest covers the probe and storing the report,
+# so a slow page cannot outlive the lease and be run by a second node at the same time
+SCAN_LEASE_FRACTION = 0.8
+
+MONITOR_RUNS = Counter('a11y_monitor_runs_total', 'Monitor runs by outcome', ('outcome',))
+MONITOR_RUN_SECONDS = Histogram('a11y_monitor_run_seconds', 'Duration of monitor runs')
+
+
+class MonitorLimitExceeded(Exception):
+    """Raised when a user already monitors the maximum number of URLs"""
+
+
+class MonitorStore:
+    """Monitored URLs and their runs, shared by every node connected to the same database"""
+
+    def __init__(self, db):
+        self.monitors = db['monitored_urls']
+        self.runs = db['monitor_runs']
+        self.monitors.create_index([('user_id', ASCENDING), ('url', ASCENDING)], unique=True)
+        self.monitors.create_index([('enabled', ASCENDING), ('next_run_at', ASCENDING)])
+        self.runs.create_index([('monitor_id', ASCENDING), ('started_at', DESCENDING)])
+
+    def create(self, user_id, url, interval_hours=None):
+        """
+        Start monitoring url for user_id
+        Args:
+            interval_hours: Hours between runs (optional)
+        Returns: The new monitor ID
+        Raises: ValueError when interval_hours is not between the minimum and maximum interval
+        """
+        interval_hours = interval_hours or DEFAULT_INTERVAL_HOURS
+        # Checked before timedelta, which overflows on huge or infinite values
+        if not math.isfinite(interval_hours):
+            raise ValueError("interval_hours must be a finite number")
+        if interval_hours > MAX_INTERVAL_HOURS:
+            raise ValueError(f"Monitors run at least every {MAX_INTERVAL_HOURS:g} hours")
+        interval = timedelta(hours=interval_hours)
+        if interval < timedelta(minutes=MIN_INTERVAL_MINUTES):
+            raise ValueError(f"Monitors run at most every {MIN_INTERVAL_MINUTES:g} minutes")
+        if self.monitors.count_documents({'user_id': user_id}) >= USER_LIMIT:
+            raise MonitorLimitExceeded(f"At most {USER_LIMIT} URLs can be monitored")
+
+        now = datetime.now()
+        result = self.monitors.insert_one({
+            'user_id': user_id,
+            'url': url,
+            'interval_seconds': interval.total_seconds(),
+            'enabled': True,
+            'created_at': now,
+            # First runs are spread over one interval
+            'next_run_at': now + interval * random.random(),
+            'lease_until': None,
+            'etag': None,
+            'last_modified': None,
+            'content_hash': None,
+            'violations_hash': None,
+            'last_report_id': None,
+            'last_run_at': None,
+            'last_outcome': None
+        })
+        return str(result.inserted_id)
+
+    def get(self, monitor_id, user_id=None):
+        query = {'_id': _object_id(monitor_id)}
+        if user_id:
+            query['user_id'] = user_id
+        return self.monitors.find_one(query)
+
+    def list(self, user_id):
+        return list(self.monitors.find({'user_id': user_id}).sort('created_at', DESCENDING))
+
+    def set_enabled(self, monitor_id, user_id, enabled):
+        """Returns: True if the monitor exists"""
+        result = self.monitors.update_one(
+            {'_id': _object_id(monitor_id), 'user_id': user_id},
+            {'$set': {'enabled': enabled}}
+        )
+        return result.matched_count == 1
+
+    def delete(self, monitor_id, user_id):
+        """Stop monitoring; reports stored by the monitor are kept"""
+        result = self.monitors.delete_one({'_id': _object_id(monitor_id), 'user_id': user_id})
+        if result.deleted_count:
+            self.runs.delete_many({'monitor_id': monitor_id})
+        return result.deleted_count == 1
+
+    def claim_due(self, lease_seconds):
+        """
+        Lease the most overdue monitor so no other node runs it at the same time
+        Returns: The monitor document, or None when nothing is due
+        """
+        now = datetime.now()
+        return self.monitors.find_one_and_update(
+            {
+                'enabled': True,
+                'next_run_at': {'$lte': now},
+                '$or': [{'lease_until': None}, {'lease_until': {'$lt': now}}]
+            },
+            {'$set': {'lease_until': now + timedelta(seconds=lease_seconds)}},
+            sort=[('next_run_at', ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def finish(self, monitor, run, **fields):
+        """Record a run, release the lease and schedule the next run with jitter"""
+        interval = monitor['interval_seconds']
+        fields.update(
+            lease_until=None,
+            last_run_at=run['started_at'],
+            last_outcome=run['outcome'],
+            next_run_at=datetime.now() + timedelta(seconds=interval * (1 + random.uniform(-JITTER, JITTER)))
+        )
+        self.monitors.update_one({'_id': monitor['_id']}, {'$set': fields})
+        self.runs.insert_one(run)
+
+    def list_runs(self, monitor_id, limit=50):
+        return list(self.runs.find({'monitor_id': monitor_id}).sort('started_at', DESCENDING).limit(limit))
+
+
+def _object_id(monitor_id):
+    # Malformed IDs match nothing instead of raising
+    try:
+        return ObjectId(monitor_id)
+    except (InvalidId, TypeError):
+        return None
+
+
+def violations_fingerprint(results):
+    """Hash of the rule and target of every violating node, independent of order"""
+    issues = sorted(
+        (violation.get('id') or '', json.dumps(target))
+        for violation in results.get('violations', [])
+        for node in violation.get('nodes', [])
+        for target in node.get('target', [])
+    )
+    return hashlib.sha256(json.dumps(issues).encode('utf-8')).hexdigest()
+
+
+def probe(url, etag=None, last_modified=None):
+    """
+    Conditional GET of url, without reading the body
+    Returns: (modified, etag, last_modified); modified is True when the server did not
+             confirm the page is unchanged
+    """
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    try:
+        with requests.get(url, headers=headers, timeout=PROBE_TIMEOUT, stream=True, allow_redirects=True) as response:
+            if response.status_code == 304:
+                return False, etag, last_modified
+            if response.ok:
+                return True, response.headers.get('ETag'), response.headers.get('Last-Modified')
+    except requests.RequestException as e:
+        logger.info("Probe of %s failed, scanning instead: %s", url, e)
+    return True, None, None
+
+
+def run_monitor(monitor, db, scan=None, timeout=None):
+    """
+    Check a monitored URL, cheapest test first, and store a report only when its violations changed
+    Args:
+        monitor: Monitor document
+        db: Database the reports are stored in
+        scan: Function scanning a URL, defaults to accessibility_checker.run_scan
+        timeout: Seconds the scan may take, including waiting for a browser (optional)
+    Returns: (run entry, monitor fields to update)
+    """
+    if scan is None:
+        from accessibility_checker import run_scan as scan
+
+    started_at = datetime.now()
+    run = {
+        'monitor_id': str(monitor['_id']),
+        'user_id': monitor['user_id'],
+        'url': monitor['url'],
+        'started_at': started_at,
+        'report_id': monitor.get('last_report_id'),
+        'violation_count': None,
+        'error': None
+    }
+    fields = {}
+    has_report = bool(monitor.get('last_report_id'))
+
+    try:
+        modified, etag, last_modified = probe(
+            monitor['url'],
+            monitor.get('etag') if has_report else None,
+            monitor.get('last_modified') if has_report else None
+        )
+        fields.update(etag=etag, last_modified=last_modified)
+        if not modified:
+            run['outcome'] = NOT_MODIFIED
+        else:
+            result = scan(
+                monitor['url'], skip_if_hash=monitor.get('content_hash') if has_report else None, timeout=timeout
+            )
+            fields['content_hash'] = result.get('content_hash')
+            if result.get('unchanged'):
+                run['outcome'] = DOM_UNCHANGED
+            else:
+                run['violation_count'] = len(result['results'].get('violations', []))
+                fingerprint = violations_fingerprint(result['results'])
+                if has_report and fingerprint == monitor.get('violations_hash'):
+                    run['outcome'] = VIOLATIONS_UNCHANGED
+                else:
+                    run['report_id'] = db.store_scan(
+                        result, monitor['url'], monitor['user_id'],
+                        metadata={'type': 'monitor_report', 'monitor_id': str(monitor['_id'])}
+                    )
+                    fields.update(violations_hash=fingerprint, last_report_id=run['report_id'])
+                    run['outcome'] = CHANGED
+    except Exception as e:
+        logger.warning("Monitor run for %s failed: %s", monitor['url'], e)
+        run.update(outcome=FAILED, error=str(e))
+        # Validators from a failed run are not trusted for the next probe
+        fields = {}
+
+    run['finished_at'] = datetime.now()
+    run['seconds'] = (run['finished_at'] - started_at).total_seconds()
+    return run, fields
+
+
+class MonitorScheduler:
+    def __init__(self, store, db, max_workers=None, poll_seconds=None, lease_seconds=None):
+        """
+        Runs due monitors on a bounded worker pool
+        Args:
+            store: MonitorStore
+            db: Database reports are stored in
+            max_workers: Monitors run at once
+            poll_seconds: Seconds between checks for due monitors
+            lease_seconds: Seconds a claimed monitor is reserved for this node
+        """
+        self.store = store
+        self.db = db
+        self.max_workers = max_workers or int(os.getenv('MONITOR_WORKERS', 2))
+        self.poll_seconds = poll_seconds or float(os.getenv('MONITOR_POLL_SECONDS', 30))
+        self.lease_seconds = lease_seconds or float(os.getenv('MONITOR_LEASE_SECONDS', 900))
+
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='monitor')
+        self._slots = threading.Semaphore(self.max_workers)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, name='monitor-scheduler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            try:
+                self._claim_all()
+            except Exception as e:
+                logger.warning("Monitor scheduling failed: %s", e)
+            self._stop.wait(self.poll_seconds)
+
+    def _claim_all(self):
+        # Only claim what a free worker can start right away; other nodes take the rest
+        while self._slots.acquire(blocking=False):
+            monitor = self.store.claim_due(self.lease_seconds)
+            if monitor is None:
+                self._slots.release()
+                return
+            self.executor.submit(self._run, monitor)
+
+    def _run(self, monitor):
+        try:
+            run, fields = run_monitor(monitor, self.db, timeout=self.lease_seconds * SCAN_LEASE_FRACTION)
+            MONITOR_RUNS.inc(outcome=run['outcome'])
+            MONITOR_RUN_SECONDS.observe(run['seconds'])
+            self.store.finish(monitor, run, **fields)
+        except Exception as e:
+            logger.warning("Could not record monitor run for %s: %s", monitor['url'], e)
+        finally:
+            self._slots.release()
+
+
+def serialize_monitor(monitor):
+    """JSON-safe view of a monitor"""
+    return {
+        'monitor_id': str(monitor['_id']),
+        'url': monitor['url'],
+        'interval_hours': monitor['interval_seconds'] / 3600,
+        'enabled': monitor['enabled'],
+        'next_run_at': monitor['next_run_at'].isoformat() if monitor.get('next_run_at') else None,
+        'last_run_at': monitor['last_run_at'].isoformat() if monitor.get('last_run_at') else None,
+        'last_outcome': monitor.get('last_outcome'),
+        'last_report_id': monitor.get('last_report_id')
+    }
+
+
+def serialize_run(run):
+    """JSON-safe view of a monitor run"""
+    return {
+        'started_at': run['started_at'].isoformat(),
+        'seconds': run.get('seconds'),
+        'outcome': run['outcome'],
+        'report_id': run.get('report_id'),
+        'violation_count': run.get('violation_count'),
+        'error': run.get('error')
+    }
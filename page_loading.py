@@ -0,0 +1,144 @@
+import os
+from urllib.parse import urlsplit
+
+# Wait strategies accepted by page.goto
+WAIT_UNTIL_OPTIONS = ('commit', 'domcontentloaded', 'load', 'networkidle')
+
+# Playwright resource types that can be blocked
+RESOURCE_TYPES = ('document', 'stylesheet', 'image', 'media', 'font', 'script', 'texttrack',
+                  'xhr', 'fetch', 'eventsource', 'websocket', 'manifest', 'other')
+
+# Hosts blocked when 'analytics' is listed in SCAN_BLOCK_DOMAINS
+ANALYTICS_DOMAINS = (
+    'google-analytics.com', 'googletagmanager.com', 'doubleclick.net', 'googlesyndication.com',
+    'facebook.net', 'hotjar.com', 'segment.com', 'segment.io', 'mixpanel.com', 'newrelic.com',
+    'nr-data.net', 'fullstory.com', 'clarity.ms', 'quantserve.com', 'scorecardresearch.com'
+)
+
+
+def _env_list(name, default=''):
+    return tuple(item.strip().lower() for item in os.getenv(name, default).split(',') if item.strip())
+
+
+def load_options(**overrides):
+    """
+    How pages are loaded before they are checked, from the environment
+    Args:
+        overrides: Values replacing the environment settings
+    Returns: Dict of load options
+    """
+    domains = []
+    for domain in _env_list('SCAN_BLOCK_DOMAINS'):
+        domains.extend(ANALYTICS_DOMAINS if domain == 'analytics' else [domain])
+
+    options = {
+        'block_resource_types': _env_list('SCAN_BLOCK_RESOURCES'),
+        'block_domains': tuple(domains),
+        'block_third_party': os.getenv('SCAN_BLOCK_THIRD_PARTY', '').lower() in ('1', 'true', 'yes'),
+        'wait_until': os.getenv('SCAN_WAIT_UNTIL', 'load'),
+        'wait_for_selector': os.getenv('SCAN_WAIT_FOR_SELECTOR') or None,
+        'timeout_ms': int(os.getenv('SCAN_NAVIGATION_TIMEOUT_MS', 30000))
+    }
+    options.update(overrides)
+
+    if options['wait_until'] not in WAIT_UNTIL_OPTIONS:
+        raise ValueError(f"Unknown wait strategy: {options['wait_until']}")
+    unknown = set(options['block_resource_types']) - set(RESOURCE_TYPES)
+    if unknown:
+        raise ValueError(f"Unknown resource types: {', '.join(sorted(unknown))}")
+    return options
+
+
+DEFAULT_LOAD_OPTIONS = load_options()
+
+
+def cache_options(options):
+    """The load options that can change scan results, for the cache key"""
+    return {
+        'block_resource_types': sorted(options['block_resource_types']),
+        'block_domains': sorted(options['block_domains']),
+        'block_third_party': options['block_third_party'],
+        'wait_until': options['wait_until'],
+        'wait_for_selector': options['wait_for_selector']
+    }
+
+
+def blocks_requests(options):
+    return bool(options['block_resource_types'] or options['block_domains'] or options['block_third_party'])
+
+
+def should_block(request_url, resource_type, page_url, options, main_document=False):
+    """
+    Whether a request made while loading page_url is blocked
+    The page itself, including its redirects, is never blocked
+    """
+    if main_document:
+        return False
+    if resource_type in options['block_resource_types']:
+        return True
+
+    host = (urlsplit(request_url).hostname or '').lower()
+    if any(host == domain or host.endswith('.' + domain) for domain in options['block_domains']):
+        return True
+    if options['block_third_party']:
+        page_host = (urlsplit(page_url).hostname or '').lower()
+        return bool(host) and host != page_host and not _same_site(host, page_host)
+    return False
+
+
+def _same_site(host, page_host):
+    # Subdomains of the page's registrable domain (approximated by its last two labels) count as first party
+    site = '.'.join(page_host.split('.')[-2:])
+    return host == site or host.endswith('.' + site)
+
+
+def block_requests(context, page_url, options):
+    """Install request blocking on a sync Playwright context"""
+    if not blocks_requests(options):
+        return
+
+    def handle(route):
+        request = route.request
+        if should_block(request.url, request.resource_type, page_url, options, _is_main_document(request)):
+            route.abort('blockedbyclient')
+        else:
+            route.fallback()
+
+    context.route('**/*', handle)
+
+
+async def block_requests_async(context, page_url, options):
+    """Install request blocking on an async Playwright context"""
+    if not blocks_requests(options):
+        return
+
+    async def handle(route):
+        request = route.request
+        if should_block(request.url, request.resource_type, page_url, options, _is_main_document(request)):
+            await route.abort('blockedbyclient')
+        else:
+            await route.fallback()
+
+    await context.route('**/*', handle)
+
+
+def _is_main_document(request):
+    try:
+        return request.is_navigation_request() and request.frame.parent_frame is None
+    except Exception:
+        # Service worker requests have no frame
+        return False
+
+
+def navigate(page, url, options):
+    """Load url with the configured wait strategy and timeout"""
+    page.goto(url, wait_until=options['wait_until'], timeout=options['timeout_ms'])
+    if options['wait_for_selector']:
+        page.wait_for_selector(options['wait_for_selector'], timeout=options['timeout_ms'])
+
+
+async def navigate_async(page, url, options):
+    """Async counterpart of navigate"""
+    await page.goto(url, wait_until=options['wait_until'], timeout=options['timeout_ms'])
+    if options['wait_for_selector']:
+        await page.wait_for_selector(options['wait_for_selector'], timeout=options['timeout_ms'])
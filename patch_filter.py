@@ -0,0 +1,216 @@
+import re
+import posixpath
+from bs4 import BeautifulSoup
+
+# Files rendered as pages when scanned
+PAGE_EXTENSIONS = ('.html', '.htm')
+TEMPLATE_EXTENSIONS = ('.jinja', '.jinja2', '.j2', '.njk', '.hbs', '.mustache', '.twig', '.liquid', '.ejs')
+TEMPLATE_DIRS = ('templates',)
+
+# Files that only matter through the pages that load them
+ASSET_EXTENSIONS = ('.css', '.js')
+
+HTML_COMMENT = re.compile(r'<!--.*?-->', re.S)
+BLOCK_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+LINE_COMMENT = re.compile(r'^\s*//.*$', re.M)
+TEMPLATE_COMMENT = re.compile(r'\{#.*?#\}|\{\{!--.*?--\}\}|\{\{!.*?\}\}', re.S)
+
+# Comment delimiters left after removing complete comments mean a change opens or closes a
+# comment around lines outside it, which comments markup in or out
+PAGE_DELIMITERS = ('<!--', '-->', '{#', '#}', '{{!')
+ASSET_DELIMITERS = ('/*', '*/')
+WHITESPACE = re.compile(r'\s+')
+HUNK_HEADER = re.compile(r'^@@ -(\d+)(?:,\d+)? \+(\d+)(?:,\d+)? @@')
+
+
+class FilePatch:
+    """The patch text and changed lines of one file"""
+
+    def __init__(self, old_path, new_path, text):
+        self.old_path = old_path
+        self.new_path = new_path
+        self.text = text
+        self.added = []
+        self.removed = []
+        # (removed lines, added lines) of each run of consecutive changed lines
+        self.runs = []
+        # Line numbers touched in the new and old file; a pure removal touches the
+        # lines either side of it in the other file
+        self.new_lines = []
+        self.old_lines = []
+        self.binary = False
+
+    @property
+    def path(self):
+        # Same key as compare_commits: the current path, or the old one for deletions
+        return self.new_path or self.old_path
+
+
+def parse_patch(patch_text):
+    """
+    Split the output of a single `git diff` over many files
+    Args:
+        patch_text: Unified diff text
+    Returns: Dict of path to FilePatch
+    """
+    patches = {}
+    for chunk in re.split(r'^(?=diff --git )', patch_text, flags=re.M):
+        if not chunk.startswith('diff --git '):
+            continue
+        lines = chunk.split('\n')
+        old_path, new_path = _header_paths(lines[0])
+        patch = FilePatch(old_path, new_path, chunk.rstrip('\n'))
+
+        in_hunk = False
+        old_number = new_number = 0
+        block = None
+        for line in lines[1:]:
+            if block and not line.startswith(('+', '-')):
+                _close_block(patch, block, old_number, new_number)
+                block = None
+            if line.startswith('@@'):
+                in_hunk = True
+                match = HUNK_HEADER.match(line)
+                if match:
+                    old_number, new_number = int(match.group(1)), int(match.group(2))
+            elif not in_hunk:
+                if line.startswith('--- '):
+                    patch.old_path = _patch_path(line[4:], 'a/')
+                elif line.startswith('+++ '):
+                    patch.new_path = _patch_path(line[4:], 'b/')
+                elif line.startswith('rename from '):
+                    patch.old_path = _unquote(line[len('rename from '):])
+                elif line.startswith('rename to '):
+                    patch.new_path = _unquote(line[len('rename to '):])
+                elif line.startswith('deleted file'):
+                    patch.new_path = None
+                elif line.startswith('new file'):
+                    patch.old_path = None
+                elif line.startswith('Binary files '):
+                    patch.binary = True
+            elif line.startswith('+'):
+                patch.added.append(line[1:])
+                patch.new_lines.append(new_number)
+                new_number += 1
+                block = block or {'added': [], 'removed': []}
+                block['added'].append(line[1:])
+            elif line.startswith('-'):
+                patch.removed.append(line[1:])
+                patch.old_lines.append(old_number)
+                old_number += 1
+                block = block or {'added': [], 'removed': []}
+                block['removed'].append(line[1:])
+            elif line.startswith(' '):
+                old_number += 1
+                new_number += 1
+        if block:
+            _close_block(patch, block, old_number, new_number)
+
+        patches[patch.path] = patch
+    return patches
+
+
+def _close_block(patch, block, old_number, new_number):
+    patch.runs.append((block['removed'], block['added']))
+    # A run of only removed lines marks where they were in the new file, and vice versa
+    if not block['added']:
+        patch.new_lines.extend(number for number in (new_number - 1, new_number) if number > 0)
+    if not block['removed']:
+        patch.old_lines.extend(number for number in (old_number - 1, old_number) if number > 0)
+
+
+def is_page(path):
+    """Whether a path is an HTML page or template that can be scanned"""
+    lower = path.lower()
+    if lower.endswith(PAGE_EXTENSIONS + TEMPLATE_EXTENSIONS):
+        return True
+    # Generic template extensions only count inside a templates directory
+    in_template_dir = any(part in TEMPLATE_DIRS for part in posixpath.dirname(lower).split('/'))
+    return in_template_dir and lower.endswith(('.tpl', '.tmpl', '.xhtml'))
+
+
+def is_asset(path):
+    return path.lower().endswith(ASSET_EXTENSIONS)
+
+
+def is_cosmetic(patch):
+    """
+    Whether a patch only changes whitespace or comments
+    Each run of changed lines is compared on its own, and only comments that open and
+    close inside the run are ignored; a run adding or removing a lone comment delimiter,
+    e.g. commenting markup out, is significant
+    """
+    if patch.binary or patch.old_path is None or patch.new_path is None or not patch.runs:
+        return False
+    for removed, added in patch.runs:
+        old, new = _normalise(removed, patch.path), _normalise(added, patch.path)
+        if old is None or new is None or old != new:
+            return False
+    return True
+
+
+def referenced_assets(html, page_path):
+    """
+    Repository paths of the stylesheets and scripts a page loads
+    Args:
+        html: Page source
+        page_path: Path of the page in the repository
+    Returns: Set of normalised repository paths
+    """
+    soup = BeautifulSoup(html, 'html.parser')
+    references = [link.get('href') for link in soup.find_all('link', href=True)]
+    references += [script.get('src') for script in soup.find_all('script', src=True)]
+
+    base = posixpath.dirname(page_path)
+    paths = set()
+    for reference in references:
+        reference = reference.split('#', 1)[0].split('?', 1)[0]
+        if not reference or re.match(r'^[a-z][a-z0-9+.-]*:|^//', reference, re.I):
+            # External URLs are not part of the repository
+            continue
+        if reference.startswith('/'):
+            path = posixpath.normpath(reference.lstrip('/'))
+        else:
+            path = posixpath.normpath(posixpath.join(base, reference))
+        paths.add(path)
+    return paths
+
+
+def _normalise(lines, path):
+    # Text without complete comments and whitespace runs, or None when a delimiter is left over
+    text = '\n'.join(lines)
+    lower = path.lower()
+    if lower.endswith(ASSET_EXTENSIONS):
+        text = BLOCK_COMMENT.sub('', text)
+        if lower.endswith('.js'):
+            text = LINE_COMMENT.sub('', text)
+        delimiters = ASSET_DELIMITERS
+    else:
+        text = HTML_COMMENT.sub('', text)
+        text = TEMPLATE_COMMENT.sub('', text)
+        delimiters = PAGE_DELIMITERS
+    if any(delimiter in text for delimiter in delimiters):
+        return None
+    return WHITESPACE.sub(' ', text).strip()
+
+
+def _header_paths(header):
+    # "diff --git a/old b/new"; exact for unquoted paths without " b/"
+    match = re.match(r'^diff --git (?:"?a/)(.*?)"? "?b/(.*?)"?$', header)
+    if not match:
+        return None, None
+    return match.group(1), match.group(2)
+
+
+def _patch_path(value, prefix):
+    value = _unquote(value.split('\t', 1)[0])
+    if value == '/dev/null':
+        return None
+    return value[len(prefix):] if value.startswith(prefix) else value
+
+
+def _unquote(value):
+    # git quotes paths with special characters using C-style escapes
+    if len(value) >= 2 and value.startswith('"') and value.endswith('"'):
+        return value[1:-1].encode('latin-1', 'backslashreplace').decode('unicode_escape').encode('latin-1').decode('utf-8', 'replace')
+    return value
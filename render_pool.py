@@ -0,0 +1,242 @@
+import os
+import time
+import atexit
+import logging
+import resource
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from metrics import Gauge, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Address space limit for render worker processes, so a pathological report fails with
+# MemoryError instead of taking the host down; 0 disables
+MEMORY_LIMIT_MB = int(os.getenv('REPORT_MEMORY_LIMIT_MB', 2048))
+
+# Seconds a caller waits for one report before giving up on it
+RENDER_TIMEOUT = float(os.getenv('RENDER_TIMEOUT', 120))
+
+
+class RenderQueueFull(Exception):
+    """Raised when too many renders are already waiting for a worker"""
+
+
+class RenderFuture:
+    """Handle to a submitted render"""
+
+    def __init__(self, future, release, timeout):
+        self._future = future
+        self._release = release
+        self._timeout = timeout
+
+    def done(self):
+        return self._future.done()
+
+    def result(self, timeout=None):
+        """
+        Wait for the render to finish
+        Args:
+            timeout: Seconds to wait, defaults to RENDER_TIMEOUT
+        Returns: Whatever the submitted function returned
+        Raises: TimeoutError, BrokenProcessPool when the worker died, or the exception
+                raised by the function
+        """
+        try:
+            _, _, result = self._future.result(self._timeout if timeout is None else timeout)
+            return result
+        except FuturesTimeoutError:
+            # Nobody waits for it any more; a render that has not started is dropped and
+            # its slot is freed either way, so a hung render cannot fill the queue
+            self._future.cancel()
+            self._release(timed_out=True)
+            raise TimeoutError("Timed out waiting for the PDF render")
+
+
+def limit_memory():
+    """Process initializer applying MEMORY_LIMIT_MB to the current process"""
+    if not MEMORY_LIMIT_MB:
+        return
+    limit = MEMORY_LIMIT_MB * 1024 * 1024
+    try:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    except (ValueError, OSError) as e:
+        logger.warning("Could not limit render worker memory: %s", e)
+
+
+def _run_timed(fn, args, kwargs):
+    # Runs in the worker; wall-clock times are comparable across processes, monotonic ones are not
+    started_at = time.time()
+    result = fn(*args, **kwargs)
+    return started_at, time.time(), result
+
+
+class RenderPool:
+    def __init__(self, size=None, max_tasks_per_child=None, max_pending=None, timeout=None):
+        """
+        Worker processes for CPU-bound PDF rendering, off the request threads
+        Args:
+            size: Number of worker processes
+            max_tasks_per_child: Renders before a worker is replaced, releasing WeasyPrint's memory
+            max_pending: Maximum renders submitted but not finished
+            timeout: Default seconds RenderFuture.result waits
+        """
+        self.size = size or int(os.getenv('RENDER_POOL_SIZE', 2))
+        self.max_tasks_per_child = max_tasks_per_child or int(os.getenv('RENDER_POOL_MAX_TASKS_PER_CHILD', 20))
+        self.max_pending = max_pending or int(os.getenv('RENDER_POOL_QUEUE_SIZE', 50))
+        self.timeout = timeout or RENDER_TIMEOUT
+
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pending = 0
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+        self._timed_out = 0
+        self._restarts = 0
+
+    def _new_executor(self):
+        # Workers fork from a single-threaded server instead of the threaded web process,
+        # so they cannot inherit a lock held by another thread; a worker that dies
+        # breaks the executor instead of leaving its render unresolved
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload(['report_render'])
+        return ProcessPoolExecutor(
+            max_workers=self.size,
+            mp_context=context,
+            initializer=limit_memory,
+            max_tasks_per_child=self.max_tasks_per_child
+        )
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue fn(*args, **kwargs) on a worker process; fn and its arguments must be picklable
+        Returns: A RenderFuture
+        Raises: RenderQueueFull when max_pending renders are unfinished
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise RenderQueueFull("Too many reports are being rendered, try again later")
+            self._pending += 1
+            self._submitted += 1
+
+        submitted_at = time.time()
+        released = threading.Event()
+
+        def release(timed_out=False, failed=False):
+            with self._lock:
+                if released.is_set():
+                    return
+                released.set()
+                self._pending -= 1
+                if timed_out:
+                    self._timed_out += 1
+                elif failed:
+                    self._failed += 1
+                else:
+                    self._completed += 1
+
+        def finished(future):
+            if future.cancelled():
+                release(timed_out=True)
+                return
+            error = future.exception()
+            if error is not None:
+                if isinstance(error, BrokenProcessPool):
+                    self._discard(executor)
+                release(failed=True)
+                return
+            started_at, finished_at, _ = future.result()
+            QUEUE_WAIT_SECONDS.observe(max(started_at - submitted_at, 0))
+            RENDER_SECONDS.observe(finished_at - started_at)
+            release()
+
+        try:
+            executor = self._current_executor()
+            try:
+                future = executor.submit(_run_timed, fn, args, kwargs)
+            except BrokenProcessPool:
+                # Broken by a worker that died since the last render; start over once
+                self._discard(executor)
+                executor = self._current_executor()
+                future = executor.submit(_run_timed, fn, args, kwargs)
+        except Exception:
+            release(failed=True)
+            raise
+        future.add_done_callback(finished)
+        return RenderFuture(future, release, self.timeout)
+
+    def _current_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = self._new_executor()
+            return self._executor
+
+    def _discard(self, executor):
+        # Renders still queued on a broken executor fail with BrokenProcessPool; the next
+        # submit starts a fresh one
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+            self._restarts += 1
+        logger.warning("A render worker died; restarting the render pool")
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def run(self, fn, *args, timeout=None, **kwargs):
+        """Submit fn and wait for its result"""
+        return self.submit(fn, *args, **kwargs).result(timeout)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        """Queue depth and throughput counters"""
+        with self._lock:
+            return {
+                'size': self.size,
+                'max_tasks_per_child': self.max_tasks_per_child,
+                'pending': self._pending,
+                'queued': max(self._pending - self.size, 0),
+                'submitted': self._submitted,
+                'completed': self._completed,
+                'failed': self._failed,
+                'timed_out': self._timed_out,
+                'restarts': self._restarts
+            }
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def get_render_pool():
+    """Return the process-wide render pool, creating it on first use"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        # A forked job worker cannot use its parent's pool and starts its own
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = RenderPool()
+            _pool_pid = os.getpid()
+            atexit.register(_pool.shutdown)
+        return _pool
+
+
+def _pool_stat(name):
+    def read():
+        if _pool is None or _pool_pid != os.getpid():
+            raise LookupError("Render pool not started")
+        return _pool.stats()[name]
+    return read
+
+
+QUEUE_WAIT_SECONDS = Histogram('a11y_render_queue_wait_seconds', 'Time renders wait for a worker process')
+RENDER_SECONDS = Histogram('a11y_render_seconds', 'Time spent rendering in worker processes')
+Gauge('a11y_render_pool_pending', 'Renders submitted and not finished', function=_pool_stat('pending'))
+Gauge('a11y_render_pool_queued', 'Renders waiting for a worker process', function=_pool_stat('queued'))
+Gauge('a11y_render_pool_size', 'Render worker processes', function=_pool_stat('size'))
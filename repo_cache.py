@@ -0,0 +1,152 @@
+import os
+import re
+import time
+import fcntl
+import shutil
+import hashlib
+import tempfile
+import threading
+from contextlib import contextmanager
+from git import Repo, GitCommandError, Git
+from tracing import span
+
+CACHE_DIR = os.getenv('REPO_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'repo-mirrors'))
+MAX_BYTES = int(os.getenv('REPO_CACHE_MAX_BYTES', 5 * 1024 * 1024 * 1024))
+
+# Partial clone needs git 2.22+ on this side; servers without support fall back to a full clone
+PARTIAL_CLONE_FILTER = os.getenv('REPO_CACHE_FILTER', 'blob:none')
+PARTIAL_CLONE_MIN_VERSION = (2, 22)
+
+_repo_locks = {}
+_repo_locks_guard = threading.Lock()
+_last_update = {}
+_git_version = None
+
+
+def mirror_path(repo_url):
+    """Directory of the bare mirror for repo_url"""
+    key = hashlib.sha256(repo_url.encode('utf-8')).hexdigest()[:24]
+    return os.path.join(CACHE_DIR, f'{key}.git')
+
+
+@contextmanager
+def open_mirror(repo_url):
+    """
+    Open an up-to-date bare mirror of repo_url, cloning it on first use
+    The mirror is shared-locked while in use so it cannot be evicted from under a reader
+    Yields: A GitPython Repo without a working tree
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = mirror_path(repo_url)
+    requested_at = time.monotonic()
+
+    with open(path + '.lock', 'a') as use_lock:
+        fcntl.flock(use_lock, fcntl.LOCK_SH)
+        try:
+            # Threads share one clone/fetch per repo, processes are serialised by the update lock
+            with _thread_lock(path), open(path + '.update', 'a') as update_lock:
+                fcntl.flock(update_lock, fcntl.LOCK_EX)
+                if _last_update.get(path, 0) > requested_at and os.path.isdir(path):
+                    # Another request fetched while this one waited
+                    repo = Repo(path)
+                else:
+                    with span('git_fetch'):
+                        repo = _update_mirror(repo_url, path)
+                    _last_update[path] = time.monotonic()
+
+            try:
+                yield repo
+            finally:
+                repo.close()
+                os.utime(path + '.lock')
+        finally:
+            fcntl.flock(use_lock, fcntl.LOCK_UN)
+
+    evict(keep=path)
+
+
+def evict(max_bytes=None, keep=None):
+    """
+    Remove least recently used mirrors until the cache fits in max_bytes
+    Mirrors in use, and the mirror at keep, are skipped
+    """
+    max_bytes = max_bytes or MAX_BYTES
+    if not os.path.isdir(CACHE_DIR):
+        return
+
+    mirrors = []
+    for name in os.listdir(CACHE_DIR):
+        path = os.path.join(CACHE_DIR, name)
+        if name.endswith('.git') and os.path.isdir(path) and path != keep:
+            lock_path = path + '.lock'
+            last_used = os.path.getmtime(lock_path) if os.path.exists(lock_path) else 0
+            mirrors.append((last_used, path, _disk_usage(path)))
+
+    total = sum(size for _, _, size in mirrors)
+    for _, path, size in sorted(mirrors):
+        if total <= max_bytes:
+            break
+        with open(path + '.lock', 'a') as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue
+            try:
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _update_mirror(repo_url, path):
+    if os.path.isdir(path):
+        repo = Repo(path)
+        try:
+            # Incremental: only new objects are transferred
+            repo.git.fetch('origin', '--prune', '--tags')
+            return repo
+        except GitCommandError:
+            # A broken mirror is cheaper to re-clone than to repair
+            repo.close()
+            shutil.rmtree(path, ignore_errors=True)
+
+    options = ['--mirror']
+    if PARTIAL_CLONE_FILTER and _git_version_tuple() >= PARTIAL_CLONE_MIN_VERSION:
+        options.append(f'--filter={PARTIAL_CLONE_FILTER}')
+
+    partial_path = path + '.partial'
+    shutil.rmtree(partial_path, ignore_errors=True)
+    try:
+        Repo.clone_from(repo_url, partial_path, multi_options=options)
+        os.rename(partial_path, path)
+    except Exception:
+        shutil.rmtree(partial_path, ignore_errors=True)
+        raise
+    return Repo(path)
+
+
+@contextmanager
+def _thread_lock(path):
+    with _repo_locks_guard:
+        lock = _repo_locks.setdefault(path, threading.Lock())
+    with lock:
+        yield
+
+
+def _git_version_tuple():
+    global _git_version
+    if _git_version is None:
+        match = re.search(r'(\d+)\.(\d+)', Git().version())
+        _git_version = (int(match.group(1)), int(match.group(2))) if match else (0, 0)
+    return _git_version
+
+
+def _disk_usage(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
@@ -0,0 +1,203 @@
+import os
+import time
+import uuid
+import logging
+import tempfile
+import threading
+from datetime import datetime
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from images import IMAGE_REF, image_src, mimetype
+from tracing import span
+from render_pool import RENDER_TIMEOUT, get_render_pool
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+
+# Reports with more violations are rendered in chunks of this size in parallel and merged; 0 disables
+CHUNK_VIOLATIONS = int(os.getenv('REPORT_CHUNK_VIOLATIONS', 200))
+
+# Screenshot bytes one report may embed; later screenshots are left out
+MAX_IMAGE_BYTES = int(os.getenv('REPORT_MAX_IMAGE_BYTES', 256 * 1024 * 1024))
+
+# Smallest transparent GIF, served in place of images over the budget
+PLACEHOLDER_IMAGE = b'GIF89a\x01\x00\x01\x00\x00\x00\x00!\xf9\x04\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x00;'
+
+_environment = Environment(loader=FileSystemLoader(TEMPLATE_DIR), autoescape=select_autoescape(['html']))
+
+
+def iter_report_html(url, results, screenshots, overview=None, image_url=None,
+                     first_number=1, issue_count=None, title_page=True, numbered=None):
+    """
+    Stream report HTML for scan results
+    Args:
+        image_url: Maps a stored image ID to a URL, for viewing in a browser (optional)
+        first_number: Number of the first violation, for reports rendered in chunks
+        issue_count: Total number of violations shown on the title page (optional)
+        title_page: Include the title page and the annotated overview
+        numbered: Number issues to match the overview markers; defaults to whether
+                  there is an overview, chunks pass it for the whole report
+    Yields: HTML fragments
+    """
+    violations = results.get('violations', [])
+    screenshots = _within_budget(screenshots)
+    issues = (
+        (first_number + i, violation, screenshots[i] if i < len(screenshots) else None)
+        for i, violation in enumerate(violations)
+    )
+    return _environment.get_template('report.html').generate(
+        url=url,
+        generated=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        issue_count=len(violations) if issue_count is None else issue_count,
+        crawl=results.get('crawl'),
+        overview=overview,
+        numbered=bool(overview) if numbered is None else numbered,
+        title_page=title_page,
+        issues=issues,
+        image_src=lambda image: image_src(image, image_url)
+    )
+
+
+def generate_report_html(url, results, screenshots, overview=None, image_url=None):
+    """Report HTML for scan results, see iter_report_html"""
+    return ''.join(iter_report_html(url, results, screenshots, overview, image_url))
+
+
+def write_report_pdf(url, results, screenshots, overview=None, load_image=None, timeout=None):
+    """
+    Render scan results to a PDF in the render pool and wait for it
+    Args:
+        load_image: Returns the bytes of a stored image by ID, for screenshots referenced
+                    rather than inlined; must be picklable (optional)
+        timeout: Seconds to wait for the render, defaults to RENDER_TIMEOUT
+    Returns: Path to the generated PDF
+    """
+    return submit_report_pdf(url, results, screenshots, overview, load_image).result(timeout)
+
+
+def submit_report_pdf(url, results, screenshots, overview=None, load_image=None):
+    """
+    Queue scan results for rendering in the render pool without waiting
+    Large reports are split into chunks rendered in parallel and merged
+    Returns: A future whose result() is the path to the generated PDF
+    Raises: RenderQueueFull when the pool has too many renders waiting
+    """
+    report_path = _temp_pdf_path()
+    violations = results.get('violations', [])
+    if CHUNK_VIOLATIONS and len(violations) > CHUNK_VIOLATIONS:
+        return _ChunkedReport(report_path, url, results, screenshots, overview, load_image)
+    return get_render_pool().submit(render_pdf, report_path, url, results, screenshots, overview, load_image)
+
+
+def render_pdf(report_path, url, results, screenshots, overview=None, load_image=None,
+               first_number=1, issue_count=None, title_page=True, numbered=None):
+    """Render one report, or one chunk of a report, to report_path"""
+    # Imported here so scanning and HTML reports do not load WeasyPrint's native libraries
+    from weasyprint import HTML
+
+    with span('report_html'):
+        # WeasyPrint parses a complete document, so the stream is joined once here
+        report_html = ''.join(iter_report_html(
+            url, results, screenshots, overview,
+            first_number=first_number, issue_count=issue_count, title_page=title_page, numbered=numbered
+        ))
+    with span('pdf_render'):
+        HTML(string=report_html, url_fetcher=_url_fetcher(load_image)).write_pdf(report_path)
+    return report_path
+
+
+class _ChunkedReport:
+    """Chunks of one report rendered in the pool, merged when the result is awaited"""
+
+    def __init__(self, report_path, url, results, screenshots, overview, load_image):
+        self.report_path = report_path
+        self.url = url
+        self.violations = results.get('violations', [])
+        self.chunk_paths = []
+        self.futures = []
+
+        pool = get_render_pool()
+        try:
+            for start in range(0, len(self.violations), CHUNK_VIOLATIONS):
+                stop = start + CHUNK_VIOLATIONS
+                chunk_results = {'violations': self.violations[start:stop], 'crawl': results.get('crawl')}
+                self.chunk_paths.append(_temp_pdf_path())
+                self.futures.append(pool.submit(
+                    render_pdf, self.chunk_paths[-1], url, chunk_results, screenshots[start:stop],
+                    overview if start == 0 else None, load_image,
+                    start + 1, len(self.violations), start == 0, bool(overview)
+                ))
+        except Exception:
+            self._clean_up()
+            raise
+
+    def done(self):
+        return all(future.done() for future in self.futures)
+
+    def result(self, timeout=None):
+        from pypdf import PdfWriter
+
+        # The timeout covers the whole report, not each chunk
+        deadline = time.monotonic() + (RENDER_TIMEOUT if timeout is None else timeout)
+        try:
+            for future in self.futures:
+                future.result(max(deadline - time.monotonic(), 0))
+            with span('pdf_merge'):
+                writer = PdfWriter()
+                for path in self.chunk_paths:
+                    writer.append(path)
+                with open(self.report_path, 'wb') as f:
+                    writer.write(f)
+            logger.info("Rendered %s violations for %s in %s chunks", len(self.violations), self.url, len(self.futures))
+            return self.report_path
+        finally:
+            if self.done():
+                self._clean_up()
+            else:
+                # Timed out: chunks still rendering would recreate their files after removal
+                threading.Thread(target=self._clean_up, name='chunk-cleanup', daemon=True).start()
+
+    def _clean_up(self):
+        for future in self.futures:
+            try:
+                future.result()
+            except Exception:
+                pass
+        for path in self.chunk_paths:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _within_budget(screenshots):
+    # Inline screenshots beyond MAX_IMAGE_BYTES are replaced with a note
+    total = 0
+    kept = []
+    for screenshot in screenshots:
+        if screenshot and not screenshot['data'].startswith(IMAGE_REF):
+            total += len(screenshot['data']) * 3 // 4
+            if total > MAX_IMAGE_BYTES:
+                screenshot = dict(screenshot, data=None, omitted=True)
+        kept.append(screenshot)
+    return kept
+
+
+def _url_fetcher(load_image):
+    from weasyprint import default_url_fetcher
+
+    loaded = [0]
+
+    def fetch(resource_url):
+        # WeasyPrint fetches each URL once, so an image shared by several issues is loaded once
+        if resource_url.startswith(IMAGE_REF) and load_image:
+            if loaded[0] > MAX_IMAGE_BYTES:
+                return {'string': PLACEHOLDER_IMAGE, 'mime_type': 'image/gif'}
+            data = load_image(resource_url[len(IMAGE_REF):])
+            loaded[0] += len(data)
+            return {'string': data, 'mime_type': mimetype(data)}
+        return default_url_fetcher(resource_url)
+
+    return fetch
+
+
+def _temp_pdf_path():
+    return os.path.join(tempfile.gettempdir(), f'report_{datetime.now().strftime("%Y%m%d_%H%M%S")}_{uuid.uuid4().hex[:8]}.pdf')
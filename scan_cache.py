@@ -0,0 +1,254 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+DEFAULT_TTL = int(os.getenv('SCAN_CACHE_TTL', 24 * 60 * 60))
+DEFAULT_MAX_ENTRIES = int(os.getenv('SCAN_CACHE_MAX_ENTRIES', 500))
+DEFAULT_MAX_BYTES = int(os.getenv('SCAN_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+
+# Mongo documents are limited to 16MB
+MONGO_MAX_DOCUMENT_BYTES = 15 * 1024 * 1024
+
+_axe_hash = None
+
+
+def axe_hash():
+    """SHA-256 of the bundled axe.min.js, so upgrading axe invalidates the cache"""
+    global _axe_hash
+    if _axe_hash is None:
+        axe_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'axe.min.js')
+        with open(axe_path, 'rb') as f:
+            _axe_hash = hashlib.sha256(f.read()).hexdigest()
+    return _axe_hash
+
+
+def hash_content(content):
+    """SHA-256 of a serialised DOM"""
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return hashlib.sha256(content).hexdigest()
+
+
+def make_key(content_hash, options=None):
+    """
+    Cache key for a scan
+    Args:
+        content_hash: Hash of the serialised DOM, or the git blob SHA
+        options: Run options that change the output
+    """
+    payload = json.dumps({
+        'content': content_hash,
+        'axe': axe_hash(),
+        'options': options or {}
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class MemoryCache:
+    """
+    In-process LRU tier
+    Keeps the axe results and the screenshots, so a hit skips all browser work
+    """
+
+    name = 'memory'
+
+    def __init__(self, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and time.monotonic() - entry['stored_at'] > self.ttl:
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return {
+                'results': entry['results'],
+                'screenshots': entry['screenshots'],
+                'overview': entry['overview']
+            }
+
+    def put(self, key, results, screenshots=None, overview=None):
+        size = len(json.dumps(results)) + len(overview or '')
+        size += sum(len(screenshot['data']) for screenshot in screenshots or [] if screenshot)
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {
+                'results': results,
+                'screenshots': screenshots,
+                'overview': overview,
+                'size': size,
+                'stored_at': time.monotonic()
+            }
+            self._bytes += size
+
+            # Evict least recently used entries until within budget
+            while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry['size']
+
+
+class MongoCache:
+    """
+    Shared tier in the scan_cache collection
+    Only the axe results are kept here, so a hit skips axe.run but still takes screenshots
+    """
+
+    name = 'mongo'
+
+    def __init__(self, db, ttl=DEFAULT_TTL, max_entries=None):
+        self.ttl = ttl
+        self.max_entries = max_entries or int(os.getenv('SCAN_CACHE_MONGO_MAX_ENTRIES', 10000))
+        self.cache = db['scan_cache']
+        # Mongo removes expired entries itself
+        self.cache.create_index('expires_at', expireAfterSeconds=0)
+        self.cache.create_index('last_used')
+
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        doc = self.cache.find_one_and_update(
+            {'_id': key, 'expires_at': {'$gt': datetime.now()}},
+            {'$set': {'last_used': datetime.now()}}
+        )
+        with self._lock:
+            if doc is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return {'results': json.loads(doc['results']), 'screenshots': None, 'overview': None}
+
+    def put(self, key, results, screenshots=None, overview=None):
+        serialised = json.dumps(results)
+        if len(serialised) > MONGO_MAX_DOCUMENT_BYTES:
+            return
+
+        now = datetime.now()
+        self.cache.replace_one({'_id': key}, {
+            'results': serialised,
+            'size': len(serialised),
+            'last_used': now,
+            'expires_at': now + timedelta(seconds=self.ttl)
+        }, upsert=True)
+
+        # Evict least recently used entries beyond the size budget
+        excess = self.cache.estimated_document_count() - self.max_entries
+        if excess > 0:
+            stale = [doc['_id'] for doc in self.cache.find({}, {'_id': 1}).sort('last_used', 1).limit(excess)]
+            result = self.cache.delete_many({'_id': {'$in': stale}})
+            with self._lock:
+                self.evictions += result.deleted_count
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+
+class ScanCache:
+    def __init__(self, tiers):
+        """
+        Tiered scan result cache, checked in order
+        Args:
+            tiers: List of MemoryCache/MongoCache instances, fastest first
+        """
+        self.tiers = tiers
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Look up a scan
+        Returns: Dict with 'results', 'screenshots' and 'overview', or None on a miss.
+                 'screenshots' is None when only the results were cached.
+        """
+        for i, tier in enumerate(self.tiers):
+            entry = tier.get(key)
+            if entry is None:
+                continue
+
+            # Promote to the faster tiers
+            for faster in self.tiers[:i]:
+                faster.put(key, entry['results'], entry['screenshots'], entry['overview'])
+
+            with self._lock:
+                self.hits += 1
+            return entry
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, results, screenshots=None, overview=None):
+        for tier in self.tiers:
+            tier.put(key, results, screenshots, overview)
+
+    def stats(self):
+        with self._lock:
+            stats = {'hits': self.hits, 'misses': self.misses}
+        stats['tiers'] = {tier.name: tier.stats() for tier in self.tiers}
+        return stats
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_scan_cache():
+    """
+    Return the process-wide scan cache, creating it on first use
+    SCAN_CACHE_BACKENDS selects the tiers, e.g. 'memory,mongo'; 'none' disables caching
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            backends = [b.strip() for b in os.getenv('SCAN_CACHE_BACKENDS', 'memory').split(',') if b.strip()]
+            tiers = []
+            if 'memory' in backends:
+                tiers.append(MemoryCache())
+            if 'mongo' in backends:
+                from database import Database
+                tiers.append(MongoCache(Database().db))
+            _cache = ScanCache(tiers)
+        return _cache
@@ -0,0 +1,43 @@
+import requests
+import xml.etree.ElementTree as ET
+
+SITEMAP_NS = '{http://www.sitemaps.org/schemas/sitemap/0.9}'
+
+
+def fetch_sitemap_urls(sitemap_url, limit=None, timeout=10):
+    """
+    Collect page URLs from a sitemap.xml, following sitemap indexes
+    Args:
+        sitemap_url: URL of the sitemap
+        limit: Maximum number of URLs to return (optional)
+        timeout: Request timeout in seconds
+    Returns: List of page URLs in sitemap order
+    """
+    urls = []
+    pending = [sitemap_url]
+    visited = set()
+
+    while pending and (limit is None or len(urls) < limit):
+        current = pending.pop(0)
+        if current in visited:
+            continue
+        visited.add(current)
+
+        response = requests.get(current, timeout=timeout)
+        response.raise_for_status()
+        root = ET.fromstring(response.content)
+
+        if root.tag == f'{SITEMAP_NS}sitemapindex':
+            pending.extend(_locations(root, 'sitemap'))
+        else:
+            urls.extend(_locations(root, 'url'))
+
+    return urls[:limit] if limit is not None else urls
+
+
+def _locations(root, element):
+    return [
+        loc.text.strip()
+        for loc in root.findall(f'{SITEMAP_NS}{element}/{SITEMAP_NS}loc')
+        if loc.text
+    ]
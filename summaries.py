@@ -0,0 +1,21 @@
+# axe impact levels, most severe first
+IMPACTS = ('critical', 'serious', 'moderate', 'minor')
+
+
+def summarize_results(results):
+    """
+    Violation counts of axe results
+    Returns: Dict with the number of violated rules, violating nodes, and nodes by impact and by rule id
+    """
+    by_impact = dict.fromkeys(IMPACTS + ('unknown',), 0)
+    by_rule = {}
+    nodes = 0
+    violations = results.get('violations', [])
+    for violation in violations:
+        count = len(violation.get('nodes', [])) or 1
+        impact = violation.get('impact') if violation.get('impact') in IMPACTS else 'unknown'
+        rule = violation.get('id') or 'unknown'
+        by_impact[impact] += count
+        by_rule[rule] = by_rule.get(rule, 0) + count
+        nodes += count
+    return {'violations': len(violations), 'nodes': nodes, 'by_impact': by_impact, 'by_rule': by_rule}
@@ -0,0 +1,69 @@
+from patch_filter import parse_patch, is_cosmetic
+
+
+def _patch(path, body):
+    text = (
+        f'diff --git a/{path} b/{path}\n'
+        f'--- a/{path}\n'
+        f'+++ b/{path}\n'
+        f'{body}'
+    )
+    return parse_patch(text)[path]
+
+
+def test_whitespace_change_is_cosmetic():
+    patch = _patch('index.html', (
+        '@@ -1,3 +1,3 @@\n'
+        ' <main>\n'
+        '-<p>Hello</p>\n'
+        '+    <p>Hello</p>\n'
+        ' </main>\n'
+    ))
+    assert is_cosmetic(patch)
+
+
+def test_complete_comment_is_cosmetic():
+    patch = _patch('index.html', (
+        '@@ -1,2 +1,3 @@\n'
+        ' <main>\n'
+        '+<!-- greeting -->\n'
+        ' </main>\n'
+    ))
+    assert is_cosmetic(patch)
+
+
+def test_commenting_out_markup_is_significant():
+    patch = _patch('index.html', (
+        '@@ -1,4 +1,6 @@\n'
+        ' <main>\n'
+        '+<!--\n'
+        ' <p>Hello</p>\n'
+        ' <img src="logo.png">\n'
+        '+-->\n'
+        ' </main>\n'
+    ))
+    assert not is_cosmetic(patch)
+
+
+def test_uncommenting_markup_is_significant():
+    patch = _patch('index.html', (
+        '@@ -1,6 +1,4 @@\n'
+        ' <main>\n'
+        '-<!--\n'
+        ' <p>Hello</p>\n'
+        ' <img src="logo.png">\n'
+        '--->\n'
+        ' </main>\n'
+    ))
+    assert not is_cosmetic(patch)
+
+
+def test_commenting_out_css_is_significant():
+    patch = _patch('site.css', (
+        '@@ -1,3 +1,5 @@\n'
+        '+/*\n'
+        ' a { color: #777; }\n'
+        '+*/\n'
+        ' body { margin: 0; }\n'
+    ))
+    assert not is_cosmetic(patch)
@@ -0,0 +1,52 @@
+import time
+import logging
+import functools
+import contextvars
+from contextlib import contextmanager
+from metrics import PHASE_SECONDS, PHASE_ERRORS
+
+logger = logging.getLogger(__name__)
+
+# Names of the open spans; a context variable so each thread and asyncio task has its own
+_current_path = contextvars.ContextVar('span_path', default=())
+
+
+class Span:
+    def __init__(self, name, path):
+        self.name = name
+        self.path = path
+        self.seconds = None
+
+
+@contextmanager
+def span(name):
+    """
+    Time a phase, recording it in the a11y_phase_seconds histogram
+    Nested spans are logged at debug level with their parents, e.g. "scan_page/axe"
+    Yields: A Span whose seconds are set when the block exits
+    """
+    path = _current_path.get() + (name,)
+    token = _current_path.set(path)
+    current = Span(name, path)
+    started = time.perf_counter()
+    try:
+        yield current
+    except BaseException:
+        PHASE_ERRORS.inc(phase=name)
+        raise
+    finally:
+        current.seconds = time.perf_counter() - started
+        _current_path.reset(token)
+        PHASE_SECONDS.observe(current.seconds, phase=name)
+        logger.debug("span %s took %.3fs", '/'.join(path), current.seconds)
+
+
+def traced(name):
+    """Decorator wrapping every call of a function in a span"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator